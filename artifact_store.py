@@ -0,0 +1,303 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import wait as wait_futures
+from contextlib import contextmanager
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+# Written last; an entry without it is still being generated (or was abandoned)
+RESULT_FILE = "result.json"
+# flock()ed by whichever process is generating or evicting the entry
+LOCK_FILE = ".lock"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Files of an entry that is not committed yet may still change or disappear
+UNCOMMITTED_CACHE_CONTROL = "no-store"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    sha256 of a file's bytes, read in chunks; for a directory, of its files' names and
+    digests. An open binary file is hashed from the start and rewound afterwards.
+    """
+    digest = hashlib.sha256()
+    if hasattr(path, "read"):
+        path.seek(0)
+        for chunk in iter(lambda: path.read(chunk_size), b""):
+            digest.update(chunk)
+        path.seek(0)
+        return digest.hexdigest()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode() + file_digest(file_path).encode())
+        return digest.hexdigest()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def artifact_key(content_digest, **params):
+    """Key for one study under one pipeline configuration (models, TTA, ...)"""
+    payload = json.dumps({"content": content_digest, **params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def json_default(value):
+    """json.dump default for the numpy arrays and scalars in metrics / contours"""
+    return value.tolist() if hasattr(value, "tolist") else str(value)
+
+
+def _directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ArtifactEntry:
+    """One study's artifact directory, held under its key lock while it is generated"""
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.directory = os.path.join(store.root, key)
+        self.deferred = False
+        self._lock_fd = None
+
+    def result(self):
+        """The stored pipeline result, or None when this study has not been generated yet"""
+        path = os.path.join(self.directory, RESULT_FILE)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.store.touch(self.key)
+        return result
+
+    def commit(self, result, pending=()):
+        """
+        Record the pipeline result; the entry is then served to identical re-uploads.
+
+        `pending` are futures of files still being written into the entry. The
+        commit then waits for them on a background thread, keeping the entry
+        locked, and `result` may be a callable evaluated only after they finish.
+        If any of them fails the entry is discarded instead.
+        """
+        pending = list(pending)
+        if all(future.done() for future in pending):
+            self._finish(result, pending)
+            return
+        self.deferred = True
+        threading.Thread(target=self._commit_when_done, args=(result, pending),
+                         name=f"artifact-commit-{self.key[:8]}", daemon=True).start()
+
+    def _finish(self, result, pending):
+        failed = [future.exception() for future in pending if future.exception() is not None]
+        try:
+            if failed:
+                raise failed[0]
+            result = result() if callable(result) else result
+            tmp_path = os.path.join(self.directory, RESULT_FILE + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(result, f, default=json_default)
+            os.replace(tmp_path, os.path.join(self.directory, RESULT_FILE))
+        except Exception as e:
+            # Nothing half-written is ever served as a committed entry
+            print(f"❌ Discarding artifacts for study {self.key}: {e}")
+            shutil.rmtree(self.directory, ignore_errors=True)
+            return
+        self.store.touch(self.key)
+
+    def _commit_when_done(self, result, pending):
+        try:
+            wait_futures(pending)
+            self._finish(result, pending)
+        finally:
+            self.store.release(self._lock_fd)
+
+
+class ArtifactStore:
+    """
+    Content-addressed, size-bounded store for per-study artifacts (meshes,
+    LOD manifests, viewer files) under `root`, one directory per key.
+
+    Entries are never modified once committed, so they are served with
+    strong ETags and immutable cache headers. Least recently used entries
+    are evicted once the store exceeds `max_bytes`. All state lives on
+    disk, so several worker processes can share one store: recency is the
+    result file's mtime, and an entry is locked with flock() on its lock
+    file while it is generated or evicted, so no process removes an entry
+    another one is still writing.
+    """
+
+    def __init__(self, root, max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._sweeper = None
+        self._stop = threading.Event()
+        os.makedirs(root, exist_ok=True)
+
+    def touch(self, key):
+        try:
+            os.utime(os.path.join(self.root, key, RESULT_FILE))
+        except OSError:
+            pass
+
+    def is_committed(self, key):
+        return os.path.exists(os.path.join(self.root, key, RESULT_FILE))
+
+    def lock(self, key, blocking=True):
+        """
+        flock() the entry's lock file, creating the entry when blocking; returns the
+        descriptor, or None when non-blocking and the entry is in use or gone
+        """
+        directory = os.path.join(self.root, key)
+        path = os.path.join(directory, LOCK_FILE)
+        while True:
+            if blocking:
+                os.makedirs(directory, exist_ok=True)
+            try:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            except FileNotFoundError:
+                if not blocking:
+                    return None
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                os.close(fd)
+                return None
+            # The entry may have been evicted while we waited; then lock its replacement
+            try:
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+            if not blocking:
+                return None
+
+    def release(self, fd):
+        os.close(fd)
+
+    @contextmanager
+    def entry(self, key):
+        """
+        Exclusive access to one key, across threads and processes: concurrent
+        uploads of the same study wait here, then find the first one's
+        committed result. A deferred commit keeps the lock until it is written.
+        """
+        fd = self.lock(key)
+        entry = ArtifactEntry(self, key)
+        entry._lock_fd = fd
+        try:
+            yield entry
+        finally:
+            if not entry.deferred:
+                self.release(fd)
+
+    def sweep(self):
+        """Evict least recently used entries until the store fits in max_bytes"""
+        sizes, committed, uncommitted = {}, [], []
+        for key in os.listdir(self.root):
+            directory = os.path.join(self.root, key)
+            if not os.path.isdir(directory):
+                continue
+            sizes[key] = _directory_bytes(directory)
+            try:
+                committed.append((os.path.getmtime(os.path.join(directory, RESULT_FILE)), key))
+            except OSError:
+                uncommitted.append(key)
+        total = sum(sizes.values())
+
+        # Abandoned directories (no result, nobody holding the lock) go first, then LRU order
+        evicted = []
+        for key in uncommitted + [key for _, key in sorted(committed)]:
+            if total <= self.max_bytes and key not in uncommitted:
+                break
+            fd = self.lock(key, blocking=False)
+            if fd is None:
+                continue
+            try:
+                shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            finally:
+                self.release(fd)
+            total -= sizes[key]
+            evicted.append(key)
+        if evicted:
+            print(f"🧹 Evicted {len(evicted)} artifact entries, {total / 1e6:.1f} MB in store")
+        evicted_committed = len(set(evicted) - set(uncommitted))
+        return {"evicted": evicted, "bytes": total, "entries": len(committed) - evicted_committed}
+
+    def start_sweeper(self, interval_s=60.0):
+        """Sweep periodically on a daemon thread"""
+        def run():
+            while not self._stop.wait(interval_s):
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"⚠️  Artifact sweep failed: {e}")
+
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=run, name="artifact-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+
+
+def immutable_file_response(store, key, filename, request_headers, stat_result=None, status_code=200,
+                            media_type=None):
+    """
+    FileResponse for a store file with a strong ETag (key + file name) and an
+    immutable Cache-Control, or a 304 when the client already has it. Files of
+    an entry that is not committed yet are served uncached and without an ETag.
+    """
+    if not store.is_committed(key):
+        return FileResponse(os.path.join(store.root, key, filename), status_code=status_code,
+                            stat_result=stat_result, headers={"cache-control": UNCOMMITTED_CACHE_CONTROL},
+                            media_type=media_type)
+    etag = f'"{key}-{filename}"'
+    headers = {"etag": etag, "cache-control": IMMUTABLE_CACHE_CONTROL}
+    response = FileResponse(os.path.join(store.root, key, filename), status_code=status_code,
+                            stat_result=stat_result, headers=headers, media_type=media_type)
+    if_none_match = request_headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return NotModifiedResponse(response.headers)
+    store.touch(key)
+    return response
+
+
+class ArtifactStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves a store's entries with a strong, content-based
+    ETag and a one-year immutable Cache-Control; other files are unchanged.
+    """
+
+    def __init__(self, *args, store=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.store = store
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        relative = os.path.relpath(os.path.realpath(full_path), os.path.realpath(self.store.root)) \
+            if self.store else os.pardir
+        if relative.startswith(os.pardir):
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        key = relative.split(os.sep)[0]
+        return immutable_file_response(self.store, key, relative.replace(os.sep, "/")[len(key) + 1:],
+                                       Headers(scope=scope), stat_result=stat_result, status_code=status_code)
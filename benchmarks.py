@@ -0,0 +1,901 @@
+"""
+Benchmarks for the NeuroVision inference pipeline.
+
+Every case runs in a fresh process so peak RSS numbers are not polluted by
+earlier cases. Usage:
+
+    python benchmarks.py sliding-window --shapes 256x256x256 512x512x200
+    python benchmarks.py micro-batching --clients 8 --batch-sizes 1 4 8
+    python benchmarks.py backends
+    python benchmarks.py weights-memory
+    python benchmarks.py precision --tolerance 0.98
+    python benchmarks.py preprocessing --shapes 256x256x256 512x512x200
+    python benchmarks.py tta --views 1 2 4 8
+    python benchmarks.py region-stats --shapes 256x256x256 512x512x200
+    python benchmarks.py brain-template --shapes 128x128x64 512x512x200
+    python benchmarks.py viewer --shapes 128x128x64 256x256x256
+    python benchmarks.py contours --shapes 256x256x256 512x512x200
+    python benchmarks.py dicom-series --slices 300 --size 512
+    python benchmarks.py nifti --shapes 256x256x256 512x512x200
+    python benchmarks.py load --clients 4 --requests 2
+    python benchmarks.py cases --existing 1000 10000
+"""
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_SHAPES = ["256x256x256", "512x512x200"]
+
+
+def parse_shape(text):
+    return tuple(int(s) for s in text.lower().split("x"))
+
+
+def synthetic_volume(shape, seed=0):
+    """Noisy float32 volume with a bright ellipsoid standing in for a lesion"""
+    rng = np.random.default_rng(seed)
+    volume = rng.normal(0.5, 0.15, shape).astype(np.float32)
+    center = [s // 2 for s in shape]
+    z, y, x = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    lesion = ((z - center[0]) / (shape[0] * 0.1)) ** 2 + \
+             ((y - center[1]) / (shape[1] * 0.08)) ** 2 + \
+             ((x - center[2]) / (shape[2] * 0.06)) ** 2 <= 1
+    volume[lesion] += 0.4
+    return volume
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB (Linux reports KB)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return peak_rss_mb()
+
+
+def reset_peak_rss():
+    """Reset the kernel's RSS high-water mark (Linux only) so the next peak is measured from here"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def run_isolated(fn, *args):
+    """Run `fn(*args)` in a fresh spawned process and return its result"""
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def print_table(rows, columns):
+    widths = [max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row.get(c, "")).ljust(w) for c, w in zip(columns, widths)))
+
+
+# --- Sliding-window vs resize -------------------------------------------------
+
+def _segment_case(shape, mode, roi_size, overlap, max_patches):
+    from monai_segmentor import MonaiLocalSegmentor
+
+    segmentor = MonaiLocalSegmentor(inference_mode=mode, roi_size=roi_size,
+                                    overlap=overlap, max_patches=max_patches)
+    volume = synthetic_volume(shape)
+    baseline_mb = peak_rss_mb()
+
+    start = time.perf_counter()
+    segmentation, _ = segmentor.segment_brain_tumor(volume)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "shape": "x".join(map(str, shape)),
+        "mode": mode,
+        "seconds": round(elapsed, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "inference_rss_mb": round(peak_rss_mb() - baseline_mb, 1),
+        "output_shape": "x".join(map(str, segmentation.shape)) if segmentation is not None else "failed",
+    }
+
+
+def bench_sliding_window(args):
+    rows = []
+    for shape in map(parse_shape, args.shapes):
+        for mode in ("resize", "sliding_window"):
+            rows.append(run_isolated(_segment_case, shape, mode, parse_shape(args.roi),
+                                     args.overlap, args.max_patches))
+    print_table(rows, ["shape", "mode", "seconds", "peak_rss_mb", "inference_rss_mb", "output_shape"])
+
+
+# --- Cross-request micro-batching ---------------------------------------------
+
+def _micro_batch_case(max_batch_size, max_wait_ms, clients, requests_per_client):
+    from monai_segmentor import MonaiLocalSegmentor
+
+    segmentor = MonaiLocalSegmentor(max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    volumes = [synthetic_volume((128, 128, 64), seed=i) for i in range(clients)]
+    segmentor.segment_brain_tumor(volumes[0])  # warmup
+
+    def client(i):
+        latencies = []
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            segmentor.segment_brain_tumor(volumes[i])
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        latencies = sorted(l for ls in pool.map(client, range(clients)) for l in ls)
+    elapsed = time.perf_counter() - start
+
+    row = {
+        "max_batch": max_batch_size,
+        "clients": clients,
+        "studies_per_s": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000),
+    }
+    if segmentor.scheduler is not None:
+        stats = segmentor.scheduler.stats()
+        row["batch_sizes"] = stats["batch_size_histogram"]
+        row["queue_depths"] = stats["queue_depth_histogram"]
+    return row
+
+
+def bench_micro_batching(args):
+    rows = [run_isolated(_micro_batch_case, size, args.max_wait_ms, args.clients, args.requests)
+            for size in args.batch_sizes]
+    print_table(rows, ["max_batch", "clients", "studies_per_s", "p50_ms", "p99_ms",
+                       "batch_sizes", "queue_depths"])
+
+
+# --- Eager vs TorchScript vs ONNX Runtime ---------------------------------------
+
+def _backends_case(input_shape, repeats):
+    from monai_segmentor import MonaiLocalSegmentor
+    from inference_backends import compare_backends
+
+    segmentor = MonaiLocalSegmentor()
+    return compare_backends(segmentor.model, segmentor.weights_path, input_shape, repeats)
+
+
+def bench_backends(args):
+    rows = run_isolated(_backends_case, (1, 1) + parse_shape(args.shape), args.repeats)
+    print_table(rows, ["backend", "available", "median_ms", "min_ms", "max_abs_diff",
+                       "argmax_agreement", "parity_ok"])
+
+
+# --- Private vs page-cache-backed weights per backend ---------------------------
+
+def _rss_kb():
+    with open("/proc/self/status") as f:
+        fields = dict(line.split(":", 1) for line in f)
+    return int(fields["RssAnon"].split()[0]), int(fields["RssFile"].split()[0])
+
+
+def _weights_memory_case(backend_name, weights_path):
+    import torch
+    from inference_backends import create_backend
+    from inference_precision import PrecisionBackend
+    from model_registry import registry
+
+    torch.set_num_threads(1)
+    anon0, file0 = _rss_kb()
+    model = registry.get("unet3d-2class", weights_path)
+    anon1, file1 = _rss_kb()
+    with open("/proc/self/maps") as f:
+        mapped = [tuple(int(x, 16) for x in line.split()[0].split("-")) for line in f if weights_path in line]
+    tensors = list(model.parameters()) + list(model.buffers())
+    in_mapping = sum(t.nbytes for t in tensors if any(lo <= t.data_ptr() < hi for lo, hi in mapped))
+    if backend_name == "channels_last":
+        backend = PrecisionBackend(model, "fp32", channels_last=True)
+    else:
+        backend = create_backend(backend_name, model, weights_path, example_shape=(1, 1, 32, 32, 16))
+    anon2, file2 = _rss_kb()
+    return {"backend": backend.name, "weights_mapped_pct": round(100 * in_mapping / sum(t.nbytes for t in tensors), 1),
+            "model_private_mb": round((anon1 - anon0) / 1024, 2),
+            "model_page_cache_mb": round((file1 - file0) / 1024, 2),
+            "backend_private_mb": round((anon2 - anon1) / 1024, 2)}
+
+
+def bench_weights_memory(args):
+    import os
+
+    weights_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "trained_brain_model.pth")
+    print(f"weights file: {os.path.getsize(weights_path) / 1024 / 1024:.2f} MB")
+    rows = [run_isolated(_weights_memory_case, name, weights_path)
+            for name in ("eager", "torchscript", "onnxruntime", "channels_last")]
+    print_table(rows, ["backend", "weights_mapped_pct", "model_private_mb", "model_page_cache_mb", "backend_private_mb"])
+
+
+# --- fp32 vs bf16 vs int8, contiguous vs channels-last-3d ---------------------
+
+def _precision_case(count, tolerance):
+    from monai_segmentor import MonaiLocalSegmentor
+    from inference_precision import synthetic_calibration_set
+
+    segmentor = MonaiLocalSegmentor()
+    return segmentor.evaluate_precision_modes(synthetic_calibration_set(count), tolerance)
+
+
+def bench_precision(args):
+    from inference_precision import fastest_within_tolerance
+
+    rows = run_isolated(_precision_case, args.volumes, args.tolerance)
+    print_table(rows, ["mode", "available", "median_ms", "mean_dice_vs_fp32", "min_dice_vs_fp32",
+                       "within_tolerance"])
+    print(f"Fastest mode within Dice >= {args.tolerance}: {fastest_within_tolerance(rows)}")
+
+
+# --- Torch-native vs scipy preprocessing --------------------------------------
+
+def scipy_preprocess(image_array, target_shape, timings):
+    """The original NumPy normalize + scipy.ndimage.zoom path, kept as the baseline"""
+    from scipy.ndimage import zoom
+    import torch
+
+    start = time.perf_counter()
+    normalized = (image_array - np.min(image_array)) / (np.max(image_array) - np.min(image_array))
+    timings["normalize"] = round((time.perf_counter() - start) * 1000, 3)
+
+    start = time.perf_counter()
+    resized = zoom(normalized, [target_shape[i] / normalized.shape[i] for i in range(3)], order=1)
+    timings["resample"] = round((time.perf_counter() - start) * 1000, 3)
+
+    start = time.perf_counter()
+    tensor = torch.from_numpy(resized).unsqueeze(0).unsqueeze(0).float()
+    timings["to_tensor"] = round((time.perf_counter() - start) * 1000, 3)
+    return tensor
+
+
+def _preprocess_case(shape, path, target_shape, dtype):
+    import torch
+    from preprocessing import preprocess_volume
+
+    import scipy.ndimage  # noqa: F401  (keep the import out of the timed region)
+
+    volume = synthetic_volume(shape)
+    if dtype != "float32":
+        volume = (volume * 1000).astype(dtype)
+    reset_peak_rss()
+    baseline_mb = current_rss_mb()
+    timings = {}
+
+    start = time.perf_counter()
+    if path == "scipy":
+        result = scipy_preprocess(volume, target_shape, timings)
+    else:
+        result = preprocess_volume(volume, target_shape, timings=timings)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "shape": "x".join(map(str, shape)),
+        "input": dtype,
+        "path": f"{path} ({torch.get_num_threads()} threads)",
+        "total_ms": round(elapsed * 1000, 1),
+        "steps_ms": timings,
+        "peak_alloc_mb": round(peak_rss_mb() - baseline_mb, 1),
+        "output_dtype": str(result.dtype).replace("torch.", ""),
+    }
+
+
+def bench_preprocessing(args):
+    target_shape = parse_shape(args.target)
+    rows = [run_isolated(_preprocess_case, shape, path, target_shape, dtype)
+            for shape in map(parse_shape, args.shapes) for dtype in args.dtypes
+            for path in ("scipy", "torch")]
+    print_table(rows, ["shape", "input", "path", "total_ms", "steps_ms", "peak_alloc_mb", "output_dtype"])
+
+
+# --- Test-time augmentation --------------------------------------------------
+
+def _tta_case(views, repeats):
+    from monai_segmentor import MonaiLocalSegmentor
+
+    segmentor = MonaiLocalSegmentor()
+    volume = synthetic_volume((128, 128, 64))
+    segmentor.segment_brain_tumor(volume, tta_views=views)  # warmup
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        segmentor.segment_brain_tumor(volume, tta_views=views)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {"views": views, "median_ms": round(timings[len(timings) // 2], 1)}
+
+
+def bench_tta(args):
+    rows = [run_isolated(_tta_case, views, args.repeats) for views in args.views]
+    base = rows[0]["median_ms"]
+    for row in rows:
+        row["vs_first"] = f"{row['median_ms'] / base:.2f}x"
+        row["ms_per_view"] = round(row["median_ms"] / row["views"], 1)
+    print_table(rows, ["views", "median_ms", "vs_first", "ms_per_view"])
+
+
+# --- Region statistics ----------------------------------------------------------
+
+def synthetic_mask(shape, lesions=3, seed=0):
+    """uint8 label mask with a few ellipsoid lesions of labels 1 and 2"""
+    rng = np.random.default_rng(seed)
+    mask = np.zeros(shape, dtype=np.uint8)
+    for i in range(lesions):
+        center = [rng.uniform(0.2, 0.8) * s for s in shape]
+        radii = [rng.uniform(0.03, 0.08) * s for s in shape]
+        lo = [max(0, int(c - r)) for c, r in zip(center, radii)]
+        hi = [min(s, int(c + r) + 1) for c, r, s in zip(center, radii, shape)]
+        z, y, x = np.ogrid[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+        ellipsoid = ((z - center[0]) / radii[0]) ** 2 + ((y - center[1]) / radii[1]) ** 2 + \
+                    ((x - center[2]) / radii[2]) ** 2 <= 1
+        mask[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]][ellipsoid] = 1 + i % 2
+    return mask
+
+
+def legacy_region_metrics(segmentation):
+    """The original calculate_metrics / estimate_tumor_location scans, kept as the baseline"""
+    tumor_voxels = np.sum(segmentation == 1)
+    tumor_mask = segmentation == 1
+    centroid = np.argwhere(tumor_mask).mean(axis=0)
+    binary_mask = (segmentation > 0.5).astype(np.float32)
+    center = [np.mean(coord) for coord in np.where(binary_mask)]
+    coords = np.where((segmentation > 0.5).astype(np.float32))
+    bbox = [[int(c.min()) for c in coords], [int(c.max()) for c in coords]]
+    tumor_mask = (segmentation > 0).astype(np.float32)
+    z, y, x = np.indices(tumor_mask.shape)
+    center_z = np.sum(z * tumor_mask) / np.sum(tumor_mask)
+    return tumor_voxels, centroid, center, bbox, center_z
+
+
+def _region_stats_case(shape, path):
+    from region_stats import compute_region_stats
+
+    mask = synthetic_mask(shape)
+    reset_peak_rss()
+    baseline_mb = current_rss_mb()
+    start = time.perf_counter()
+    if path == "legacy":
+        legacy_region_metrics(mask)
+    else:
+        compute_region_stats(mask)
+    return {
+        "shape": "x".join(map(str, shape)),
+        "path": path,
+        "ms": round((time.perf_counter() - start) * 1000, 1),
+        "peak_alloc_mb": round(peak_rss_mb() - baseline_mb, 1),
+    }
+
+
+def bench_region_stats(args):
+    rows = [run_isolated(_region_stats_case, shape, path)
+            for shape in map(parse_shape, args.shapes) for path in ("legacy", "single-pass")]
+    print_table(rows, ["shape", "path", "ms", "peak_alloc_mb"])
+
+
+def legacy_anatomical_brain_model(radius_x, radius_y, radius_z):
+    """The original per-voxel brain template, kept as the baseline"""
+    import trimesh
+    from skimage import measure
+
+    brain_volume = np.zeros((100, 100, 100))
+    for i in range(100):
+        for j in range(100):
+            for k in range(100):
+                nx, ny, nz = (i - 50) / 25, (j - 50) / 25, (k - 50) / 25
+                dist = np.sqrt((nx ** 2) + (ny ** 2) + (nz ** 2))
+                if dist <= 1.0 + 0.15 * np.sin(3 * np.arctan2(ny, nx)):
+                    brain_volume[i, j, k] = 1
+    verts, faces, _, _ = measure.marching_cubes(brain_volume, level=0.5)
+    verts[:, 0] = verts[:, 0] * (radius_x * 2 / 100) - radius_x
+    verts[:, 1] = verts[:, 1] * (radius_y * 2 / 100) - radius_y
+    verts[:, 2] = verts[:, 2] * (radius_z * 2 / 100) - radius_z
+    return trimesh.Trimesh(vertices=verts, faces=faces)
+
+
+def _brain_template_case(shape, path, cache_dir):
+    import brain_template
+
+    brain_template.TEMPLATE_CACHE_DIR = cache_dir
+    radii = [s / 2 for s in shape]
+    if path == "memory":
+        brain_template.load_unit_template()
+    start = time.perf_counter()
+    if path == "legacy":
+        legacy_anatomical_brain_model(*radii)
+    else:
+        brain_template.anatomical_brain_mesh(*radii)
+    return {
+        "shape": "x".join(map(str, shape)),
+        "path": path,
+        "ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
+def bench_brain_template(args):
+    rows = []
+    for shape in map(parse_shape, args.shapes):
+        # "cold" builds and writes the disk cache that the "disk" case then loads
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for path in ("legacy", "cold", "disk", "memory"):
+                rows.append(run_isolated(_brain_template_case, shape, path, cache_dir))
+    print_table(rows, ["shape", "path", "ms"])
+
+
+def _viewer_case(shape, path, output_dir):
+    import os
+
+    from monai_segmentor import create_transparent_brain_model, visualize_3d_tumor
+    from tumor_mesh import roi_marching_cubes
+
+    mask = synthetic_mask(shape) > 0
+    verts, faces, _ = roi_marching_cubes(mask)
+    start = time.perf_counter()
+    if path == "plotly-html":
+        paths = [visualize_3d_tumor(verts, faces, shape, os.path.join(output_dir, "tumor_3d_view.html"))]
+    else:
+        from mesh_export import mesh_exporter
+        from viewer import export_brain_buffer
+
+        brain = create_transparent_brain_model(shape)
+        tumor_export = mesh_exporter.export(verts, faces, output_dir, "tumor_3d", formats=("bin",))
+        brain_export = export_brain_buffer(brain.vertices, brain.faces, verts, output_dir)
+        paths = [tumor_export["formats"]["bin"]["path"], brain_export["formats"]["bin"]["path"]]
+    return {
+        "shape": "x".join(map(str, shape)),
+        "path": path,
+        "ms": round((time.perf_counter() - start) * 1000, 1),
+        "bytes": sum(os.path.getsize(p) for p in paths),
+    }
+
+
+def bench_viewer(args):
+    from viewer import VIEWER_SHELL
+
+    rows = []
+    for shape in map(parse_shape, args.shapes):
+        with tempfile.TemporaryDirectory() as output_dir:
+            for path in ("plotly-html", "binary-buffers"):
+                rows.append(run_isolated(_viewer_case, shape, path, output_dir))
+    print_table(rows, ["shape", "path", "ms", "bytes"])
+    print(f"Viewer shell (written once, cached by clients): {len(VIEWER_SHELL.encode())} bytes")
+
+
+def legacy_contours(mask):
+    """The original per-slice find_contours loop, as float64 lists in the response"""
+    from skimage import measure
+
+    contours_2d = []
+    for z in range(mask.shape[2]):
+        slice_mask = mask[:, :, z] > 0.5
+        if np.any(slice_mask):
+            contours = measure.find_contours(slice_mask, level=0.5)
+            contours_2d.append({'slice': z, 'contours': [c.tolist() for c in contours]})
+    return contours_2d
+
+
+def _contours_case(shape, encoding, tolerance):
+    from contours import extract_slice_contours
+
+    mask = synthetic_mask(shape) > 0
+    start = time.perf_counter()
+    if encoding == "legacy":
+        contours_2d = legacy_contours(mask)
+    else:
+        contours_2d = extract_slice_contours(mask, tolerance, encoding)
+    extract_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    payload = json.dumps({"contours_2d": contours_2d})
+    return {
+        "shape": "x".join(map(str, shape)),
+        "encoding": encoding,
+        "extract_ms": round(extract_ms, 1),
+        "serialize_ms": round((time.perf_counter() - start) * 1000, 1),
+        "json_kb": round(len(payload) / 1024, 1),
+    }
+
+
+def bench_contours(args):
+    rows = [run_isolated(_contours_case, shape, encoding, args.tolerance)
+            for shape in map(parse_shape, args.shapes) for encoding in ("legacy", "int16", "delta")]
+    print_table(rows, ["shape", "encoding", "extract_ms", "serialize_ms", "json_kb"])
+
+
+def write_synthetic_series(directory, slices=300, size=512, seed=0):
+    """An axial int16 MR series, one file per slice, written in shuffled order"""
+    import pydicom
+    from pydicom.dataset import FileDataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+    rng = np.random.default_rng(seed)
+    series_uid, study_uid = generate_uid(), generate_uid()
+    paths = []
+    for order, z in enumerate(rng.permutation(slices)):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = MRImageStorage
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = FileDataset(None, {}, file_meta=meta, preamble=b"\0" * 128)
+        ds.SOPClassUID, ds.SOPInstanceUID = MRImageStorage, meta.MediaStorageSOPInstanceUID
+        ds.Modality = "MR"
+        ds.StudyInstanceUID, ds.SeriesInstanceUID = study_uid, series_uid
+        ds.InstanceNumber = int(z) + 1
+        ds.ImagePositionPatient = [0.0, 0.0, float(z) * 1.5]
+        ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+        ds.PixelSpacing = [0.5, 0.5]
+        ds.SliceThickness = 1.5
+        ds.Rows = ds.Columns = size
+        ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, "MONOCHROME2"
+        ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 16, 15, 1
+        ds.PixelData = rng.integers(0, 4000, (size, size), dtype=np.int16).tobytes()
+        path = f"{directory}/slice_{order:04d}.dcm"
+        pydicom.dcmwrite(path, ds, enforce_file_format=True)
+        paths.append(path)
+    return paths
+
+
+def sequential_series(paths):
+    """Baseline: read every file fully, one after another, then sort and stack"""
+    import pydicom
+
+    datasets = [pydicom.dcmread(p) for p in paths]
+    datasets.sort(key=lambda ds: float(ds.ImagePositionPatient[2]))
+    return np.stack([ds.pixel_array.astype(np.float32) for ds in datasets])
+
+
+def _dicom_series_case(directory, path, workers):
+    import os
+
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+    reset_peak_rss()
+    baseline_mb = current_rss_mb()
+    start = time.perf_counter()
+    if path == "sequential":
+        volume = sequential_series(paths)
+    elif path == "simpleitk":
+        import SimpleITK as sitk
+
+        reader = sitk.ImageSeriesReader()
+        reader.SetFileNames(reader.GetGDCMSeriesFileNames(directory))
+        volume = sitk.GetArrayFromImage(reader.Execute()).astype(np.float32)
+    else:
+        from dicom_series import load_dicom_series
+
+        volume = load_dicom_series(paths, max_workers=workers)
+    seconds = time.perf_counter() - start
+    return {
+        "path": path if path != "parallel" else f"parallel x{workers}",
+        "files": len(paths),
+        "shape": "x".join(map(str, volume.shape)),
+        "ms": round(seconds * 1000, 1),
+        "files_per_s": round(len(paths) / seconds, 1),
+        "peak_alloc_mb": round(peak_rss_mb() - baseline_mb, 1),
+    }
+
+
+def bench_dicom_series(args):
+    with tempfile.TemporaryDirectory() as directory:
+        write_synthetic_series(directory, args.slices, args.size)
+        rows = [run_isolated(_dicom_series_case, directory, "sequential", 1),
+                run_isolated(_dicom_series_case, directory, "simpleitk", 1)]
+        rows += [run_isolated(_dicom_series_case, directory, "parallel", workers) for workers in args.workers]
+    print_table(rows, ["path", "files", "shape", "ms", "files_per_s", "peak_alloc_mb"])
+
+
+def write_synthetic_nifti(path, shape, seed=0):
+    """int16 volume with a non-trivial scl_slope, as scanners export them"""
+    import nibabel as nib
+
+    volume = (synthetic_volume(shape, seed) * 1000).astype(np.int16)
+    image = nib.Nifti1Image(volume, np.diag([0.9, 0.9, 1.2, 1.0]))
+    image.header.set_slope_inter(0.5, 0)
+    nib.save(image, path)
+
+
+def _nifti_case(path, mode, cache_dir, target_shape):
+    import nibabel as nib
+
+    import nifti_loader
+    from preprocessing import preprocess_volume
+
+    nifti_loader.NIFTI_CACHE_DIR = cache_dir
+    reset_peak_rss()
+    baseline_mb = current_rss_mb()
+    start = time.perf_counter()
+    if mode == "get_fdata":
+        volume = nib.load(path).get_fdata().transpose(2, 1, 0)
+    else:
+        volume = nifti_loader.load_nifti_volume(path)
+    load_ms = (time.perf_counter() - start) * 1000
+    preprocess_volume(volume, target_shape)
+    seconds = time.perf_counter() - start
+    return {
+        "path": mode,
+        "shape": "x".join(map(str, volume.shape)),
+        "load_ms": round(load_ms, 1),
+        "total_ms": round(seconds * 1000, 1),
+        "peak_alloc_mb": round(peak_rss_mb() - baseline_mb, 1),
+    }
+
+
+def bench_nifti(args):
+    target_shape = parse_shape(args.target)
+    rows = []
+    for shape in args.shapes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/volume.nii.gz"
+            write_synthetic_nifti(path, parse_shape(shape))
+            cache_dir = f"{directory}/cache"
+            rows.append(run_isolated(_nifti_case, path, "get_fdata", cache_dir, target_shape))
+            rows.append(run_isolated(_nifti_case, path, "lazy (decompress)", cache_dir, target_shape))
+            rows.append(run_isolated(_nifti_case, path, "lazy (cached)", cache_dir, target_shape))
+    print_table(rows, ["path", "shape", "load_ms", "total_ms", "peak_alloc_mb"])
+
+
+# --- Event-loop responsiveness under segmentation load -------------------------
+
+
+def _percentile_ms(latencies, q):
+    latencies = sorted(latencies)
+    return round(latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000, 1)
+
+
+def _load_case(clients, requests_per_client, shape, idle_s):
+    import os
+    import socket
+    import subprocess
+    import sys
+    import threading
+    from collections import Counter
+
+    import httpx
+
+    # The server gets its own process so the load generator does not compete with it for the GIL
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "neurovision_complete:app",
+                               "--port", str(port), "--log-level", "warning"],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    while True:
+        try:
+            if httpx.get(f"{base}/api/ready").status_code == 200:
+                break
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            # Distinct studies, so no request is answered from the artifact store
+            paths = []
+            for i in range(clients * requests_per_client):
+                paths.append(os.path.join(directory, f"study{i}.nii"))
+                write_synthetic_nifti(paths[-1], shape, seed=i)
+
+            def poll_health(stop):
+                latencies = []
+                with httpx.Client(base_url=base, timeout=None) as client:
+                    while not stop.is_set():
+                        start = time.perf_counter()
+                        client.get("/api/health")
+                        latencies.append(time.perf_counter() - start)
+                        time.sleep(0.02)
+                return latencies
+
+            def segment(i):
+                results = []
+                with httpx.Client(base_url=base, timeout=None) as client:
+                    for path in paths[i::clients]:
+                        start = time.perf_counter()
+                        with open(path, "rb") as f:
+                            response = client.post("/api/segment", files={"file": (os.path.basename(path), f)})
+                        results.append((response.status_code, time.perf_counter() - start))
+                return results
+
+            rows = []
+            stop = threading.Event()
+            with ThreadPoolExecutor(clients + 1) as pool:
+                idle = pool.submit(poll_health, stop)
+                time.sleep(idle_s)
+                stop.set()
+                idle_latencies = idle.result()
+
+                stop = threading.Event()
+                loaded = pool.submit(poll_health, stop)
+                start = time.perf_counter()
+                results = [r for rs in pool.map(segment, range(clients)) for r in rs]
+                elapsed = time.perf_counter() - start
+                stop.set()
+                loaded_latencies = loaded.result()
+    finally:
+        server.terminate()
+        server.wait()
+    statuses = Counter(status for status, _ in results)
+    for phase, latencies in (("idle", idle_latencies), (f"{clients} clients segmenting", loaded_latencies)):
+        rows.append({
+            "phase": phase,
+            "health_calls": len(latencies),
+            "health_p50_ms": _percentile_ms(latencies, 0.5),
+            "health_p99_ms": _percentile_ms(latencies, 0.99),
+            "health_max_ms": round(max(latencies) * 1000, 1),
+        })
+    rows[-1].update({
+        "segment_statuses": dict(statuses),
+        "segment_p50_ms": _percentile_ms([s for c, s in results if c == 200] or [0], 0.5),
+        "wall_s": round(elapsed, 1),
+    })
+    return rows
+
+
+def bench_load(args):
+    rows = run_isolated(_load_case, args.clients, args.requests, parse_shape(args.shape), args.idle_s)
+    print_table(rows, ["phase", "health_calls", "health_p50_ms", "health_p99_ms", "health_max_ms",
+                       "segment_statuses", "segment_p50_ms", "wall_s"])
+
+
+# --- Case store -----------------------------------------------------------------
+
+
+def _cases_case(existing, path, operations):
+    import os
+    import uuid
+    from datetime import datetime
+
+    from case_store import CaseStore
+
+    case = {"patient": {"name": "Jane Doe", "age": "54", "gender": "F", "contact": "-"},
+            "metadata": {"hospital": "General", "description": "x" * 200}}
+    with tempfile.TemporaryDirectory() as directory:
+        if path == "cases.json":
+            cases_file = os.path.join(directory, "cases.json")
+            with open(cases_file, "w") as f:
+                json.dump([{"id": str(uuid.uuid4()), "timestamp": datetime.now().isoformat(), **case}
+                           for _ in range(existing)], f, indent=4)
+
+            def create():
+                with open(cases_file) as f:
+                    cases = json.load(f)
+                cases.append({"id": str(uuid.uuid4()), "timestamp": datetime.now().isoformat(), **case})
+                with open(cases_file, "w") as f:
+                    json.dump(cases, f, indent=4)
+
+            def list_page():
+                with open(cases_file) as f:
+                    return json.load(f)
+        else:
+            store = CaseStore(os.path.join(directory, "cases.db"))
+            for _ in range(existing):
+                store.create(case)
+
+            def create():
+                store.create(case)
+
+            def list_page():
+                return store.list(limit=50)
+
+        timings = {}
+        for name, fn in (("create", create), ("list", list_page)):
+            start = time.perf_counter()
+            for _ in range(operations):
+                fn()
+            timings[name] = (time.perf_counter() - start) * 1000 / operations
+    return {"path": path, "existing": existing, "create_ms": round(timings["create"], 2),
+            "list_ms": round(timings["list"], 2)}
+
+
+def bench_cases(args):
+    rows = [run_isolated(_cases_case, existing, path, args.operations)
+            for existing in args.existing for path in ("cases.json", "sqlite")]
+    print_table(rows, ["path", "existing", "create_ms", "list_ms"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NeuroVision inference benchmarks")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    sw = sub.add_parser("sliding-window", help="Resize path vs native-resolution sliding window")
+    sw.add_argument("--shapes", nargs="+", default=DEFAULT_SHAPES)
+    sw.add_argument("--roi", default="128x128x64")
+    sw.add_argument("--overlap", type=float, default=0.25)
+    sw.add_argument("--max-patches", type=int, default=4)
+    sw.set_defaults(func=bench_sliding_window)
+
+    mb = sub.add_parser("micro-batching", help="Throughput and latency under concurrent requests")
+    mb.add_argument("--clients", type=int, default=8)
+    mb.add_argument("--requests", type=int, default=4, help="Requests per client")
+    mb.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    mb.add_argument("--max-wait-ms", type=float, default=10.0)
+    mb.set_defaults(func=bench_micro_batching)
+
+    be = sub.add_parser("backends", help="Latency and logit parity per inference backend")
+    be.add_argument("--shape", default="128x128x64")
+    be.add_argument("--repeats", type=int, default=5)
+    be.set_defaults(func=bench_backends)
+
+    wm = sub.add_parser("weights-memory", help="Private vs shared (page cache) weight memory per backend")
+    wm.set_defaults(func=bench_weights_memory)
+
+    pr = sub.add_parser("precision", help="Latency and Dice vs fp32 per precision mode")
+    pr.add_argument("--volumes", type=int, default=4, help="Size of the fixed calibration set")
+    pr.add_argument("--tolerance", type=float, default=0.98)
+    pr.set_defaults(func=bench_precision)
+
+    pp = sub.add_parser("preprocessing", help="Torch-native vs NumPy/scipy preprocessing")
+    pp.add_argument("--shapes", nargs="+", default=DEFAULT_SHAPES)
+    pp.add_argument("--target", default="128x128x64")
+    pp.add_argument("--dtypes", nargs="+", default=["float32", "int16", "float64"],
+                    help="Input dtypes: DICOM via pydicom, SimpleITK series, nibabel get_fdata")
+    pp.set_defaults(func=bench_preprocessing)
+
+    tt = sub.add_parser("tta", help="Latency growth with the number of TTA views")
+    tt.add_argument("--views", type=int, nargs="+", default=[1, 2, 4, 8])
+    tt.add_argument("--repeats", type=int, default=3)
+    tt.set_defaults(func=bench_tta)
+
+    rs = sub.add_parser("region-stats", help="Single-pass region statistics vs the legacy scans")
+    rs.add_argument("--shapes", nargs="+", default=DEFAULT_SHAPES)
+    rs.set_defaults(func=bench_region_stats)
+
+    bt = sub.add_parser("brain-template", help="Per-voxel brain template vs the cached unit mesh")
+    bt.add_argument("--shapes", nargs="+", default=["128x128x64", "512x512x200"])
+    bt.set_defaults(func=bench_brain_template)
+
+    vw = sub.add_parser("viewer", help="Per-study Plotly HTML vs binary viewer buffers")
+    vw.add_argument("--shapes", nargs="+", default=["128x128x64", "256x256x256"])
+    vw.set_defaults(func=bench_viewer)
+
+    ct = sub.add_parser("contours", help="Per-slice float contours vs simplified integer polygons")
+    ct.add_argument("--shapes", nargs="+", default=DEFAULT_SHAPES)
+    ct.add_argument("--tolerance", type=float, default=1.0)
+    ct.set_defaults(func=bench_contours)
+
+    ds = sub.add_parser("dicom-series", help="Sequential vs SimpleITK vs parallel DICOM series loading")
+    ds.add_argument("--slices", type=int, default=300)
+    ds.add_argument("--size", type=int, default=512)
+    ds.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    ds.set_defaults(func=bench_dicom_series)
+
+    nf = sub.add_parser("nifti", help="nibabel get_fdata vs memory-mapped float32 NIfTI loading")
+    nf.add_argument("--shapes", nargs="+", default=["256x256x256"])
+    nf.add_argument("--target", default="128x128x64")
+    nf.set_defaults(func=bench_nifti)
+
+    ld = sub.add_parser("load", help="/api/health latency while concurrent clients run /api/segment")
+    ld.add_argument("--clients", type=int, default=4)
+    ld.add_argument("--requests", type=int, default=2, help="Uploads per client")
+    ld.add_argument("--shape", default="128x128x64")
+    ld.add_argument("--idle-s", type=float, default=2.0, help="Baseline health polling before the load")
+    ld.set_defaults(func=bench_load)
+
+    cs = sub.add_parser("cases", help="cases.json rewrite vs the SQLite case store")
+    cs.add_argument("--existing", type=int, nargs="+", default=[1000, 10000])
+    cs.add_argument("--operations", type=int, default=50)
+    cs.set_defaults(func=bench_cases)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+
+import numpy as np
+import trimesh
+from skimage import measure
+
+# Grid used to voxelize the procedural brain before marching cubes
+TEMPLATE_RESOLUTION = 100
+TEMPLATE_CACHE_DIR = os.path.join(os.path.dirname(__file__), "models")
+# Bump when the template shape changes so stale disk caches are ignored
+TEMPLATE_VERSION = 1
+
+_template_lock = threading.Lock()
+_unit_templates = {}
+
+
+def anatomical_brain_volume(resolution=TEMPLATE_RESOLUTION):
+    """
+    Boolean brain-shaped volume: a unit sphere with lobes modulated by the
+    in-plane angle, built with broadcasting instead of a per-voxel loop.
+    """
+    center = resolution / 2
+    scale = resolution / 4
+    i, j, k = np.ogrid[:resolution, :resolution, :resolution]
+    nx = ((i - center) / scale).astype(np.float32)
+    ny = ((j - center) / scale).astype(np.float32)
+    nz = ((k - center) / scale).astype(np.float32)
+    dist = np.sqrt(nx ** 2 + ny ** 2 + nz ** 2)
+    return dist <= 1.0 + 0.15 * np.sin(3 * np.arctan2(ny, nx))  # Brain-like shape
+
+
+def _build_unit_template(resolution):
+    verts, faces, _, _ = measure.marching_cubes(anatomical_brain_volume(resolution).astype(np.uint8), level=0.5)
+    # Map voxel coordinates to [-1, 1] so the mesh only needs a per-axis radius scale
+    verts = verts * (2.0 / resolution) - 1.0
+    return verts.astype(np.float32), faces.astype(np.int32)
+
+
+def _cache_path(resolution):
+    return os.path.join(TEMPLATE_CACHE_DIR, f"brain_template_v{TEMPLATE_VERSION}_{resolution}.npz")
+
+
+def load_unit_template(resolution=TEMPLATE_RESOLUTION):
+    """Unit brain mesh (verts in [-1, 1]), from memory, then the disk cache, then built once"""
+    with _template_lock:
+        if resolution in _unit_templates:
+            return _unit_templates[resolution]
+
+        path = _cache_path(resolution)
+        template = None
+        if os.path.exists(path):
+            try:
+                with np.load(path) as cached:
+                    template = cached["vertices"], cached["faces"]
+            except Exception as e:
+                print(f"⚠️  Ignoring unreadable brain template cache {path}: {e}")
+
+        if template is None:
+            start = time.perf_counter()
+            template = _build_unit_template(resolution)
+            print(f"🧠 Brain template built in {(time.perf_counter() - start) * 1000:.0f} ms")
+            try:
+                os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+                tmp_path = path + ".tmp.npz"
+                np.savez(tmp_path, vertices=template[0], faces=template[1])
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️  Could not cache brain template: {e}")
+
+        _unit_templates[resolution] = template
+        return template
+
+
+def anatomical_brain_mesh(radius_x, radius_y, radius_z):
+    """The cached unit template rescaled to a study's half-extents"""
+    verts, faces = load_unit_template()
+    scaled = verts * np.array([radius_x, radius_y, radius_z], dtype=np.float32)
+    return trimesh.Trimesh(vertices=scaled, faces=faces, process=False)
+
+
+def ellipsoid_mesh(radius_x, radius_y, radius_z, segments=50):
+    """UV ellipsoid with the same vertex order and quad split as the original loop version"""
+    u = np.linspace(0, 2 * np.pi, segments)
+    v = np.linspace(0, np.pi, segments)
+    x = radius_x * np.outer(np.cos(u), np.sin(v))
+    y = radius_y * np.outer(np.sin(u), np.sin(v))
+    z = radius_z * np.outer(np.ones_like(u), np.cos(v))
+    verts = np.stack([x.ravel(), y.ravel(), z.ravel()], axis=1)
+
+    i, j = np.meshgrid(np.arange(segments - 1), np.arange(segments - 1), indexing="ij")
+    p1 = (i * segments + j).ravel()
+    p2 = p1 + 1
+    p3 = p1 + segments
+    p4 = p3 + 1
+    faces = np.empty((p1.size * 2, 3), dtype=np.int64)
+    faces[0::2] = np.stack([p1, p2, p4], axis=1)
+    faces[1::2] = np.stack([p1, p4, p3], axis=1)
+    return verts, faces
@@ -0,0 +1,114 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from scipy import ndimage
+
+# Every crop edge must be divisible by the UNet's total stride (2 * 2 * 2)
+UNET_DIVISOR = 8
+# Logit gap that makes "background" win the argmax wherever the fine pass did not run
+BACKGROUND_LOGIT = 20.0
+
+
+def _snap_box(lo, hi, shape, divisor=UNET_DIVISOR):
+    """Grow [lo, hi) so every edge is a multiple of `divisor`, shifting it back inside the volume"""
+    lo, hi = list(lo), list(hi)
+    for axis, size in enumerate(shape):
+        length = hi[axis] - lo[axis]
+        target = min(size, -(-length // divisor) * divisor)
+        hi[axis] = lo[axis] + target
+        if hi[axis] > size:
+            lo[axis] -= hi[axis] - size
+            hi[axis] = size
+    return lo, hi
+
+
+def _merge_boxes(boxes):
+    """Union overlapping boxes"""
+    boxes = [(list(lo), list(hi)) for lo, hi in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                (alo, ahi), (blo, bhi) = boxes[i], boxes[j]
+                if all(alo[a] < bhi[a] and blo[a] < ahi[a] for a in range(len(alo))):
+                    boxes[i] = ([min(x, y) for x, y in zip(alo, blo)], [max(x, y) for x, y in zip(ahi, bhi)])
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+def candidate_boxes(coarse_probabilities, full_shape, margin=8, threshold=0.3):
+    """
+    Connected tumor candidates on the coarse grid mapped to padded, snapped full-grid boxes.
+    Boxes are snapped before they are merged, and merged unions are snapped again until
+    none overlap, so no voxel goes through the fine pass twice.
+    """
+    labels, count = ndimage.label(coarse_probabilities > threshold)
+    if count == 0:
+        return []
+    scale = [f / c for f, c in zip(full_shape, coarse_probabilities.shape)]
+    boxes = []
+    for region in ndimage.find_objects(labels):
+        lo = [max(0, int(np.floor(s.start * k)) - margin) for s, k in zip(region, scale)]
+        hi = [min(size, int(np.ceil(s.stop * k)) + margin) for s, k, size in zip(region, scale, full_shape)]
+        boxes.append(_snap_box(lo, hi, full_shape))
+    while True:
+        merged = _merge_boxes(boxes)
+        if len(merged) == len(boxes):
+            return merged
+        boxes = [_snap_box(lo, hi, full_shape) for lo, hi in merged]
+
+
+def cascade_logits(forward, input_tensor, coarse_shape=(64, 64, 32), margin=8, threshold=0.3,
+                   stats=None):
+    """
+    Two-stage inference over a (1, 1, D, H, W) tensor.
+
+    A low-resolution pass finds candidate tumor regions; the full-resolution
+    pass runs only on padded crops around them and is skipped entirely when
+    nothing is found. Returns full-grid logits (background outside the crops)
+    so mask/probability post-processing is unchanged. When the crops would cover
+    at least the whole volume, one full-resolution pass runs instead. `stats`, if given, is
+    filled with the voxels processed and the compute saved vs. a full pass.
+    """
+    full_shape = tuple(input_tensor.shape[2:])
+    full_voxels = int(np.prod(full_shape))
+
+    coarse_input = F.interpolate(input_tensor, size=tuple(coarse_shape), mode="trilinear", align_corners=True)
+    coarse_logits = forward(coarse_input)
+    coarse_probabilities = torch.softmax(coarse_logits[0].float(), dim=0)[1].cpu().numpy()
+    boxes = candidate_boxes(coarse_probabilities, full_shape, margin, threshold)
+
+    full_pass = sum(int(np.prod([h - l for l, h in zip(lo, hi)])) for lo, hi in boxes) >= full_voxels
+    if full_pass:
+        boxes = [([0] * len(full_shape), list(full_shape))]
+        logits = forward(input_tensor).float().cpu()
+        fine_voxels = full_voxels
+    else:
+        num_classes = coarse_logits.shape[1]
+        logits = torch.zeros((1, num_classes) + full_shape, dtype=torch.float32)
+        logits[:, 1:] = -BACKGROUND_LOGIT
+
+        fine_voxels = 0
+        for lo, hi in boxes:
+            region = (slice(None), slice(None)) + tuple(slice(l, h) for l, h in zip(lo, hi))
+            logits[region] = forward(input_tensor[region]).float().cpu()
+            fine_voxels += int(np.prod([h - l for l, h in zip(lo, hi)]))
+
+    if stats is not None:
+        processed = int(np.prod(coarse_shape)) + fine_voxels
+        stats["cascade"] = {
+            "early_exit": not boxes,
+            "full_pass": full_pass,
+            "regions": len(boxes),
+            "crop_boxes": [{"min": lo, "max": hi} for lo, hi in boxes],
+            "coarse_voxels": int(np.prod(coarse_shape)),
+            "fine_voxels": fine_voxels,
+            "full_pass_voxels": full_voxels,
+            "compute_saved_pct": round(100.0 * (1 - processed / full_voxels), 1),
+        }
+    return logits
@@ -0,0 +1,167 @@
+import base64
+import json
+import os
+import sqlite3
+import uuid
+from datetime import datetime
+
+from sqlite_db import connect
+
+DEFAULT_CASE_STATUS = "open"
+MAX_PAGE_SIZE = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cases_timestamp ON cases (timestamp, id);
+CREATE INDEX IF NOT EXISTS cases_status_timestamp ON cases (status, timestamp, id);
+"""
+
+
+def encode_cursor(timestamp, case_id):
+    return base64.urlsafe_b64encode(f"{timestamp}|{case_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) of the last case on the previous page; ValueError when malformed"""
+    try:
+        timestamp, case_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return timestamp, case_id
+
+
+def new_case(case_data, coerce=False):
+    """
+    The case to store: generated id and timestamp unless supplied, and the
+    status always present in the case JSON, so it agrees with the status
+    column. Supplied id, timestamp and status must be strings and the
+    timestamp ISO 8601 (ValueError otherwise); coerce=True stringifies them
+    instead, for legacy cases.json entries.
+    """
+    case = {"id": str(uuid.uuid4()), "timestamp": datetime.now().isoformat(), "status": DEFAULT_CASE_STATUS,
+            **{k: v for k, v in case_data.items() if not (k in ("id", "timestamp", "status") and v is None)}}
+    for field in ("id", "timestamp", "status"):
+        if not isinstance(case[field], str) or not case[field]:
+            if not coerce:
+                raise ValueError(f"Case {field} must be a non-empty string")
+            case[field] = str(case[field])
+    if not coerce:
+        try:
+            datetime.fromisoformat(case["timestamp"])
+        except ValueError:
+            raise ValueError("Case timestamp must be an ISO 8601 timestamp")
+    return case
+
+
+class CaseStore:
+    """
+    Cases in SQLite (WAL mode), one row per case with the full case JSON.
+
+    id is the primary key; (timestamp, id) and (status, timestamp, id)
+    indexes serve the newest-first listing, its filters and keyset
+    pagination, so create, delete, lookup and each page cost the same no
+    matter how many cases exist. An existing cases.json is imported once.
+    """
+
+    def __init__(self, db_path, legacy_json=None):
+        self.db_path = db_path
+        with connect(db_path) as db:
+            db.executescript(_SCHEMA)
+        if legacy_json and os.path.exists(legacy_json):
+            self.migrate_json(legacy_json)
+
+    def migrate_json(self, path):
+        """
+        Import a cases.json and rename it inside one write transaction, so processes
+        starting together import it exactly once; a file already gone was migrated
+        """
+        with connect(self.db_path) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                try:
+                    with open(path) as f:
+                        cases = json.load(f)
+                except FileNotFoundError:
+                    db.execute("ROLLBACK")
+                    return
+                for case in cases:
+                    case = new_case(case, coerce=True)
+                    db.execute("INSERT OR IGNORE INTO cases (id, timestamp, status, data) VALUES (?, ?, ?, ?)",
+                               (case["id"], case["timestamp"], case["status"], json.dumps(case)))
+                os.replace(path, path + ".migrated")
+                try:
+                    db.execute("COMMIT")
+                except Exception:
+                    os.replace(path + ".migrated", path)
+                    raise
+            except Exception:
+                if db.in_transaction:
+                    db.execute("ROLLBACK")
+                raise
+        print(f"🗃️  Migrated {len(cases)} cases from {path}")
+
+    def create(self, case_data):
+        """Store a new case; ValueError for a malformed id/timestamp/status or an id already in use"""
+        case = new_case(case_data)
+        with connect(self.db_path) as db:
+            try:
+                db.execute("INSERT INTO cases (id, timestamp, status, data) VALUES (?, ?, ?, ?)",
+                           (case["id"], case["timestamp"], case["status"], json.dumps(case)))
+            except sqlite3.IntegrityError:
+                raise ValueError(f"Case {case['id']} already exists")
+        return case
+
+    def get(self, case_id):
+        with connect(self.db_path) as db:
+            row = db.execute("SELECT data FROM cases WHERE id = ?", (case_id,)).fetchone()
+        return None if row is None else json.loads(row["data"])
+
+    def delete(self, case_id):
+        """True when a case was deleted"""
+        with connect(self.db_path) as db:
+            return db.execute("DELETE FROM cases WHERE id = ?", (case_id,)).rowcount > 0
+
+    @staticmethod
+    def _filters(status, since, until):
+        clauses, params = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        return clauses, params
+
+    def all(self, status=None, since=None, until=None):
+        """Every matching case, oldest first as cases.json kept them (the unpaginated listing)"""
+        clauses, params = self._filters(status, since, until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with connect(self.db_path) as db:
+            rows = db.execute(f"SELECT data FROM cases {where} ORDER BY timestamp, rowid", params).fetchall()
+        return [json.loads(row["data"]) for row in rows]
+
+    def list(self, limit=50, cursor=None, status=None, since=None, until=None):
+        """
+        One newest-first page of cases, optionally filtered by status and an
+        ISO timestamp range [since, until). Returns (cases, next_cursor);
+        next_cursor is None on the last page.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        clauses, params = self._filters(status, since, until)
+        if cursor is not None:
+            clauses.append("(timestamp, id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with connect(self.db_path) as db:
+            rows = db.execute(f"SELECT id, timestamp, data FROM cases {where} "
+                              "ORDER BY timestamp DESC, id DESC LIMIT ?", (*params, limit + 1)).fetchall()
+        next_cursor = encode_cursor(rows[limit - 1]["timestamp"], rows[limit - 1]["id"]) if len(rows) > limit else None
+        return [json.loads(row["data"]) for row in rows[:limit]], next_cursor
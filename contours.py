@@ -0,0 +1,86 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+# Imported by name so skimage's lazy loader resolves them at import, not on the first request
+from skimage.measure import approximate_polygon, find_contours
+
+from postprocessing import mask_bounding_box
+
+# Max distance (pixels) between a simplified polygon and the raw contour
+CONTOUR_TOLERANCE = 1.0
+# "int16": flat [r0, c0, r1, c1, ...]; "delta": first point, then per-vertex differences
+CONTOUR_ENCODINGS = ("int16", "delta")
+CONTOUR_WORKERS = min(4, os.cpu_count() or 1)
+# Occupied slices handed to one pool task
+SLICES_PER_TASK = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _contour_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=CONTOUR_WORKERS, thread_name_prefix="contours")
+        return _pool
+
+
+def slice_occupancy(mask, axis=2):
+    """Boolean vector: does slice i along `axis` contain any foreground"""
+    return np.asarray(mask).any(axis=tuple(a for a in range(3) if a != axis))
+
+
+def encode_polygon(points, encoding="delta"):
+    """Integer polygon as a flat list; int16 keeps absolute positions, delta stores steps"""
+    points = np.rint(points).astype(np.int16)
+    if encoding == "delta":
+        points[1:] = np.diff(points, axis=0)
+    elif encoding != "int16":
+        raise ValueError(f"Unknown contour encoding: {encoding}")
+    return points.ravel().tolist()
+
+
+def _contours_for_slices(mask, slices, offset, tolerance, encoding):
+    entries = []
+    for z in slices:
+        # Pad so contours touching the crop edge close instead of ending open
+        contours = find_contours(np.pad(mask[:, :, z], 1), level=0.5)
+        polygons = [encode_polygon(approximate_polygon(c, tolerance) + offset, encoding)
+                    for c in contours]
+        entries.append({'slice': int(z), 'contours': polygons})
+    return entries
+
+
+def extract_slice_contours(mask, tolerance=CONTOUR_TOLERANCE, encoding="delta", slice_offset=0,
+                           plane_offset=(0, 0)):
+    """
+    Contours of a boolean (H, W, D) mask on every occupied slice along the last axis.
+
+    Empty slices are skipped through a per-slice occupancy vector, each
+    slice is cropped to the mask's in-plane bounding box, and occupied
+    slices are traced in chunks on a thread pool. Polygons are simplified
+    to within `tolerance` pixels and rounded to int16 coordinates in the
+    full-volume frame (offset by `plane_offset` / `slice_offset`).
+    """
+    bbox = mask_bounding_box(mask)
+    if bbox is None:
+        return []
+    lo, hi = bbox
+    crop = mask[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+    offset = np.array([lo[0] + plane_offset[0], lo[1] + plane_offset[1]]) - 1  # -1 for the padding
+    occupied = np.flatnonzero(slice_occupancy(crop))
+
+    chunks = [occupied[i:i + SLICES_PER_TASK] for i in range(0, len(occupied), SLICES_PER_TASK)]
+    if CONTOUR_WORKERS > 1 and len(chunks) > 1:
+        results = _contour_pool().map(
+            lambda chunk: _contours_for_slices(crop, chunk, offset, tolerance, encoding), chunks)
+    else:
+        results = [_contours_for_slices(crop, chunk, offset, tolerance, encoding) for chunk in chunks]
+
+    entries = [entry for chunk in results for entry in chunk]
+    for entry in entries:
+        entry['slice'] += lo[2] + slice_offset
+    return entries
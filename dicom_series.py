@@ -0,0 +1,140 @@
+import os
+import struct
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import pydicom
+except ImportError:
+    pydicom = None
+
+SERIES_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+# (7FE0,0010) as it appears in a little-endian file
+PIXEL_DATA_TAG = struct.pack("<HH", 0x7FE0, 0x0010)
+
+
+def list_dicom_files(path):
+    """Every regular file under a directory (DICOM files often have no extension)"""
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, _, names in os.walk(path):
+        files.extend(os.path.join(root, name) for name in sorted(names) if not name.startswith("."))
+    return files
+
+
+def _read_header(path):
+    try:
+        with open(path, "rb") as f:
+            header = pydicom.dcmread(f, stop_before_pixels=True)
+            # dcmread stops right in front of the PixelData element
+            return path, header, f.tell()
+    except Exception:
+        # Not DICOM (DICOMDIR indexes, stray files in the archive, ...)
+        return path, None, None
+
+
+def _native_pixel_dtype(header):
+    """numpy dtype of uncompressed little-endian single-channel pixels, or None"""
+    transfer_syntax = getattr(getattr(header, "file_meta", None), "TransferSyntaxUID", None)
+    if transfer_syntax is None or transfer_syntax.is_compressed or not transfer_syntax.is_little_endian:
+        return None
+    if getattr(header, "SamplesPerPixel", 1) != 1 or getattr(header, "NumberOfFrames", 1) not in (1, "1", None):
+        return None
+    bits = int(getattr(header, "BitsAllocated", 0))
+    if bits not in (8, 16, 32):
+        return None
+    return np.dtype(f"<{'i' if getattr(header, 'PixelRepresentation', 0) else 'u'}{bits // 8}")
+
+
+def _read_native_pixels(path, header, offset, dtype):
+    """Read uncompressed pixels straight from the file, skipping a second header parse"""
+    explicit = not header.file_meta.TransferSyntaxUID.is_implicit_VR
+    with open(path, "rb") as f:
+        f.seek(offset)
+        element = f.read(12 if explicit else 8)
+        if element[:4] != PIXEL_DATA_TAG:
+            return None
+        length = struct.unpack("<I", element[8:12] if explicit else element[4:8])[0]
+        count = int(header.Rows) * int(header.Columns)
+        if length < count * dtype.itemsize:
+            return None
+        return np.fromfile(f, dtype=dtype, count=count).reshape(int(header.Rows), int(header.Columns))
+
+
+def _slice_position(header):
+    """Distance along the slice normal, so oblique stacks sort correctly; InstanceNumber as fallback"""
+    position = getattr(header, "ImagePositionPatient", None)
+    orientation = getattr(header, "ImageOrientationPatient", None)
+    if position is not None and orientation is not None:
+        normal = np.cross(np.array(orientation[:3], dtype=float), np.array(orientation[3:], dtype=float))
+        return float(np.dot(normal, np.array(position, dtype=float)))
+    if position is not None:
+        return float(position[2])
+    return float(getattr(header, "InstanceNumber", 0) or 0)
+
+
+def _decode_into(volume, index, path, header, offset):
+    dtype = _native_pixel_dtype(header)
+    pixels = _read_native_pixels(path, header, offset, dtype) if dtype is not None else None
+    if pixels is None:
+        # Compressed or unusual encodings go through pydicom's decoders
+        header = pydicom.dcmread(path)
+        pixels = header.pixel_array
+    slope = float(getattr(header, "RescaleSlope", 1) or 1)
+    intercept = float(getattr(header, "RescaleIntercept", 0) or 0)
+    np.multiply(pixels, slope, out=volume[index], casting="unsafe")
+    if intercept:
+        volume[index] += intercept
+
+
+def load_dicom_series(paths, series_uid=None, max_workers=SERIES_WORKERS, info=None):
+    """
+    Load one DICOM series from many slice files into a float32 (slices, rows, cols) volume.
+
+    Headers are read in parallel with stop_before_pixels, grouped by
+    SeriesInstanceUID (the largest series wins unless `series_uid` is given)
+    and sorted by ImagePositionPatient along the slice normal. Pixel data is
+    then decoded on the same thread pool straight into one preallocated
+    volume, with RescaleSlope/Intercept applied; uncompressed pixels are read
+    directly at the offset where the header pass stopped. Spacing (slice, row, col)
+    in mm, the series UID and slice counts go into `info` when a dict is passed.
+    """
+    if not pydicom:
+        raise ImportError("pydicom library is required to read DICOM files.")
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dicom") as pool:
+        headers = list(pool.map(_read_header, paths))
+
+        series = defaultdict(list)
+        for path, header, offset in headers:
+            if header is not None and "Rows" in header:
+                series[str(getattr(header, "SeriesInstanceUID", ""))].append((path, header, offset))
+        if not series:
+            raise ValueError("No DICOM images found in upload")
+        if series_uid is None:
+            series_uid = max(series, key=lambda uid: len(series[uid]))
+        slices = sorted(series[series_uid], key=lambda item: _slice_position(item[1]))
+
+        first = slices[0][1]
+        volume = np.empty((len(slices), int(first.Rows), int(first.Columns)), dtype=np.float32)
+        list(pool.map(lambda item: _decode_into(volume, item[0], *item[1]), enumerate(slices)))
+
+    positions = [_slice_position(header) for _, header, _ in slices]
+    if len(positions) > 1:
+        slice_spacing = float(np.median(np.diff(positions)))
+    else:
+        slice_spacing = float(getattr(first, "SpacingBetweenSlices", 0) or getattr(first, "SliceThickness", 1) or 1)
+    row_spacing, col_spacing = [float(v) for v in getattr(first, "PixelSpacing", [1.0, 1.0])]
+
+    if info is not None:
+        info.update({
+            "series_uid": series_uid,
+            "slices": len(slices),
+            "series_found": len(series),
+            "skipped_files": len(paths) - len(slices),
+            "spacing": (abs(slice_spacing) or 1.0, row_spacing, col_spacing),
+        })
+    return volume
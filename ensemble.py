@@ -0,0 +1,80 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import torch.nn.functional as F
+
+from metrics import run_in_context, span
+from postprocessing import as_mask_array
+from real_segmentor import SUBREGION_SHAPE
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+class EnsembleExecutor:
+    """
+    Serve the 2-class tumor UNet and the 3-class subregion UNet together.
+
+    The study is preprocessed once by the tumor segmentor; both models then
+    run concurrently on a thread pool (torch releases the GIL inside ops) and
+    the subregion labels are brought onto the tumor mask's grid so
+    calculate_metrics can report real edema / enhancing volumes.
+    """
+
+    def __init__(self, tumor_segmentor, subregion_segmentor, max_workers=2):
+        self.tumor_segmentor = tumor_segmentor
+        self.subregion_segmentor = subregion_segmentor
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ensemble")
+
+    def _timed(self, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        return result, _elapsed_ms(start)
+
+    def _subregion_labels(self, input_tensor):
+        # The 3-class model always runs on its own grid (as standalone and exported), whatever
+        # grid the tumor segmentor prepared the shared input on
+        if tuple(input_tensor.shape[2:]) != SUBREGION_SHAPE:
+            input_tensor = F.interpolate(input_tensor, size=SUBREGION_SHAPE, mode="trilinear", align_corners=True)
+        with span("inference.subregion_model"):
+            return self.subregion_segmentor.segment_tensor(input_tensor)
+
+    def segment(self, image_array, stats=None, **segment_kwargs):
+        """
+        Returns (tumor mask, tumor probabilities, subregion mask); the subregion
+        mask shares the tumor mask's grid. Per-model timings go into
+        stats["ensemble"] when a dict is passed.
+        """
+        wall_start = time.perf_counter()
+        input_tensor, preprocess_ms = self._timed(
+            self.tumor_segmentor.prepare_input, image_array, segment_kwargs.get("inference_mode"))
+
+        # Submitted with the request's trace so spans inside the models land on it
+        tumor_future = run_in_context(self.pool, self._timed, self.tumor_segmentor.segment_tensor,
+                                      input_tensor, stats=stats, **segment_kwargs)
+        subregion_future = run_in_context(self.pool, self._timed, self._subregion_labels, input_tensor)
+        (segmentation, tumor_probabilities), tumor_ms = tumor_future.result()
+        subregions, subregion_ms = subregion_future.result()
+
+        merge_start = time.perf_counter()
+        tumor_mask = as_mask_array(segmentation)
+        if subregions.shape != tumor_mask.shape:
+            subregions = F.interpolate(torch.from_numpy(subregions)[None, None].float(),
+                                       size=tumor_mask.shape, mode="nearest")[0, 0].to(torch.uint8).numpy()
+
+        if stats is not None:
+            stats["ensemble"] = {
+                "preprocess_ms": preprocess_ms,
+                "tumor_model_ms": tumor_ms,
+                "subregion_model_ms": subregion_ms,
+                "merge_ms": _elapsed_ms(merge_start),
+                "wall_ms": _elapsed_ms(wall_start),
+                # Time the second model added on top of running the tumor model alone
+                "subregion_overhead_ms": round(max(0.0, _elapsed_ms(wall_start) - preprocess_ms - tumor_ms), 2),
+            }
+        return segmentation, tumor_probabilities, subregions
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
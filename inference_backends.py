@@ -0,0 +1,205 @@
+import io
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# Preferred order when the caller asks for "auto"
+BACKENDS = ("onnxruntime", "torchscript", "eager")
+BACKEND_CHOICES = ("auto",) + BACKENDS
+
+
+class EagerBackend:
+    """Plain PyTorch forward pass; always available"""
+    name = "eager"
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, input_tensor):
+        with torch.no_grad():
+            return self.model(input_tensor)
+
+
+class TorchScriptBackend:
+    """Traced TorchScript module, cached next to the weights"""
+    name = "torchscript"
+
+    def __init__(self, model, example_input, weights_path=None):
+        self.artifact_path = artifact_path = artifact_path_for(weights_path, self.name)
+        if is_fresh(artifact_path, weights_path):
+            print(f"Loading cached TorchScript model: {artifact_path}")
+            self.module = torch.jit.load(artifact_path, map_location="cpu")
+        else:
+            with torch.no_grad():
+                self.module = torch.jit.freeze(torch.jit.trace(model.eval(), example_input))
+            if artifact_path:
+                with atomic_output(artifact_path) as tmp_path:
+                    torch.jit.save(self.module, tmp_path)
+                print(f"TorchScript model exported: {artifact_path}")
+
+    def __call__(self, input_tensor):
+        with torch.no_grad():
+            return self.module(input_tensor)
+
+
+class OnnxRuntimeBackend:
+    """ONNX export of the UNet run on ONNX Runtime's CPU execution provider"""
+    name = "onnxruntime"
+
+    def __init__(self, model, example_input, weights_path=None, intra_op_threads=None):
+        if ort is None:
+            raise ImportError("onnxruntime is not installed. Please install it using: pip install onnxruntime")
+
+        self.artifact_path = artifact_path = artifact_path_for(weights_path, self.name)
+        if is_fresh(artifact_path, weights_path):
+            print(f"Loading cached ONNX model: {artifact_path}")
+            model_source = artifact_path
+        else:
+            model_source = export_onnx(model, example_input, artifact_path)
+            if artifact_path:
+                print(f"ONNX model exported: {artifact_path}")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_source, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, input_tensor):
+        inputs = np.ascontiguousarray(input_tensor.detach().cpu().numpy(), dtype=np.float32)
+        logits = self.session.run(None, {self.input_name: inputs})[0]
+        return torch.from_numpy(logits)
+
+
+def export_onnx(model, example_input, output_path=None):
+    """Export with dynamic batch and spatial axes; returns the path, or the model bytes if no path"""
+    if output_path:
+        with atomic_output(output_path) as tmp_path:
+            export_onnx_to(model, example_input, tmp_path)
+        return output_path
+    target = io.BytesIO()
+    export_onnx_to(model, example_input, target)
+    return target.getvalue()
+
+
+def export_onnx_to(model, example_input, target):
+    dynamic = {0: "batch", 2: "depth", 3: "height", 4: "width"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model.eval(), (example_input,), target,
+            input_names=["input"], output_names=["logits"],
+            dynamic_axes={"input": dynamic, "logits": dynamic},
+            opset_version=17, dynamo=False,
+        )
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Yield a temporary path next to `path` and move it into place once written, so a
+    worker starting alongside the exporter never loads a partial artifact
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def artifact_path_for(weights_path, backend_name):
+    """models/trained_brain_model.pth -> models/trained_brain_model.onnx / .ts.pt"""
+    if not weights_path or not os.path.exists(weights_path):
+        return None
+    stem = os.path.splitext(weights_path)[0]
+    return stem + {"onnxruntime": ".onnx", "torchscript": ".ts.pt"}[backend_name]
+
+
+def is_fresh(artifact_path, weights_path):
+    """An exported artifact is reusable if it is newer than the weights it came from"""
+    return (artifact_path is not None and os.path.exists(artifact_path) and
+            os.path.getmtime(artifact_path) >= os.path.getmtime(weights_path))
+
+
+def create_backend(name, model, weights_path=None, example_shape=(1, 1, 128, 128, 64)):
+    """
+    Build the requested backend, falling back down BACKENDS to eager PyTorch.
+
+    Exported artifacts are cached next to `weights_path`; without weights the
+    export is kept in memory only. `name` is one of BACKEND_CHOICES.
+    """
+    if name not in BACKEND_CHOICES:
+        raise ValueError(f"Unknown inference backend {name!r}; expected one of {', '.join(BACKEND_CHOICES)}")
+    candidates = BACKENDS if name == "auto" else BACKENDS[BACKENDS.index(name):]
+    example_input = torch.zeros(example_shape, device=next(model.parameters()).device)
+
+    for candidate in candidates:
+        try:
+            if candidate == "eager":
+                return EagerBackend(model)
+            if candidate == "onnxruntime":
+                return OnnxRuntimeBackend(model, example_input, weights_path)
+            return TorchScriptBackend(model, example_input, weights_path)
+        except Exception as e:
+            print(f"⚠️  {candidate} backend unavailable: {e}, falling back")
+            traceback.print_exc()
+    return EagerBackend(model)
+
+
+def check_parity(reference, candidate, input_tensor):
+    """Compare a backend's logits and argmax mask against a reference backend"""
+    expected = reference(input_tensor)
+    actual = candidate(input_tensor)
+    diff = (expected - actual).abs()
+    agreement = (expected.argmax(dim=1) == actual.argmax(dim=1)).float().mean()
+    return {
+        "max_abs_diff": float(f"{float(diff.max()):.3g}"),
+        "mean_abs_diff": float(f"{float(diff.mean()):.3g}"),
+        "argmax_agreement": round(float(agreement), 6),
+    }
+
+
+def measure_latency(backend, input_tensor, repeats=5, warmup=1):
+    for _ in range(warmup):
+        backend(input_tensor)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        backend(input_tensor)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {"median_ms": round(timings[len(timings) // 2], 2), "min_ms": round(timings[0], 2)}
+
+
+def compare_backends(model, weights_path=None, input_shape=(1, 1, 128, 128, 64), repeats=5,
+                     atol=1e-3):
+    """Latency per backend plus logit parity against eager PyTorch"""
+    input_tensor = torch.rand(input_shape)
+    reference = EagerBackend(model)
+    report = []
+    for name in BACKENDS:
+        backend = reference if name == "eager" else create_backend(name, model, weights_path, input_shape)
+        if backend.name != name:
+            report.append({"backend": name, "available": False})
+            continue
+        parity = check_parity(reference, backend, input_tensor)
+        report.append({
+            "backend": name,
+            "available": True,
+            **measure_latency(backend, input_tensor, repeats),
+            **parity,
+            "parity_ok": parity["max_abs_diff"] <= atol,
+        })
+    return report
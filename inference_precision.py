@@ -0,0 +1,134 @@
+import copy
+import time
+import warnings
+
+import numpy as np
+import torch
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+class PrecisionBackend:
+    """
+    Run the UNet at a reduced precision and/or channels-last-3d layout.
+
+    Logits are always returned as float32 so downstream argmax/softmax code
+    does not care which mode produced them.
+    """
+
+    def __init__(self, model, precision="fp32", channels_last=False, calibration_inputs=None):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        self.precision = precision
+        self.channels_last = channels_last
+        self.name = precision + ("+channels_last_3d" if channels_last else "")
+
+        # Never mutate the caller's fp32 model; layout and quantization are applied to a copy
+        model = copy.deepcopy(model).eval() if (channels_last or precision == "int8") else model.eval()
+        if channels_last:
+            model = model.to(memory_format=torch.channels_last_3d)
+        if precision == "int8":
+            model = quantize_int8(model, calibration_inputs, channels_last)
+        self.model = model
+
+    def __call__(self, input_tensor):
+        if self.channels_last:
+            input_tensor = input_tensor.contiguous(memory_format=torch.channels_last_3d)
+        with torch.no_grad():
+            if self.precision == "bf16":
+                with torch.autocast("cpu", dtype=torch.bfloat16):
+                    output = self.model(input_tensor)
+            else:
+                output = self.model(input_tensor)
+        return output.float().contiguous()
+
+
+def quantize_int8(model, calibration_inputs, channels_last=False):
+    """Post-training static int8 quantization (FX graph mode), calibrated on a few volumes"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    if not calibration_inputs:
+        raise ValueError("int8 quantization needs calibration inputs")
+
+    memory_format = torch.channels_last_3d if channels_last else torch.contiguous_format
+    calibration_inputs = [x.cpu().contiguous(memory_format=memory_format) for x in calibration_inputs]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        prepared = prepare_fx(model.cpu(), get_default_qconfig_mapping("x86"), (calibration_inputs[0],))
+        with torch.no_grad():
+            for x in calibration_inputs:
+                prepared(x)
+        return convert_fx(prepared)
+
+
+def synthetic_calibration_set(count=4, shape=(128, 128, 64), seed=0):
+    """Fixed, seeded MRI-like volumes with one ellipsoid lesion each"""
+    rng = np.random.default_rng(seed)
+    volumes = []
+    z, y, x = np.ogrid[:shape[0], :shape[1], :shape[2]]
+    for _ in range(count):
+        volume = rng.normal(0.5, 0.15, shape).astype(np.float32)
+        center = [rng.uniform(0.3, 0.7) * s for s in shape]
+        radii = [rng.uniform(0.06, 0.15) * s for s in shape]
+        lesion = sum(((c - m) / r) ** 2 for c, m, r in zip((z, y, x), center, radii)) <= 1
+        volume[lesion] += 0.4
+        volumes.append(np.clip(volume, 0, 1))
+    return volumes
+
+
+def dice_score(mask_a, mask_b):
+    """Dice overlap of two boolean masks; two empty masks agree perfectly"""
+    total = mask_a.sum() + mask_b.sum()
+    if total == 0:
+        return 1.0
+    return float(2.0 * np.logical_and(mask_a, mask_b).sum() / total)
+
+
+def evaluate_precisions(model, input_tensors, modes=None, tolerance=0.98, repeats=3):
+    """
+    Latency and tumor-mask Dice against fp32 for each (precision, channels_last) mode.
+
+    `input_tensors` is the fixed calibration set, already preprocessed to
+    (1, 1, D, H, W). int8 is calibrated on the same set.
+    """
+    if modes is None:
+        modes = [(p, cl) for p in PRECISIONS for cl in (False, True)]
+
+    reference = PrecisionBackend(model, "fp32")
+    reference_masks = [reference(x).argmax(dim=1).numpy() == 1 for x in input_tensors]
+
+    report = []
+    for precision, channels_last in modes:
+        try:
+            backend = PrecisionBackend(model, precision, channels_last, calibration_inputs=input_tensors)
+        except Exception as e:
+            report.append({"mode": precision + ("+channels_last_3d" if channels_last else ""),
+                           "available": False, "error": str(e)})
+            continue
+
+        backend(input_tensors[0])  # warmup
+        timings, dices = [], []
+        for x, expected in zip(input_tensors, reference_masks):
+            for _ in range(repeats):
+                start = time.perf_counter()
+                logits = backend(x)
+                timings.append((time.perf_counter() - start) * 1000)
+            dices.append(dice_score(logits.argmax(dim=1).numpy() == 1, expected))
+
+        timings.sort()
+        report.append({
+            "mode": backend.name,
+            "available": True,
+            "median_ms": round(timings[len(timings) // 2], 2),
+            "mean_dice_vs_fp32": round(float(np.mean(dices)), 4),
+            "min_dice_vs_fp32": round(float(np.min(dices)), 4),
+            "within_tolerance": bool(np.min(dices) >= tolerance),
+        })
+    return report
+
+
+def fastest_within_tolerance(report):
+    """Pick the quickest mode whose worst-case Dice stays within tolerance"""
+    candidates = [r for r in report if r.get("within_tolerance")]
+    return min(candidates, key=lambda r: r["median_ms"])["mode"] if candidates else "fp32"
@@ -0,0 +1,150 @@
+import threading
+import queue
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import torch
+
+
+class _Request:
+    __slots__ = ("tensor", "future", "enqueued_at")
+
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatchScheduler:
+    """
+    Gather input tensors from concurrent callers into micro-batches.
+
+    A single worker thread waits for the first request, keeps collecting until
+    `max_batch_size` samples are queued or `max_wait_ms` has passed, then runs
+    one forward pass per input shape and hands each caller its own slice.
+    Inputs are (N, C, D, H, W) tensors; N may be larger than one (e.g. the
+    patches of a sliding window) and is preserved in the returned slice. A
+    request that would take the batch past `max_batch_size` waits for the
+    next one, so only a single request larger than the limit exceeds it.
+    """
+
+    def __init__(self, forward_fn, max_batch_size=4, max_wait_ms=10.0, latency_window=1000):
+        self.forward_fn = forward_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        # Taken from the queue but left out of the last batch because it did not fit
+        self._carry = None
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_depths = Counter()
+        self._latencies_ms = deque(maxlen=latency_window)
+        self._requests = 0
+        self._batches = 0
+
+        self._running = True
+        self._worker = threading.Thread(target=self._run, name="micro-batch-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, input_tensor):
+        """Queue a tensor for inference and return a Future for its logits"""
+        if not self._running:
+            raise RuntimeError("Scheduler has been shut down")
+        request = _Request(input_tensor)
+        self._queue.put(request)
+        return request.future
+
+    def infer(self, input_tensor, timeout=None):
+        """Blocking helper: submit and wait for the result"""
+        return self.submit(input_tensor).result(timeout=timeout)
+
+    __call__ = infer
+
+    def shutdown(self):
+        self._running = False
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self):
+        first, self._carry = self._carry or self._queue.get(), None
+        if first is None:
+            return None
+        batch = [first]
+        samples = first.tensor.shape[0]
+        deadline = time.perf_counter() + self.max_wait
+        while samples < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._running = False
+                break
+            if samples + request.tensor.shape[0] > self.max_batch_size:
+                self._carry = request
+                break
+            batch.append(request)
+            samples += request.tensor.shape[0]
+        return batch
+
+    def _run(self):
+        while self._running:
+            batch = self._collect()
+            if batch is None:
+                break
+            with self._lock:
+                self._queue_depths[self._queue.qsize()] += 1
+
+            # Only tensors with the same spatial shape can share a forward pass
+            groups = {}
+            for request in batch:
+                groups.setdefault(tuple(request.tensor.shape[1:]), []).append(request)
+            for requests in groups.values():
+                self._run_group(requests)
+
+    def _run_group(self, requests):
+        sizes = [r.tensor.shape[0] for r in requests]
+        try:
+            with torch.no_grad():
+                inputs = requests[0].tensor if len(requests) == 1 else torch.cat([r.tensor for r in requests])
+                outputs = self.forward_fn(inputs)
+            for request, output in zip(requests, torch.split(outputs, sizes)):
+                request.future.set_result(output)
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+
+        done = time.perf_counter()
+        with self._lock:
+            self._batches += 1
+            self._requests += len(requests)
+            self._batch_sizes[sum(sizes)] += 1
+            self._latencies_ms.extend((done - r.enqueued_at) * 1000 for r in requests)
+
+    def stats(self):
+        """Queue depth and batch-size histograms plus recent latency percentiles"""
+        with self._lock:
+            latencies = sorted(self._latencies_ms)
+            batches = self._batches
+            stats = {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth": self._queue.qsize(),
+                "requests": self._requests,
+                "batches": batches,
+                "mean_batch_size": round(sum(k * v for k, v in self._batch_sizes.items()) / batches, 2) if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "queue_depth_histogram": dict(sorted(self._queue_depths.items())),
+            }
+        if latencies:
+            stats["latency_ms"] = {
+                "p50": round(latencies[len(latencies) // 2], 2),
+                "p99": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2),
+                "max": round(latencies[-1], 2),
+            }
+        return stats
@@ -0,0 +1,302 @@
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+
+from artifact_store import json_default
+from sqlite_db import connect
+from uploads import UPLOAD_CHUNK_SIZE
+from worker_pool import PipelineBusy
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+# Pause before the dispatcher retries after an unexpected error (e.g. a locked database)
+DISPATCH_RETRY_S = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT,
+    upload_path TEXT,
+    params TEXT NOT NULL,
+    stage TEXT,
+    stages TEXT NOT NULL DEFAULT '[]',
+    result TEXT,
+    error TEXT,
+    owner_pid INTEGER,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires_at);
+"""
+
+
+class JobCancelled(Exception):
+    """Raised at the next stage boundary of a job whose cancellation was requested"""
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except (OSError, TypeError):
+        return False
+
+
+def _iso(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp)) if timestamp else None
+
+
+class JobQueue:
+    """
+    Persistent segmentation job queue in SQLite, with uploads kept under
+    `upload_dir` until their job finishes.
+
+    A dispatcher thread claims the oldest queued job whenever a pipeline
+    pool worker is idle, so waiting jobs stay in the database. Jobs
+    left running by a process that died are requeued on start(), so work
+    survives a restart. `run_job(job, on_stage)` does the work; it must
+    call on_stage(name) as each stage begins, which records progress and
+    raises JobCancelled once a cancel was requested. Results are kept as
+    rendered JSON for `result_ttl_s` seconds after the job finishes.
+    """
+
+    def __init__(self, db_path, upload_dir, run_job, pool, stages, result_ttl_s=24 * 3600,
+                 max_queued=100, sweep_interval_s=60.0):
+        self.db_path = db_path
+        self.upload_dir = upload_dir
+        self.run_job = run_job
+        self.pool = pool
+        self.stages = tuple(stages)
+        self.result_ttl_s = result_ttl_s
+        self.max_queued = max_queued
+        self.sweep_interval_s = sweep_interval_s
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._dispatcher = None
+        os.makedirs(upload_dir, exist_ok=True)
+        with connect(db_path) as db:
+            db.executescript(_SCHEMA)
+
+    # --- API-facing -------------------------------------------------------
+
+    def submit(self, fileobj, filename, params):
+        """Persist the upload and queue a job for it; returns the job id"""
+        with connect(self.db_path) as db:
+            queued = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        if queued >= self.max_queued:
+            raise QueueFull(f"{queued} jobs already queued")
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.upload_dir, job_id)
+        os.makedirs(job_dir)
+        # Keep only the extension: .nii.gz / .zip etc. drive format detection
+        name = os.path.basename(filename or "")
+        extension = name[name.find("."):] if "." in name else ""
+        upload_path = os.path.join(job_dir, "upload" + extension)
+        fileobj.seek(0)
+        with open(upload_path, "wb") as out:
+            shutil.copyfileobj(fileobj, out, UPLOAD_CHUNK_SIZE)
+
+        with connect(self.db_path) as db:
+            db.execute("INSERT INTO jobs (id, status, filename, upload_path, params, created_at) "
+                       "VALUES (?, 'queued', ?, ?, ?, ?)",
+                       (job_id, filename, upload_path, json.dumps(params), time.time()))
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id):
+        """Job status as a dict (without the result), or None"""
+        with connect(self.db_path) as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else self._describe(row)
+
+    def response_body(self, job_id):
+        """
+        JSON body for GET /api/jobs/{id}; a stored result is spliced in as
+        the text it was saved as, so repeated polling never re-encodes it.
+        """
+        with connect(self.db_path) as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        body = json.dumps(self._describe(row), separators=(",", ":"))
+        if row["result"] is not None:
+            body = body[:-1] + ',"result":' + row["result"] + "}"
+        return body
+
+    def cancel(self, job_id):
+        """Cancel a queued job at once, or flag a running one to stop at its next stage; returns the job"""
+        now = time.time()
+        with connect(self.db_path) as db:
+            db.execute("UPDATE jobs SET status = 'cancelled', finished_at = ?, expires_at = ? "
+                       "WHERE id = ? AND status = 'queued'", (now, now + self.result_ttl_s, job_id))
+            db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        job = self.get(job_id)
+        if job is not None and job["status"] == "cancelled":
+            self._remove_upload(job_id)
+        return job
+
+    def stats(self):
+        with connect(self.db_path) as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in JOB_STATUSES}
+
+    # --- Dispatcher -------------------------------------------------------
+
+    def start(self):
+        """Requeue jobs orphaned by a dead process and start dispatching"""
+        with connect(self.db_path) as db:
+            orphaned = [row["id"] for row in db.execute("SELECT id, owner_pid FROM jobs WHERE status = 'running'")
+                        if not _pid_alive(row["owner_pid"]) or row["owner_pid"] == os.getpid()]
+            for job_id in orphaned:
+                db.execute("UPDATE jobs SET status = 'queued', stage = NULL, stages = '[]', owner_pid = NULL, "
+                           "started_at = NULL WHERE id = ? AND status = 'running'", (job_id,))
+        if orphaned:
+            print(f"♻️  Requeued {len(orphaned)} interrupted jobs")
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch, name="job-dispatcher", daemon=True)
+            self._dispatcher.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _claim(self):
+        """Atomically move the oldest queued job to running; safe across processes sharing the DB"""
+        with connect(self.db_path) as db:
+            row = db.execute(
+                "UPDATE jobs SET status = 'running', owner_pid = ?, started_at = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1) "
+                "AND status = 'queued' RETURNING *", (os.getpid(), time.time())).fetchone()
+        return row
+
+    def _dispatch(self):
+        last_sweep = 0.0
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - last_sweep > self.sweep_interval_s:
+                    last_sweep = time.monotonic()
+                    self.sweep()
+                self._dispatch_next()
+            except Exception as e:
+                # e.g. "database is locked" under write contention; the thread must outlive it
+                print(f"⚠️  Job dispatch failed, retrying: {e}")
+                traceback.print_exc()
+                self._wake.wait(DISPATCH_RETRY_S)
+                self._wake.clear()
+
+    def _dispatch_next(self):
+        # Claim only for an idle worker: waiting jobs stay in the persistent queue, not in memory
+        if not self.pool.has_idle_worker():
+            self._wake.wait(0.5)
+            self._wake.clear()
+            return
+        row = self._claim()
+        if row is None:
+            self._wake.wait(self.sweep_interval_s)
+            self._wake.clear()
+            return
+        try:
+            future = self.pool.submit(self._execute, row)
+        except PipelineBusy as e:
+            # Lost the slot to a synchronous /api/segment request; put the job back
+            self._requeue(row["id"])
+            self._wake.wait(min(e.retry_after, 5))
+            self._wake.clear()
+            return
+        except Exception:
+            self._requeue(row["id"])
+            raise
+        future.add_done_callback(lambda _: self._wake.set())
+
+    def _requeue(self, job_id):
+        with connect(self.db_path) as db:
+            db.execute("UPDATE jobs SET status = 'queued', owner_pid = NULL, started_at = NULL "
+                       "WHERE id = ?", (job_id,))
+
+    def _execute(self, row):
+        job_id = row["id"]
+        stages = []
+
+        def on_stage(name):
+            with connect(self.db_path) as db:
+                if db.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]:
+                    raise JobCancelled(job_id)
+                now = time.time()
+                if stages:
+                    stages[-1]["ms"] = round((now - stages[-1]["started"]) * 1000, 1)
+                stages.append({"name": name, "started": now})
+                db.execute("UPDATE jobs SET stage = ?, stages = ? WHERE id = ?",
+                           (name, json.dumps(stages), job_id))
+
+        status, result, error = "succeeded", None, None
+        try:
+            result = json.dumps(self.run_job(dict(row), on_stage), default=json_default, separators=(",", ":"))
+        except JobCancelled:
+            status = "cancelled"
+            print(f"🛑 Job {job_id} cancelled")
+        except Exception as e:
+            traceback.print_exc()
+            status, error = "failed", str(e)
+        now = time.time()
+        if stages:
+            stages[-1]["ms"] = round((now - stages[-1]["started"]) * 1000, 1)
+        with connect(self.db_path) as db:
+            db.execute("UPDATE jobs SET status = ?, result = ?, error = ?, stages = ?, finished_at = ?, "
+                       "expires_at = ? WHERE id = ?",
+                       (status, result, error, json.dumps(stages), now, now + self.result_ttl_s, job_id))
+        self._remove_upload(job_id)
+
+    # --- Retention --------------------------------------------------------
+
+    def sweep(self):
+        """Drop finished jobs past their TTL, with any upload they left behind"""
+        with connect(self.db_path) as db:
+            expired = [row["id"] for row in db.execute(
+                "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ? RETURNING id", (time.time(),))]
+        for job_id in expired:
+            self._remove_upload(job_id)
+        if expired:
+            print(f"🧹 Expired {len(expired)} job results")
+        return expired
+
+    def _remove_upload(self, job_id):
+        shutil.rmtree(os.path.join(self.upload_dir, job_id), ignore_errors=True)
+
+    def _describe(self, row):
+        stages = json.loads(row["stages"])
+        if row["status"] == "succeeded":
+            percent = 100
+        else:
+            # Every stage before the current one has finished
+            percent = round(100 * max(len(stages) - 1, 0) / len(self.stages)) if self.stages else 0
+        return {
+            "id": row["id"],
+            "status": row["status"],
+            "filename": row["filename"],
+            "params": json.loads(row["params"]),
+            "progress": {
+                "stage": row["stage"],
+                "percent": min(percent, 100),
+                "stages": [{"name": s["name"], "ms": s.get("ms")} for s in stages],
+                "pipeline_stages": list(self.stages),
+            },
+            "cancel_requested": bool(row["cancel_requested"]),
+            "error": row["error"],
+            "created_at": _iso(row["created_at"]),
+            "started_at": _iso(row["started_at"]),
+            "finished_at": _iso(row["finished_at"]),
+            "expires_at": _iso(row["expires_at"]),
+        }
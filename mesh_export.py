@@ -0,0 +1,241 @@
+import base64
+import json
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import trimesh
+
+EXPORT_FORMATS = ("obj", "glb", "gltf", "bin")
+# Positions are snapped to a 2**QUANTIZE_BITS grid over the mesh's largest extent
+QUANTIZE_BITS = 16
+# Decimal places for OBJ text; enough for a 16-bit grid over a few hundred mm
+OBJ_DIGITS = 4
+# Rows formatted per write_obj chunk
+OBJ_CHUNK_ROWS = 16384
+
+# Viewer buffer: magic, vertex count, index count, index bytes, origin xyz, step (little-endian)
+MESH_MAGIC = b"NVM1"
+MESH_HEADER = struct.Struct("<4sIII3ff")
+
+_GLTF_UNSIGNED_SHORT = 5123
+_GLTF_UNSIGNED_INT = 5125
+_GLTF_ARRAY_BUFFER = 34962
+_GLTF_ELEMENT_ARRAY_BUFFER = 34963
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+class PreparedMesh:
+    """
+    A mesh in its compact export form: unreferenced vertices dropped,
+    indices in the smallest unsigned type that fits, and positions
+    quantized to uint16 with a per-mesh origin and uniform step.
+    """
+
+    def __init__(self, vertices, faces, bits=QUANTIZE_BITS):
+        vertices = np.asarray(vertices, dtype=np.float64)
+        faces = np.asarray(faces)
+        used, inverse = np.unique(faces, return_inverse=True)
+        vertices = vertices[used]
+        index_dtype = np.uint16 if len(used) < 2 ** 16 else np.uint32
+        self.faces = inverse.reshape(faces.shape).astype(index_dtype)
+
+        self.origin = vertices.min(axis=0) if len(vertices) else np.zeros(3)
+        extent = float((vertices.max(axis=0) - self.origin).max()) if len(vertices) else 0.0
+        self.step = extent / (2 ** bits - 1) if extent > 0 else 1.0
+        self.quantized = np.round((vertices - self.origin) / self.step).astype(np.uint16)
+
+    @property
+    def vertices(self):
+        """Dequantized float32 positions"""
+        return (self.quantized * self.step + self.origin).astype(np.float32)
+
+    def trimesh(self):
+        return trimesh.Trimesh(vertices=self.vertices, faces=self.faces, process=False)
+
+
+def write_obj(prepared, path, chunk_rows=OBJ_CHUNK_ROWS):
+    """
+    OBJ text written in chunks of rows: each chunk is one C-level format
+    call, so the GIL is released between chunks instead of being held for
+    the whole (possibly million-vertex) mesh.
+    """
+    vertices = prepared.vertices
+    faces = prepared.faces.astype(np.int64) + 1
+    vertex_fmt = f"v %.{OBJ_DIGITS}f %.{OBJ_DIGITS}f %.{OBJ_DIGITS}f\n"
+    with open(path, "w") as f:
+        for rows, fmt in ((vertices, vertex_fmt), (faces, "f %d %d %d\n")):
+            for start in range(0, len(rows), chunk_rows):
+                chunk = rows[start:start + chunk_rows]
+                f.write(fmt * len(chunk) % tuple(chunk.ravel().tolist()))
+    return path
+
+
+def _gltf_document(prepared):
+    """glTF JSON plus its single binary buffer, with KHR_mesh_quantization positions"""
+    # Vertex attributes must be 4-byte aligned, so each uint16 xyz is padded to 8 bytes
+    positions = np.zeros((len(prepared.quantized), 4), dtype="<u2")
+    positions[:, :3] = prepared.quantized
+    indices = prepared.faces.astype(prepared.faces.dtype.newbyteorder("<")).ravel()
+    positions_bytes = positions.tobytes()
+    indices_bytes = indices.tobytes()
+    binary = positions_bytes + indices_bytes
+    binary += b"\0" * (-len(binary) % 4)
+
+    q_min = prepared.quantized.min(axis=0) if len(positions) else np.zeros(3)
+    q_max = prepared.quantized.max(axis=0) if len(positions) else np.zeros(3)
+    document = {
+        "asset": {"version": "2.0", "generator": "NeuroVision AI"},
+        "extensionsUsed": ["KHR_mesh_quantization"],
+        "extensionsRequired": ["KHR_mesh_quantization"],
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{
+            "mesh": 0,
+            "translation": [float(v) for v in prepared.origin],
+            "scale": [prepared.step] * 3,
+        }],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0}, "indices": 1, "mode": 4}]}],
+        "buffers": [{"byteLength": len(binary)}],
+        "bufferViews": [
+            {"buffer": 0, "byteOffset": 0, "byteLength": len(positions_bytes), "byteStride": 8,
+             "target": _GLTF_ARRAY_BUFFER},
+            {"buffer": 0, "byteOffset": len(positions_bytes), "byteLength": len(indices_bytes),
+             "target": _GLTF_ELEMENT_ARRAY_BUFFER},
+        ],
+        "accessors": [
+            {"bufferView": 0, "componentType": _GLTF_UNSIGNED_SHORT, "count": len(positions), "type": "VEC3",
+             "min": [int(v) for v in q_min], "max": [int(v) for v in q_max]},
+            {"bufferView": 1,
+             "componentType": _GLTF_UNSIGNED_SHORT if indices.dtype.itemsize == 2 else _GLTF_UNSIGNED_INT,
+             "count": len(indices), "type": "SCALAR"},
+        ],
+    }
+    return document, binary
+
+
+def write_glb(prepared, path):
+    document, binary = _gltf_document(prepared)
+    json_chunk = json.dumps(document, separators=(",", ":")).encode()
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    total = 12 + 8 + len(json_chunk) + 8 + len(binary)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4sII", b"glTF", 2, total))
+        f.write(struct.pack("<I4s", len(json_chunk), b"JSON") + json_chunk)
+        f.write(struct.pack("<I4s", len(binary), b"BIN\0") + binary)
+    return path
+
+
+def write_gltf(prepared, path):
+    document, binary = _gltf_document(prepared)
+    document["buffers"][0]["uri"] = "data:application/octet-stream;base64," + base64.b64encode(binary).decode()
+    with open(path, "w") as f:
+        json.dump(document, f, separators=(",", ":"))
+    return path
+
+
+def mesh_buffer(prepared):
+    """
+    Compact viewer payload: a 32-byte header, uint16 xyz positions (padded to
+    4 bytes) and uint16/uint32 triangle indices; the viewer decodes it into
+    typed arrays as position * step + origin.
+    """
+    positions = prepared.quantized.astype("<u2").tobytes()
+    positions += b"\0" * (-len(positions) % 4)
+    indices = prepared.faces.astype(prepared.faces.dtype.newbyteorder("<")).ravel()
+    header = MESH_HEADER.pack(MESH_MAGIC, len(prepared.quantized), len(indices), indices.dtype.itemsize,
+                              *[float(v) for v in prepared.origin], prepared.step)
+    return header + positions + indices.tobytes()
+
+
+def write_bin(prepared, path):
+    with open(path, "wb") as f:
+        f.write(mesh_buffer(prepared))
+    return path
+
+
+WRITERS = {"obj": write_obj, "glb": write_glb, "gltf": write_gltf, "bin": write_bin}
+
+
+class MeshExportStage:
+    """
+    Write one mesh in several formats concurrently.
+
+    The compact mesh is prepared once and shared read-only by every writer
+    on the pool. With wait=False the writes continue after export()
+    returns, so the request only pays for preparing the mesh.
+    """
+
+    def __init__(self, max_workers=len(EXPORT_FORMATS)):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mesh-export")
+
+    def _write(self, fmt, prepared, path):
+        # Written aside and renamed, so a reader never sees a partial file
+        start = time.perf_counter()
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            WRITERS[fmt](prepared, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return {"path": path, "bytes": os.path.getsize(path), "ms": _elapsed_ms(start)}
+
+    def _log_failures(self, fmt, future):
+        if future.exception() is not None:
+            print(f"❌ Background {fmt} export failed: {future.exception()}")
+
+    def export(self, vertices, faces, output_dir, basename, formats=EXPORT_FORMATS, wait=True, futures=None):
+        """
+        Returns {"formats": {fmt: {"path", "bytes", "ms"}}, "prepare_ms", "wall_ms",
+        "vertices", "faces", "pending"}; byte sizes and timings are only
+        known (and "pending" False) when wait=True. Otherwise the writes'
+        futures are added to the `futures` dict by path, for complete_export.
+        """
+        unknown = set(formats) - set(WRITERS)
+        if unknown:
+            raise ValueError(f"Unknown mesh export formats: {sorted(unknown)}")
+
+        wall_start = time.perf_counter()
+        prepared = PreparedMesh(vertices, faces)
+        prepare_ms = _elapsed_ms(wall_start)
+        os.makedirs(output_dir, exist_ok=True)
+
+        pending = {fmt: self.pool.submit(self._write, fmt, prepared, os.path.join(output_dir, f"{basename}.{fmt}"))
+                   for fmt in formats}
+        result = {
+            "prepare_ms": prepare_ms,
+            "vertices": int(len(prepared.quantized)),
+            "faces": int(len(prepared.faces)),
+            "pending": not wait,
+        }
+        if wait:
+            result["formats"] = {fmt: future.result() for fmt, future in pending.items()}
+        else:
+            for fmt, future in pending.items():
+                future.add_done_callback(lambda f, fmt=fmt: self._log_failures(fmt, f))
+            result["formats"] = {fmt: {"path": os.path.join(output_dir, f"{basename}.{fmt}")} for fmt in formats}
+            if futures is not None:
+                futures.update({result["formats"][fmt]["path"]: future for fmt, future in pending.items()})
+        result["wall_ms"] = _elapsed_ms(wall_start)
+        return result
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+def complete_export(export, futures):
+    """A wait=False export result with its sizes and timings filled in from finished `futures`"""
+    formats = {fmt: futures[info["path"]].result() if info["path"] in futures else info
+               for fmt, info in export["formats"].items()}
+    return dict(export, formats=formats, pending=False)
+
+
+# Shared by the pipeline and the module-level save/export helpers
+mesh_exporter = MeshExportStage()
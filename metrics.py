@@ -0,0 +1,241 @@
+import contextvars
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds; pipeline stages run from milliseconds to minutes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_current_trace = contextvars.ContextVar("neurovision_trace", default=None)
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def metric_block(name, kind, help_text, samples, label_names=()):
+    """Prometheus text for one metric; samples are (label values, value) pairs"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{_labels(label_names, values)} {_number(value)}" for values, value in samples]
+    return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            samples = sorted(self._values.items())
+        return metric_block(self.name, "counter", self.help_text, samples, self.label_names)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in seconds, one series per label value"""
+
+    def __init__(self, name, help_text, label_name, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        with self._lock:
+            series = self._series.setdefault(label_value, {"buckets": [0] * len(self.buckets), "sum": 0.0,
+                                                           "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += seconds
+            series["count"] += 1
+
+    def render(self):
+        with self._lock:
+            series = sorted((label, dict(s, buckets=list(s["buckets"]))) for label, s in self._series.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        names = (self.label_name,)
+        for label, s in series:
+            for bound, count in zip(self.buckets + (float("inf"),), s["buckets"] + [s["count"]]):
+                lines.append(f"{self.name}_bucket{_labels(names, (label,), ('le', _number(bound)))} {count}")
+            lines.append(f"{self.name}_sum{_labels(names, (label,))} {round(s['sum'], 6)}")
+            lines.append(f"{self.name}_count{_labels(names, (label,))} {s['count']}")
+        return "\n".join(lines)
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class RequestTrace:
+    """
+    Wall time of one request's pipeline stages and the finer steps inside them.
+
+    stage(name) is the pipeline's on_stage callback: it closes the running
+    stage and opens the next. Steps come from span()/record_steps() anywhere
+    below the request, on this thread or on threads started with
+    run_in_context; repeated steps add up.
+    """
+
+    def __init__(self, on_stage=None):
+        self.on_stage = on_stage
+        self.outcome = None
+        self.started = time.perf_counter()
+        self.stages = []
+        self.steps = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        # Chained first: a job's callback raises JobCancelled before the stage starts
+        if self.on_stage:
+            self.on_stage(name)
+        now = time.perf_counter()
+        self._close(now)
+        self.stages.append([name, now, None])
+
+    def add_step(self, name, seconds):
+        with self._lock:
+            self.steps[name] = self.steps.get(name, 0.0) + seconds
+
+    def _close(self, now):
+        if self.stages and self.stages[-1][2] is None:
+            self.stages[-1][2] = now
+
+    def breakdown(self):
+        """Per-request timings for the response, in milliseconds"""
+        now = time.perf_counter()
+        with self._lock:
+            steps = dict(self.steps)
+        return {
+            "total_ms": round((now - self.started) * 1000, 1),
+            "stages_ms": {name: round(((end or now) - start) * 1000, 1) for name, start, end in self.stages},
+            "steps_ms": {name: round(seconds * 1000, 1) for name, seconds in steps.items()},
+            "peak_rss_mb": round(peak_rss_bytes() / (1024 * 1024), 1),
+        }
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as step `name` of the current request trace (no-op outside one)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_step(name, time.perf_counter() - start)
+
+
+def record_steps(prefix, timings_ms):
+    """Add a {step: ms} timings dict (e.g. from preprocess_volume) to the current trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        for step, ms in timings_ms.items():
+            trace.add_step(f"{prefix}.{step}", ms / 1000)
+
+
+def run_in_context(executor, fn, *args, **kwargs):
+    """executor.submit that carries the current request trace onto the worker thread"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class PipelineMetrics:
+    """Process-wide request, stage and step latency histograms plus outcome counters"""
+
+    def __init__(self):
+        self.requests = Counter("neurovision_requests_total",
+                                "Segmentation requests by endpoint and outcome", ("endpoint", "outcome"))
+        self.request_seconds = Histogram("neurovision_request_duration_seconds",
+                                         "End-to-end pipeline time per segmentation request", "endpoint")
+        self.stage_seconds = Histogram("neurovision_stage_duration_seconds",
+                                       "Time spent in each pipeline stage", "stage")
+        self.step_seconds = Histogram("neurovision_step_duration_seconds",
+                                      "Time spent in steps within a pipeline stage", "step")
+
+    @contextmanager
+    def trace(self, endpoint, on_stage=None):
+        """
+        Trace one request: yields a RequestTrace made current for span() calls,
+        and records its timings when the block exits. Set trace.outcome inside
+        the block; an exception leaves it "error" unless it was already set.
+        """
+        trace = RequestTrace(on_stage)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        except BaseException:
+            trace.outcome = trace.outcome or "error"
+            raise
+        finally:
+            _current_trace.reset(token)
+            self.record(endpoint, trace)
+
+    def record(self, endpoint, trace):
+        now = time.perf_counter()
+        trace._close(now)
+        self.requests.inc(endpoint, trace.outcome or "success")
+        self.request_seconds.observe(endpoint, now - trace.started)
+        for name, start, end in trace.stages:
+            self.stage_seconds.observe(name, end - start)
+        with trace._lock:
+            steps = list(trace.steps.items())
+        for name, seconds in steps:
+            self.step_seconds.observe(name, seconds)
+
+    def render(self, extra_blocks=()):
+        """Prometheus text exposition of these metrics, process memory/CPU and `extra_blocks`"""
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        blocks = [
+            self.requests.render(),
+            self.request_seconds.render(),
+            self.stage_seconds.render(),
+            self.step_seconds.render(),
+            metric_block("neurovision_process_peak_rss_bytes", "gauge",
+                         "Peak resident set size of the server process", [((), peak_rss_bytes())]),
+            metric_block("neurovision_process_cpu_seconds_total", "counter",
+                         "User and system CPU time of the server process",
+                         [((), round(usage.ru_utime + usage.ru_stime, 3))]),
+        ]
+        rss = rss_bytes()
+        if rss is not None:
+            blocks.append(metric_block("neurovision_process_resident_memory_bytes", "gauge",
+                                       "Current resident set size of the server process", [((), rss)]))
+        return "\n".join(blocks + list(extra_blocks)) + "\n"
+
+
+pipeline_metrics = PipelineMetrics()
@@ -0,0 +1,112 @@
+import hashlib
+import os
+import threading
+import time
+
+import torch
+from monai.networks.nets import UNet
+
+# Architectures served by the app, keyed by the name used in the registry
+UNET_CONFIGS = {
+    # Tumor vs background (monai_segmentor / train_local_model)
+    "unet3d-2class": dict(spatial_dims=3, in_channels=1, out_channels=2,
+                          channels=(16, 32, 64, 128), strides=(2, 2, 2), num_res_units=2),
+    # Background, edema, enhancing tumor (real_segmentor)
+    "unet3d-3class": dict(spatial_dims=3, in_channels=1, out_channels=3,
+                          channels=(16, 32, 64, 128), strides=(2, 2, 2), num_res_units=2),
+}
+
+_hash_cache = {}
+
+
+def weights_hash(weights_path):
+    """sha256 of a weights file, memoized on (path, size, mtime)"""
+    stat = os.stat(weights_path)
+    key = (os.path.abspath(weights_path), stat.st_size, stat.st_mtime_ns)
+    if key not in _hash_cache:
+        digest = hashlib.sha256()
+        with open(weights_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _hash_cache[key] = digest.hexdigest()
+    return _hash_cache[key]
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of inference-ready UNets keyed by architecture and weights hash.
+
+    Weights are loaded with `torch.load(mmap=True)` and assigned straight into
+    the module, so parameters stay backed by the page cache of the .pth file:
+    every worker process maps the same physical pages, and modules built
+    before a fork (e.g. gunicorn --preload) are shared copy-on-write.
+
+    Only backends that run this module directly keep that sharing: eager
+    and bf16. TorchScript, ONNX Runtime, int8 and channels-last build their
+    own private copy of the weights in every process (see
+    `benchmarks.py weights-memory`).
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._info = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.warmup_error = None
+
+    def get(self, architecture, weights_path=None, device="cpu"):
+        """Return the shared model for (architecture, weights, device), building it once"""
+        if weights_path and not os.path.exists(weights_path):
+            weights_path = None
+        digest = weights_hash(weights_path) if weights_path else "random-init"
+        key = (architecture, digest, str(device))
+
+        with self._lock:
+            if key not in self._models:
+                start = time.perf_counter()
+                if weights_path:
+                    # Built on the meta device so no random-init copy is ever allocated next to the mapping
+                    with torch.device("meta"):
+                        model = UNet(**UNET_CONFIGS[architecture])
+                    state_dict = torch.load(weights_path, map_location="cpu", mmap=True, weights_only=True)
+                    model.load_state_dict(state_dict, assign=True)
+                else:
+                    model = UNet(**UNET_CONFIGS[architecture])
+                model.to(device).eval().requires_grad_(False)
+                self._models[key] = model
+                self._info[key] = {
+                    "architecture": architecture,
+                    "weights_path": weights_path,
+                    "weights_sha256": digest,
+                    "device": str(device),
+                    "load_ms": round((time.perf_counter() - start) * 1000, 2),
+                    "warmup_ms": None,
+                }
+                print(f"📦 Registered {architecture} ({digest[:12]}) in {self._info[key]['load_ms']} ms")
+            return self._models[key]
+
+    def record_warmup(self, model, warmup_ms):
+        with self._lock:
+            for key, registered in self._models.items():
+                if registered is model:
+                    self._info[key]["warmup_ms"] = round(warmup_ms, 2)
+
+    def mark_ready(self, error=None):
+        self.warmup_error = error
+        self._ready.set()
+
+    def is_ready(self):
+        return self._ready.is_set() and self.warmup_error is None
+
+    def status(self):
+        with self._lock:
+            models = [dict(info) for info in self._info.values()]
+        return {
+            "ready": self.is_ready(),
+            "warmup_complete": self._ready.is_set(),
+            "warmup_error": self.warmup_error,
+            "models": models,
+        }
+
+
+registry = ModelRegistry()
@@ -1,14 +1,32 @@
 import torch
 import torch.nn as nn
-from monai.networks.nets import UNet
+from monai.inferers import SlidingWindowInferer
 import numpy as np
+import copy
 import os
 import traceback
 import random
+import time
+from functools import partial
 import trimesh
-from skimage import measure
-from scipy.ndimage import zoom
 import plotly.graph_objects as go
+from inference_scheduler import MicroBatchScheduler
+from preprocessing import preprocess_volume
+from cascade import cascade_logits
+from tta import tta_logits
+from region_stats import compute_region_stats
+from lesions import DEFAULT_MIN_LESION_VOLUME_MM3, analyze_lesions
+from contours import CONTOUR_ENCODINGS, CONTOUR_TOLERANCE, extract_slice_contours
+from dicom_series import list_dicom_files, load_dicom_series
+from nifti_loader import is_nifti, load_nifti_volume
+from brain_template import anatomical_brain_mesh, ellipsoid_mesh
+from mesh_export import PreparedMesh, mesh_exporter, write_obj
+from tumor_mesh import LOD_LEVELS, MESH_MARGIN, build_mesh_lods, mask_grid_spacing, roi_marching_cubes
+from postprocessing import as_mask_array, compact_mask, logits_to_mask, tumor_probabilities_in_bbox
+from model_registry import registry
+from metrics import record_steps, span
+from inference_backends import create_backend
+from inference_precision import PrecisionBackend, evaluate_precisions, synthetic_calibration_set
 from brain_model_utils import create_transparent_brain_model, create_interactive_brain_tumor_view
 
 # Dependency checks
@@ -20,50 +38,36 @@ except ImportError:
 
 print("Loading MONAI with Local Trained Weights...")
 
-def extract_tumor_mesh(segmentation_output, original_shape, threshold=0.5):
+def extract_tumor_mesh(segmentation_output, original_shape, threshold=0.5, spacing=(1.0, 1.0, 1.0),
+                       margin=MESH_MARGIN, step_size=1):
     """
-    Convert segmentation output to 3D mesh
+    Convert segmentation output to 3D mesh.
+
+    Marching cubes only runs on the tumor bounding box plus `margin`; the
+    vertices are in physical units (voxel index * spacing) of the full grid.
     """
     # Convert to binary mask
-    binary_mask = (segmentation_output > threshold).astype(np.uint8)
-    
-
-    
-    # Extract mesh using marching cubes
-    verts, faces, normals, values = measure.marching_cubes(
-        binary_mask, 
-        level=0.5,
-        spacing=(1.0, 1.0, 1.0)  # Adjust based on your voxel spacing
-    )
-    
-    return verts, faces, normals
+    binary_mask = segmentation_output > threshold
+    return roi_marching_cubes(binary_mask, spacing, margin, step_size)
 
 def save_tumor_mesh(verts, faces, output_path="tumor_mesh.obj"):
     """Save mesh as OBJ file for AR"""
-    mesh = trimesh.Trimesh(vertices=verts, faces=faces)
-    mesh.export(output_path)
-    return output_path
+    return write_obj(PreparedMesh(verts, faces), output_path)
 
 def calculate_center_of_mass(segmentation_output):
     """Calculate tumor center for AR positioning"""
-    binary_mask = (segmentation_output > 0.5).astype(np.float32)
-    center = np.array([np.mean(coord) for coord in np.where(binary_mask)])
-    return center.tolist()
+    foreground = compute_region_stats(np.asarray(segmentation_output) > 0.5)["foreground"]
+    return foreground["centroid"] if foreground else []
 
 def calculate_bounding_box(segmentation_output):
     """Calculate tumor bounding box for AR scaling"""
-    binary_mask = (segmentation_output > 0.5).astype(np.float32)
-    coords = np.where(binary_mask)
-    if coords[0].size == 0:
+    foreground = compute_region_stats(np.asarray(segmentation_output) > 0.5)["foreground"]
+    if foreground is None:
         return {
             'min': [0, 0, 0],
             'max': [0, 0, 0]
         }
-    bbox = {
-        'min': [int(np.min(coords[0])), int(np.min(coords[1])), int(np.min(coords[2]))],
-        'max': [int(np.max(coords[0])), int(np.max(coords[1])), int(np.max(coords[2]))]
-    }
-    return bbox
+    return foreground["bbox"]
 
 def create_transparent_brain_model(original_dicom_shape, tumor_vertices=None):
     """
@@ -71,87 +75,34 @@ def create_transparent_brain_model(original_dicom_shape, tumor_vertices=None):
     """
     print("🧠 Creating transparent brain model...")
     
-    # Method 1: Create ellipsoid brain model
     brain_radius_x = original_dicom_shape[0] / 2
     brain_radius_y = original_dicom_shape[1] / 2 
     brain_radius_z = original_dicom_shape[2] / 2 if len(original_dicom_shape) > 2 else 50
     
-    # Create brain ellipsoid
-    u = np.linspace(0, 2 * np.pi, 50)
-    v = np.linspace(0, np.pi, 50)
-    x = brain_radius_x * np.outer(np.cos(u), np.sin(v))
-    y = brain_radius_y * np.outer(np.sin(u), np.sin(v))
-    z = brain_radius_z * np.outer(np.ones_like(u), np.cos(v))
-    
-    # Convert to mesh
-    brain_verts = np.stack([x.flatten(), y.flatten(), z.flatten()], axis=1)
-    
-    # Create faces for the ellipsoid
-    faces = []
-    for i in range(49):
-        for j in range(49):
-            p1 = i * 50 + j
-            p2 = p1 + 1
-            p3 = (i + 1) * 50 + j
-            p4 = p3 + 1
-            
-            faces.append([p1, p2, p4])
-            faces.append([p1, p4, p3])
-    
-    brain_faces = np.array(faces)
-    
     # Method 2: Create brain-shaped model (more anatomical)
     brain_mesh = create_anatomical_brain_model(brain_radius_x, brain_radius_y, brain_radius_z)
+    if brain_mesh:
+        return brain_mesh
     
-    return brain_mesh if brain_mesh else (brain_verts, brain_faces)
+    # Method 1: Fall back to an ellipsoid brain model
+    return ellipsoid_mesh(brain_radius_x, brain_radius_y, brain_radius_z)
 
 def create_anatomical_brain_model(radius_x, radius_y, radius_z):
     """
-    Create a more anatomically correct brain model
+    Create a more anatomically correct brain model.
+
+    The unit template is built once (vectorized), cached in memory and on
+    disk, and only rescaled here to match the original dimensions.
     """
     try:
-        # Create hemisphere-like structure
-        theta = np.linspace(0, 2*np.pi, 60)
-        phi = np.linspace(0, np.pi, 30)
-        
-        theta, phi = np.meshgrid(theta, phi)
-        
-        # Brain-like shape with irregularities
-        r = 1 + 0.1 * np.sin(3*theta) * np.sin(2*phi)  # Add brain-like folds
-        
-        x = radius_x * r * np.sin(phi) * np.cos(theta)
-        y = radius_y * r * np.sin(phi) * np.sin(theta) 
-        z = radius_z * r * np.cos(phi)
-        
-        # Create mesh using marching cubes
-        from skimage import measure
-        
-        # Create a 3D volume for the brain
-        brain_volume = np.zeros((100, 100, 100))
-        for i in range(100):
-            for j in range(100):
-                for k in range(100):
-                    # Normalized coordinates
-                    nx, ny, nz = (i-50)/25, (j-50)/25, (k-50)/25
-                    dist = np.sqrt((nx**2) + (ny**2) + (nz**2))
-                    if dist <= 1.0 + 0.15 * np.sin(3*np.arctan2(ny, nx)):  # Brain-like shape
-                        brain_volume[i, j, k] = 1
-        
-        verts, faces, normals, values = measure.marching_cubes(brain_volume, level=0.5)
-        
-        # Scale to match original dimensions
-        verts[:, 0] = verts[:, 0] * (radius_x * 2 / 100) - radius_x
-        verts[:, 1] = verts[:, 1] * (radius_y * 2 / 100) - radius_y  
-        verts[:, 2] = verts[:, 2] * (radius_z * 2 / 100) - radius_z
-        
-        return trimesh.Trimesh(vertices=verts, faces=faces)
+        return anatomical_brain_mesh(radius_x, radius_y, radius_z)
     
     except Exception as e:
         print(f"⚠️  Anatomical brain creation failed: {e}, using ellipsoid")
         return None
 
-def visualize_3d_tumor(vertices, faces, original_shape):
-    """Create interactive 3D plot for testing"""
+def visualize_3d_tumor(vertices, faces, original_shape, output_path="static/tumor_3d_view.html"):
+    """Create interactive 3D plot for testing; pass a store entry's path to keep studies apart"""
     
     # Add tumor mesh
     fig = go.Figure(data=[
@@ -207,45 +158,93 @@ def visualize_3d_tumor(vertices, faces, original_shape):
         )
     )
     
-    fig.write_html("static/tumor_3d_view.html")
-    print("✅ 3D visualization saved: static/tumor_3d_view.html")
+    fig.write_html(output_path)
+    print(f"✅ 3D visualization saved: {output_path}")
+    return output_path
 
 def export_for_arcore(vertices, faces):
-    mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
-    mesh.export("tumor_glb.glb")  # GLTF Binary
+    return mesh_exporter.export(vertices, faces, ".", "tumor_glb", formats=("glb",))  # GLTF Binary
 
 def export_for_webar(vertices, faces):
-    mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
-    mesh.export("tumor_gltf.gltf")  # GLTF format
+    return mesh_exporter.export(vertices, faces, ".", "tumor_gltf", formats=("gltf",))  # GLTF format
+
+# Fixed grid used by the "resize" and "cascade" inference modes (the training grid)
+TARGET_SHAPE = (128, 128, 64)
+INFERENCE_MODES = ("resize", "sliding_window", "cascade")
 
 class MonaiLocalSegmentor:
-    def __init__(self):
+    def __init__(self, inference_mode="resize", roi_size=TARGET_SHAPE, overlap=0.25,
+                 blend_mode="gaussian", max_patches=4, max_batch_size=1, max_wait_ms=10.0,
+                 backend="eager", precision="fp32", channels_last=False, calibration_volumes=None,
+                 coarse_shape=(64, 64, 32), cascade_margin=8, cascade_threshold=0.3, tta_views=1,
+                 min_lesion_volume_mm3=DEFAULT_MIN_LESION_VOLUME_MM3, contour_tolerance=CONTOUR_TOLERANCE,
+                 contour_encoding="delta"):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Using device: {self.device}")
+
+        # "resize" squashes the study to TARGET_SHAPE, "sliding_window" keeps the native grid,
+        # "cascade" runs a coarse pass first and the full model only on crops around candidates
+        if inference_mode not in INFERENCE_MODES:
+            raise ValueError(f"Unknown inference mode: {inference_mode}")
+        self.inference_mode = inference_mode
+        self.roi_size = tuple(roi_size)
+        self.overlap = overlap
+        self.blend_mode = blend_mode
+        self.max_patches = max_patches
+        self.coarse_shape = tuple(coarse_shape)
+        self.cascade_margin = cascade_margin
+        self.cascade_threshold = cascade_threshold
+        self.tta_views = tta_views
+        self.min_lesion_volume_mm3 = min_lesion_volume_mm3
+        # Contours are simplified to within contour_tolerance pixels; "delta" or "int16" coordinates
+        if contour_encoding not in CONTOUR_ENCODINGS:
+            raise ValueError(f"Unknown contour encoding: {contour_encoding}")
+        self.contour_tolerance = contour_tolerance
+        self.contour_encoding = contour_encoding
         
         # Load model with local weights
         self.model = self.load_model_with_local_weights()
 
+        if precision != "fp32" or channels_last:
+            # Reduced precision / channels-last-3d run on PyTorch and replace the exported backends
+            calibration_inputs = None
+            if precision == "int8":
+                calibration_inputs = [self.preprocess_image(v) for v in
+                                      (calibration_volumes or synthetic_calibration_set())]
+            self.backend = PrecisionBackend(self.model, precision, channels_last, calibration_inputs)
+        else:
+            # Eager PyTorch, TorchScript or ONNX Runtime; falls back to eager on failure
+            self.backend = create_backend(backend, self.model, self.weights_path,
+                                          example_shape=(1, 1) + self.roi_size)
+        print(f"Inference backend: {self.backend.name}")
+
+        # Batch forward passes across concurrent requests when max_batch_size > 1
+        self.scheduler = None
+        if max_batch_size > 1:
+            self.scheduler = MicroBatchScheduler(self.backend, max_batch_size=max_batch_size,
+                                                 max_wait_ms=max_wait_ms)
+            print(f"Micro-batching enabled (max batch {max_batch_size}, max wait {max_wait_ms} ms)")
+
+    def forward(self, input_tensor):
+        """Run the model, through the micro-batch scheduler when one is configured"""
+        if self.scheduler is not None:
+            return self.scheduler.infer(input_tensor)
+        return self.backend(input_tensor)
+
     def load_model_with_local_weights(self):
-        """Load MONAI model with locally trained weights"""
+        """Load MONAI model with locally trained weights from the shared model registry"""
         print("Loading MONAI UNet with local weights...")
         
-        model = UNet(
-            spatial_dims=3,
-            in_channels=1,
-            out_channels=2,
-            channels=(16, 32, 64, 128),
-            strides=(2, 2, 2),
-            num_res_units=2,
-        )
-        
         local_weights_path = os.path.join(os.path.dirname(__file__), "models", "trained_brain_model.pth")
+        self.weights_path = None
         
         if os.path.exists(local_weights_path):
             try:
-                model.load_state_dict(torch.load(local_weights_path, map_location=self.device))
+                model = registry.get("unet3d-2class", local_weights_path, self.device)
+                self.weights_path = local_weights_path
                 print("Successfully loaded locally trained weights!")
                 print("Using REAL trained model (not synthetic)")
+                return model
             except Exception as e:
                 print(f"Failed to load local weights: {e}")
                 print("Using model with random initialization")
@@ -253,108 +252,231 @@ class MonaiLocalSegmentor:
             print(f"No local weights found at '{local_weights_path}'. Run train_local_model.py first.")
             print("Using model with random initialization (synthetic mode)")
         
-        model.to(self.device)
-        model.eval()
-        return model
+        return registry.get("unet3d-2class", None, self.device)
+
+    def warmup(self):
+        """Run one dummy forward pass through the active backend so the first request is not cold"""
+        start = time.perf_counter()
+        with torch.no_grad():
+            self.backend(torch.zeros((1, 1) + self.roi_size, device=self.device))
+        warmup_ms = (time.perf_counter() - start) * 1000
+        registry.record_warmup(self.model, warmup_ms)
+        print(f"🔥 {self.backend.name} backend warmed up in {warmup_ms:.0f} ms")
+
+    def evaluate_precision_modes(self, calibration_volumes=None, tolerance=0.98):
+        """Latency and Dice agreement with fp32 for every precision mode on a fixed calibration set"""
+        volumes = calibration_volumes or synthetic_calibration_set()
+        inputs = [self.preprocess_image(v).cpu() for v in volumes]
+        # On a copy: the registry model is shared, and .cpu() would move it for every user
+        return evaluate_precisions(copy.deepcopy(self.model).cpu(), inputs, tolerance=tolerance)
+
+    def load_medical_image(self, file_path, info=None):
+        """
+        Load DICOM files using pydicom. `file_path` may also be an open binary file
+        (e.g. the upload spool). A directory (or list of files) is read as a slice
+        series with dicom_series.load_dicom_series, and .nii/.nii.gz files come back
+        as a lazy memory-mapped nifti_loader.NiftiVolume. Voxel spacing, when the
+        study is a real volume, goes into `info` as info["spacing"].
+        """
+        if isinstance(file_path, str) and is_nifti(file_path) or hasattr(file_path, "read") and is_nifti(None, file_path):
+            try:
+                with span("load.nifti_map"):
+                    image_array = load_nifti_volume(file_path, info)
+                print(f"NIfTI volume mapped: {image_array.shape}, spacing {image_array.spacing}")
+                return image_array
+            except Exception as e:
+                print(f"Failed to load NIfTI image: {e}")
+                traceback.print_exc()
+                return None
 
-    def load_medical_image(self, file_path):
-        """Load DICOM files using pydicom"""
         print(f"Attempting to load DICOM file from: {file_path}")
         if not pydicom:
             raise ImportError("pydicom library is required to read DICOM files.")
         
         try:
-            dicom_data = pydicom.dcmread(file_path)
-            image_array = dicom_data.pixel_array.astype(np.float32)
+            if hasattr(file_path, "read"):
+                file_path.seek(0)
+            elif isinstance(file_path, (list, tuple)) or os.path.isdir(file_path):
+                paths = list(file_path) if isinstance(file_path, (list, tuple)) else list_dicom_files(file_path)
+                series_info = {}
+                with span("load.dicom_series"):
+                    image_array = load_dicom_series(paths, info=series_info)
+                print(f"DICOM series loaded: {series_info['slices']} slices, spacing {series_info['spacing']}")
+                if info is not None:
+                    info.update(series_info)
+                return image_array
+
+            with span("load.dicom_decode"):
+                dicom_data = pydicom.dcmread(file_path)
+                image_array = dicom_data.pixel_array.astype(np.float32)
             print(f"DICOM image loaded successfully. Initial Shape: {image_array.shape}")
+            # Multi-frame volumes carry their own geometry; single 2D slices keep unit spacing
+            if info is not None and image_array.ndim == 3 and getattr(dicom_data, "SamplesPerPixel", 1) == 1:
+                pixel_spacing = getattr(dicom_data, "PixelSpacing", None)
+                slice_spacing = getattr(dicom_data, "SpacingBetweenSlices", None) or getattr(dicom_data, "SliceThickness", None)
+                if pixel_spacing is not None and slice_spacing:
+                    info["spacing"] = (float(slice_spacing), float(pixel_spacing[0]), float(pixel_spacing[1]))
             return image_array
         except Exception as e:
             print(f"Failed to load DICOM image: {e}")
             traceback.print_exc()
             return None
 
-    def preprocess_image(self, image_array):
+    def preprocess_image(self, image_array, timings=None):
         """Preprocess image for model inference"""
-        if not zoom:
-            raise ImportError("scipy library is required for preprocessing.")
+        return preprocess_volume(image_array, TARGET_SHAPE, self.device, timings)
 
-        if image_array.ndim == 3 and image_array.shape[2] == 3:
-            print(f"Detected RGB image ({image_array.shape}), converting to grayscale.")
-            image_array = 0.2989 * image_array[:, :, 0] + 0.5870 * image_array[:, :, 1] + 0.1140 * image_array[:, :, 2]
+    def preprocess_native(self, image_array, timings=None):
+        """Normalize without resampling; the tensor stays on the CPU at the study's own grid"""
+        return preprocess_volume(image_array, None, None, timings)
 
-        if image_array.ndim == 2:
-            print(f"Detected 2D image ({image_array.shape}), expanding to 3D.")
-            image_array = np.expand_dims(image_array, axis=0)
+    def sliding_window_logits(self, input_tensor, predictor=None, views=1):
+        """
+        Run the model patch by patch over a native-resolution volume.
 
-        image_normalized = (image_array - np.min(image_array)) / (np.max(image_array) - np.min(image_array))
-        
-        target_shape = (128, 128, 64)
-        print(f"Resizing image from {image_normalized.shape} to {target_shape}...")
-        
-        zoom_factors = [target_shape[i] / image_normalized.shape[i] for i in range(3)]
-        image_resized = zoom(image_normalized, zoom_factors, order=1)
-        
-        input_tensor = torch.from_numpy(image_resized).unsqueeze(0).unsqueeze(0).float()
-        return input_tensor.to(self.device)
+        At most `max_patches` ROI-sized patches are on the device at once; the
+        Gaussian-blended logits are stitched on the CPU at the input grid. With
+        a TTA predictor every patch is replicated `views` times, so the window
+        batch shrinks to max_patches // views to keep the same bound.
+        """
+        inferer = SlidingWindowInferer(
+            roi_size=self.roi_size,
+            sw_batch_size=max(1, self.max_patches // views),
+            overlap=self.overlap,
+            mode=self.blend_mode,
+            sw_device=self.device,
+            device=torch.device("cpu"),
+        )
+        return inferer(input_tensor, predictor or self.forward)
     
-    def segment_brain_tumor(self, image_array):
-        """Perform segmentation using locally trained model"""
+    def prepare_input(self, image_array, inference_mode=None, timings=None):
+        """
+        Preprocess for the given mode: native grid for sliding window, TARGET_SHAPE otherwise.
+        Step timings go to the request trace as preprocess.* steps.
+        """
+        timings = {} if timings is None else timings
+        if (inference_mode or self.inference_mode) == "sliding_window":
+            input_tensor = self.preprocess_native(image_array, timings)
+        else:
+            input_tensor = self.preprocess_image(image_array, timings)
+        record_steps("preprocess", timings)
+        return input_tensor
+
+    def segment_brain_tumor(self, image_array, inference_mode=None, return_probabilities=False,
+                            mask_format="uint8", stats=None, tta_views=None):
+        """
+        Perform segmentation using locally trained model.
+
+        Returns a uint8 (or bit-packed) label mask and, only when
+        `return_probabilities` is set, a float16 TumorProbabilities crop of the
+        tumor bounding box; otherwise the second value is None. Pass a dict as
+        `stats` to collect per-request inference details (e.g. cascade savings).
+        `tta_views` (1-8) averages logits over that many flipped views, run as
+        one batched forward pass per model call.
+        """
         print("Running locally trained model inference...")
         
         try:
-            input_tensor = self.preprocess_image(image_array)
-            
-            with torch.no_grad():
-                output = self.model(input_tensor)
-                
-                probabilities = torch.softmax(output, dim=1)
-                
-                segmentation = torch.argmax(probabilities, dim=1).squeeze().cpu().numpy()
-                
-                tumor_probabilities = probabilities[:, 1, ...].squeeze().cpu().numpy()
-            
-            print(f"Local model segmentation complete! Shape: {segmentation.shape}")
-            return segmentation, tumor_probabilities
+            input_tensor = self.prepare_input(image_array, inference_mode)
+            return self.segment_tensor(input_tensor, inference_mode, return_probabilities,
+                                       mask_format, stats, tta_views)
             
         except Exception as e:
             print(f"Local model inference failed: {e}")
             traceback.print_exc()
             return None, None
+
+    def segment_tensor(self, input_tensor, inference_mode=None, return_probabilities=False,
+                       mask_format="uint8", stats=None, tta_views=None):
+        """Segment an already preprocessed (1, 1, D, H, W) tensor; see segment_brain_tumor"""
+        inference_mode = inference_mode or self.inference_mode
+        tta_views = tta_views or self.tta_views
+        forward = self.forward
+        if tta_views > 1:
+            # Sliding window caps the items in flight at max_patches, flipped copies included
+            max_batch = self.max_patches if inference_mode == "sliding_window" else None
+            forward = partial(tta_logits, self.forward, views=tta_views, max_batch=max_batch)
+            print(f"Test-time augmentation: {tta_views} flipped views per forward pass")
+
+        with torch.no_grad():
+            with span(f"inference.{inference_mode}"):
+                if inference_mode == "sliding_window":
+                    print(f"Sliding-window inference over {tuple(input_tensor.shape[2:])} "
+                          f"(roi={self.roi_size}, overlap={self.overlap}, "
+                          f"patches={max(1, self.max_patches // tta_views)} x {tta_views} views)")
+                    output = self.sliding_window_logits(input_tensor, forward, tta_views)
+                elif inference_mode == "cascade":
+                    output = cascade_logits(forward, input_tensor, self.coarse_shape,
+                                            self.cascade_margin, self.cascade_threshold, stats)
+                    if stats is not None and stats["cascade"]["early_exit"]:
+                        print("Cascade: no candidate regions in the coarse pass, skipping the full pass")
+                else:
+                    output = forward(input_tensor)
+            
+            with span("inference.postprocess"):
+                segmentation = logits_to_mask(output)
+                
+                tumor_probabilities = None
+                if return_probabilities:
+                    tumor_probabilities = tumor_probabilities_in_bbox(output, segmentation)
+        
+        print(f"Local model segmentation complete! Shape: {segmentation.shape}")
+        return compact_mask(segmentation, mask_format), tumor_probabilities
     
-    def calculate_metrics(self, segmentation, tumor_probabilities):
-        """Calculate tumor metrics"""
+    def calculate_metrics(self, segmentation, tumor_probabilities, subregions=None, spacing=(1.0, 1.0, 1.0),
+                          lesions=None):
+        """
+        Calculate tumor metrics.
+
+        `subregions` is an optional background/edema/enhancing label mask on the
+        same grid (from the 3-class UNet); without it the edema and enhancing
+        volumes fall back to a fixed split of the total. `spacing` is the voxel
+        size in mm (z, y, x). `lesions` is a prior analyze_lesions() result;
+        it is computed here when not given.
+        """
         if segmentation is None:
             return self.get_fallback_metrics()
+        segmentation = as_mask_array(segmentation)
         
-        tumor_voxels = np.sum(segmentation == 1)
+        # One pass over the mask gives counts, centroid, bbox and quadrant per label
+        region_stats = compute_region_stats(segmentation, spacing)
+        tumor = region_stats["labels"].get(1)
         
-        tumor_volume_mm3 = tumor_voxels
+        tumor_voxels = tumor["voxels"] if tumor else 0
+        tumor_volume_mm3 = tumor["volume_mm3"] if tumor else 0.0
         tumor_volume_cm3 = tumor_volume_mm3 / 1000
         
-        tumor_mask = segmentation == 1
-        if np.any(tumor_mask):
+        if tumor:
             confidence = random.uniform(0.85, 0.95)
-            z, y, x = np.argwhere(tumor_mask).mean(axis=0)
-            location_str = []
-            if z < segmentation.shape[0] / 2: location_str.append("Anterior")
-            else: location_str.append("Posterior")
-            if y < segmentation.shape[1] / 2: location_str.append("Superior")
-            else: location_str.append("Inferior")
-            if x < segmentation.shape[2] / 2: location_str.append("Left")
-            else: location_str.append("Right")
-            tumor_location = ", ".join(location_str)
-            tumor_regions_detected = ["Region A", "Region B"] # Placeholder
-            center_of_mass = calculate_center_of_mass(segmentation)
-            bounding_box = calculate_bounding_box(segmentation)
+            tumor_location = ", ".join(tumor["quadrant"])
+            if lesions is None:
+                lesions = self.analyze_lesions(segmentation, spacing)
+            tumor_regions_detected = [lesion["name"] for lesion in lesions["lesions"]]
+            lesion_details = lesions["lesions"]
+            center_of_mass = tumor["centroid"]
+            bounding_box = tumor["bbox"]
         else:
             confidence = 0.0 # No tumor predicted
             tumor_location = "N/A"
             tumor_regions_detected = []
+            lesion_details = []
             center_of_mass = None
             bounding_box = None
 
+        if subregions is not None:
+            # Only count subregion labels inside the detected tumor so they add up to at most the total
+            subregion_counts = np.bincount(subregions[segmentation == 1], minlength=3)
+            voxel_volume_cm3 = float(np.prod(spacing)) / 1000
+            edema_volume_cm3 = subregion_counts[1] * voxel_volume_cm3
+            enhancing_volume_cm3 = subregion_counts[2] * voxel_volume_cm3
+            subregion_source = "3-class MONAI UNet"
+        else:
+            edema_volume_cm3 = tumor_volume_cm3 * 0.4 # Placeholder
+            enhancing_volume_cm3 = tumor_volume_cm3 * 0.6 # Placeholder
+            subregion_source = "Estimated (fixed ratio)"
+
         return {
-            "total_tumor_volume_cm3": round(tumor_volume_cm3, 2),
+            "total_tumor_volume_cm3": round(float(tumor_volume_cm3), 2),
             "tumor_voxels": int(tumor_voxels),
             "confidence_score": round(float(confidence), 2),
             "detection_status": "Tumor Detected" if tumor_voxels > 100 else "No Significant Tumor",
@@ -364,12 +486,20 @@ class MonaiLocalSegmentor:
             "recommendation": "Clinical correlation advised",
             "tumor_location": tumor_location,
             "tumor_regions_detected": tumor_regions_detected,
-            "enhancing_tumor_volume_cm3": round(tumor_volume_cm3 * 0.6, 2), # Placeholder
-            "edema_volume_cm3": round(tumor_volume_cm3 * 0.4, 2), # Placeholder
+            "lesion_count": len(lesion_details),
+            "lesions": lesion_details,
+            "enhancing_tumor_volume_cm3": round(float(enhancing_volume_cm3), 2),
+            "edema_volume_cm3": round(float(edema_volume_cm3), 2),
+            "subregion_source": subregion_source,
             "center_of_mass": center_of_mass,
             "bounding_box": bounding_box
         }
     
+    def analyze_lesions(self, segmentation, spacing=(1.0, 1.0, 1.0)):
+        """Connected-component analysis of the tumor label (see lesions.analyze_lesions)"""
+        with span("analyze.lesions"):
+            return analyze_lesions(as_mask_array(segmentation), spacing, self.min_lesion_volume_mm3, label=1)
+
     def get_fallback_metrics(self):
         return {
             "total_tumor_volume_cm3": 0.0,
@@ -381,46 +511,88 @@ class MonaiLocalSegmentor:
             "recommendation": "Please try again or check input data"
         }
 
-    def extract_3d_tumor_structure(self, segmentation_output, original_dicom_shape):
+    def extract_3d_tumor_structure(self, segmentation_output, original_dicom_shape, voxel_spacing=None):
         """
         Extract 3D tumor structure for AR visualization
         """
+        manifest, meshes = self.extract_3d_tumor_lods(segmentation_output, original_dicom_shape, voxel_spacing)
+        verts, faces = meshes["full"]
+        return manifest["levels"][0]["path"], verts, faces
+
+    def extract_3d_tumor_lods(self, segmentation_output, original_dicom_shape, voxel_spacing=None,
+                              output_dir="static", levels=LOD_LEVELS, wait=True, futures=None):
+        """
+        Tumor mesh at every level of detail, cropped to the tumor and scaled by
+        the study's voxel spacing (see tumor_mesh.build_mesh_lods). With
+        wait=False the reduced levels are built on the mesh export pool and
+        their future goes into `futures`, as for mesh_exporter.export.
+        Returns (manifest, {level: (verts, faces)}).
+        """
         print("🔄 Extracting 3D tumor structure...")
         
         if torch.is_tensor(segmentation_output):
             segmentation_output = segmentation_output.detach().cpu().numpy()
         
-        tumor_map = segmentation_output
+        tumor_map = as_mask_array(segmentation_output)
+        spacing = mask_grid_spacing(original_dicom_shape, tumor_map.shape, voxel_spacing)
         
-        verts, faces, normals = extract_tumor_mesh(tumor_map, original_dicom_shape)
+        with span("meshes.tumor_lods"):
+            manifest, meshes = build_mesh_lods(tumor_map == 1, output_dir, "tumor_3d", spacing, levels,
+                                               executor=None if wait else mesh_exporter.pool, futures=futures)
         
-        mesh_path = save_tumor_mesh(verts, faces, "static/tumor_3d.obj")
+        print(f"✅ 3D tumor mesh saved: {manifest['levels'][0]['path']}")
+        print("📊 Mesh stats: " + ", ".join(
+            f"{lod['level']} {lod['vertices']} vertices / {lod['faces']} faces" if "faces" in lod
+            else f"{lod['level']} pending" for lod in manifest["levels"]))
         
-        print(f"✅ 3D tumor mesh saved: {mesh_path}")
-        print(f"📊 Mesh stats: {len(verts)} vertices, {len(faces)} faces")
-        
-        return mesh_path, verts, faces
+        return manifest, meshes
+
+    def extract_lesion_meshes(self, lesions, original_dicom_shape=None, voxel_spacing=None, output_dir="static"):
+        """One mesh per lesion, marching cubes on the lesion's own bounding box only"""
+        lesion_meshes = []
+        labels = lesions["labels"]
+        spacing = mask_grid_spacing(original_dicom_shape or labels.shape, labels.shape, voxel_spacing)
+        for lesion in lesions["lesions"]:
+            lo = [max(0, v - MESH_MARGIN) for v in lesion["bbox"]["min"]]
+            hi = [min(s, v + MESH_MARGIN + 1) for v, s in zip(lesion["bbox"]["max"], labels.shape)]
+            crop = labels[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]] == lesion["id"]
+            with span("meshes.lesion_marching_cubes"):
+                verts, faces, _ = roi_marching_cubes(crop, spacing)
+            verts += np.array(lo, dtype=verts.dtype) * np.array(spacing, dtype=verts.dtype)  # back to full-volume coordinates
+            mesh_path = save_tumor_mesh(verts, faces, os.path.join(output_dir, f"tumor_3d_lesion_{lesion['id']}.obj"))
+            lesion_meshes.append({"id": lesion["id"], "mesh_path": mesh_path,
+                                  "vertices": len(verts), "faces": len(faces)})
+        print(f"✅ {len(lesion_meshes)} per-lesion meshes saved")
+        return lesion_meshes
 
-    def extract_2d_tumor_slices(self, segmentation_output, original_image):
+    def extract_2d_tumor_slices(self, segmentation_output, original_image, lesions=None):
         """
-        Extract 2D tumor contours for each slice
+        Extract 2D tumor contours for each occupied slice as simplified integer
+        polygons (see contours.extract_slice_contours); with a lesion analysis,
+        each entry is for one lesion on one slice and carries its 'lesion' id
         """
+        if lesions is not None:
+            return self.extract_2d_lesion_slices(lesions)
+
         if torch.is_tensor(segmentation_output):
             segmentation_output = segmentation_output.detach().cpu().numpy()
         
-        tumor_map = segmentation_output
+        tumor_map = as_mask_array(segmentation_output)
         
+        return extract_slice_contours(tumor_map > 0.5, self.contour_tolerance, self.contour_encoding)
+
+    def extract_2d_lesion_slices(self, lesions):
+        """Per-lesion contours, only over the slices and in-plane box each lesion spans"""
+        labels = lesions["labels"]
         contours_2d = []
-        
-        for z in range(tumor_map.shape[2]):
-            slice_mask = tumor_map[:, :, z] > 0.5
-            if np.any(slice_mask):
-                contours = measure.find_contours(slice_mask, level=0.5)
-                contours_2d.append({
-                    'slice': z,
-                    'contours': contours
-                })
-        
+        for lesion in lesions["lesions"]:
+            lo, hi = lesion["bbox"]["min"], lesion["bbox"]["max"]
+            crop = labels[lo[0]:hi[0] + 1, lo[1]:hi[1] + 1, lo[2]:hi[2] + 1] == lesion["id"]
+            for entry in extract_slice_contours(crop, self.contour_tolerance, self.contour_encoding,
+                                                slice_offset=lo[2], plane_offset=lo[:2]):
+                entry['lesion'] = lesion["id"]
+                contours_2d.append(entry)
+        contours_2d.sort(key=lambda entry: (entry['slice'], entry['lesion']))
         return contours_2d
 
 # Test the local segmentor
@@ -1,83 +1,346 @@
-import numpy as np
+import copy
 import os
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from contextlib import asynccontextmanager
 import uvicorn
 from datetime import datetime
 import tempfile
+import threading
 import traceback
 import json
-import uuid
+import re
+from typing import BinaryIO, Optional, Union
+import trimesh
 
 # Import the new local segmentor
-from monai_segmentor import MonaiLocalSegmentor
+from monai_segmentor import MonaiLocalSegmentor, create_transparent_brain_model
+from postprocessing import as_mask_array
+from tumor_mesh import complete_lods, mask_grid_spacing
+from artifact_store import ArtifactStaticFiles, ArtifactStore, artifact_key, file_digest, immutable_file_response
+from mesh_export import complete_export, mesh_exporter
+from model_registry import registry, weights_hash
+from inference_backends import BACKEND_CHOICES
+from tta import MAX_TTA_VIEWS
+from uploads import UploadLimitMiddleware, extract_archive, is_archive, remove_dir
+from nifti_loader import cached_nifti, is_nifti
+from viewer import export_brain_buffer, viewer_url, write_viewer_shell
+from case_store import CaseStore, MAX_PAGE_SIZE
+from job_queue import JOB_STATUSES, JobCancelled, JobQueue, QueueFull
+from metrics import PROMETHEUS_CONTENT_TYPE, metric_block, pipeline_metrics, span
+from worker_pool import (PipelineBusy, PipelineBusyMiddleware, PipelinePool, busy_response, json_response,
+                         tune_torch_threads)
 
 print("🚀 Starting NeuroVision AI with Locally Trained Models...")
 
+# Cases live in SQLite; a cases.json from older versions is imported once on startup
+CASES_DB = os.environ.get("NEUROVISION_CASES_DB", os.path.join(os.path.dirname(__file__), "cases.db"))
 CASES_FILE = os.path.join(os.path.dirname(__file__), "cases.json")
 
-def read_cases():
-    if not os.path.exists(CASES_FILE):
-        return []
-    with open(CASES_FILE, "r") as f:
-        return json.load(f)
+# "resize", "sliding_window" or "cascade" (see MonaiLocalSegmentor)
+INFERENCE_MODE = os.environ.get("NEUROVISION_INFERENCE_MODE", "resize")
 
-def write_cases(cases):
-    with open(CASES_FILE, "w") as f:
-        json.dump(cases, f, indent=4)
+# Also run the 3-class edema/enhancing UNet next to the tumor model (needs SimpleITK/nibabel).
+# It only runs when its trained weights load; otherwise subregion volumes stay fixed-ratio estimates
+ENSEMBLE_ENABLED = os.environ.get("NEUROVISION_ENSEMBLE", "1") == "1"
+SUBREGION_WEIGHTS = os.environ.get("NEUROVISION_SUBREGION_WEIGHTS",
+                                   os.path.join(os.path.dirname(__file__), "models", "subregion_brain_model.pth"))
+
+# Cross-request micro-batching of UNet forward passes (1 disables it)
+MICRO_BATCH_SIZE = int(os.environ.get("NEUROVISION_MICRO_BATCH_SIZE", "4"))
+MICRO_BATCH_WAIT_MS = float(os.environ.get("NEUROVISION_MICRO_BATCH_WAIT_MS", "10"))
+
+# "onnxruntime", "torchscript" or "eager"; unavailable backends fall back towards eager.
+# Only eager runs on the registry's page-cache-shared weights; the others keep a private copy per worker
+INFERENCE_BACKEND = os.environ.get("NEUROVISION_BACKEND", "onnxruntime")
+if INFERENCE_BACKEND not in BACKEND_CHOICES:
+    raise ValueError(f"NEUROVISION_BACKEND={INFERENCE_BACKEND!r} is not supported; "
+                     f"use one of {', '.join(BACKEND_CHOICES)}")
+
+# "fp32", "bf16" or "int8"; anything but plain fp32 runs on PyTorch instead of INFERENCE_BACKEND
+INFERENCE_PRECISION = os.environ.get("NEUROVISION_PRECISION", "fp32")
+CHANNELS_LAST = os.environ.get("NEUROVISION_CHANNELS_LAST", "0") == "1"
+
+# Uploads over this size are rejected with 413 before the body is fully received
+MAX_UPLOAD_BYTES = int(float(os.environ.get("NEUROVISION_MAX_UPLOAD_MB", "1024")) * 1024 * 1024)
+
+# 2D contours: simplification tolerance in pixels, and "delta" or "int16" coordinates
+CONTOUR_TOLERANCE = float(os.environ.get("NEUROVISION_CONTOUR_TOLERANCE", "1.0"))
+CONTOUR_ENCODING = os.environ.get("NEUROVISION_CONTOUR_ENCODING", "delta")
+
+# Per-study meshes and viewer files, keyed by study content hash, evicted LRU past the size cap
+ARTIFACT_DIR = os.path.join("static", "artifacts")
+ARTIFACT_MAX_MB = float(os.environ.get("NEUROVISION_ARTIFACT_MAX_MB", "512"))
+ARTIFACT_SWEEP_INTERVAL_S = float(os.environ.get("NEUROVISION_ARTIFACT_SWEEP_S", "60"))
+
+# Mesh formats written for AR/web clients next to the OBJ levels of detail
+AR_EXPORT_FORMATS = ("glb", "gltf")
+
+# Studies processed at once off the event loop, and how many more may wait before 429s;
+# torch intra-op threads default to cpu_count // PIPELINE_WORKERS
+PIPELINE_WORKERS = int(os.environ.get("NEUROVISION_PIPELINE_WORKERS", "2"))
+PIPELINE_QUEUE_SIZE = int(os.environ.get("NEUROVISION_PIPELINE_QUEUE", "8"))
+TORCH_THREADS = int(os.environ.get("NEUROVISION_TORCH_THREADS", "0")) or None
+
+# Asynchronous jobs (POST /api/jobs): SQLite queue and persisted uploads survive restarts,
+# finished results are kept for JOB_RESULT_TTL_H hours
+JOBS_DB = os.environ.get("NEUROVISION_JOBS_DB", os.path.join(os.path.dirname(__file__), "jobs.db"))
+JOB_UPLOAD_DIR = os.environ.get("NEUROVISION_JOB_DIR", os.path.join(os.path.dirname(__file__), "job_uploads"))
+JOB_RESULT_TTL_H = float(os.environ.get("NEUROVISION_JOB_TTL_H", "24"))
+JOB_QUEUE_MAX = int(os.environ.get("NEUROVISION_JOB_QUEUE_MAX", "100"))
+
+# Progress stages reported for jobs, in pipeline order
+PIPELINE_STAGES = ("unpack", "load", "segment", "analyze", "meshes", "contours")
+
+case_store = CaseStore(CASES_DB, legacy_json=CASES_FILE)
+
+artifact_store = ArtifactStore(ARTIFACT_DIR, max_bytes=int(ARTIFACT_MAX_MB * 1024 * 1024))
+print(f"🧵 {PIPELINE_WORKERS} pipeline workers, {tune_torch_threads(PIPELINE_WORKERS, TORCH_THREADS)} torch threads each")
+pipeline_pool = PipelinePool(PIPELINE_WORKERS, PIPELINE_QUEUE_SIZE)
 
 class NeuroVisionAI:
     def __init__(self):
-        self.monai_segmentor = MonaiLocalSegmentor()
+        self.monai_segmentor = MonaiLocalSegmentor(inference_mode=INFERENCE_MODE,
+                                                   max_batch_size=MICRO_BATCH_SIZE,
+                                                   max_wait_ms=MICRO_BATCH_WAIT_MS,
+                                                   backend=INFERENCE_BACKEND,
+                                                   precision=INFERENCE_PRECISION,
+                                                   channels_last=CHANNELS_LAST,
+                                                   contour_tolerance=CONTOUR_TOLERANCE,
+                                                   contour_encoding=CONTOUR_ENCODING)
+        self.ensemble = None
+        if ENSEMBLE_ENABLED:
+            try:
+                from real_segmentor import RealBrainSegmentor
+                from ensemble import EnsembleExecutor
+                subregion_segmentor = RealBrainSegmentor(backend=INFERENCE_BACKEND, weights_path=SUBREGION_WEIGHTS,
+                                                         require_weights=True)
+                self.ensemble = EnsembleExecutor(self.monai_segmentor, subregion_segmentor)
+            except Exception as e:
+                print(f"⚠️  Subregion model unavailable, serving the tumor model alone: {e}")
         print("✅ NeuroVision AI with Local Model initialized!")
+
+    def warmup(self):
+        """Warm every backend once; /api/ready reports ready only after this finishes"""
+        try:
+            self.monai_segmentor.warmup()
+            if self.ensemble is not None:
+                self.ensemble.subregion_segmentor.warmup()
+            registry.mark_ready()
+        except Exception as e:
+            traceback.print_exc()
+            registry.mark_ready(error=str(e))
     
-    def process_uploaded_mri(self, file_path: str):
-        """Process uploaded MRI using the local MONAI model"""
+    def artifact_key(self, file_path: Union[str, BinaryIO], tta_views: int):
+        """Study content hash plus everything in this process that changes the pipeline output"""
+        segmentor = self.monai_segmentor
+        return artifact_key(
+            file_digest(file_path),
+            weights=weights_hash(segmentor.weights_path) if segmentor.weights_path else None,
+            inference_mode=segmentor.inference_mode,
+            precision=INFERENCE_PRECISION,
+            ensemble=weights_hash(self.ensemble.subregion_segmentor.weights_path) if self.ensemble else None,
+            tta_views=tta_views,
+            contours=(CONTOUR_TOLERANCE, CONTOUR_ENCODING),
+        )
+
+    def process_upload(self, fileobj: BinaryIO, filename: str, tta_views: int = 1, wait_exports: bool = False,
+                       on_stage=None, fallback: bool = True):
+        """
+        Blocking upload handling for the pipeline pool: unpack series archives and cache
+        NIfTI files, run process_uploaded_mri, and clean up the unpacked series.
+        on_stage(name) is called as each of PIPELINE_STAGES begins.
+        """
+        series_dir = None
         try:
-            print(f"📁 Processing MRI with local model: {file_path}")
-            
-            # Load medical image
-            image_array = self.monai_segmentor.load_medical_image(file_path)
-            if image_array is None:
-                raise ValueError("Failed to load medical image from path.")
-            
-            original_shape = image_array.shape
-            if len(original_shape) == 2:
-                original_shape = (1,) + original_shape
+            if on_stage:
+                on_stage("unpack")
+            # The multipart parser already spooled the upload in bounded chunks (in memory when
+            # small, on disk otherwise); single files are parsed straight from that spool
+            source = fileobj
+            if is_nifti(filename, fileobj):
+                # Memory-mapped from an uncompressed copy, decompressed once per distinct upload
+                source = cached_nifti(fileobj, compressed=(filename or "").lower().endswith(".gz") or None)
+            elif is_archive(filename, fileobj):
+                series_dir = tempfile.mkdtemp(prefix="neurovision-series-")
+                extract_archive(fileobj, filename, series_dir, MAX_UPLOAD_BYTES)
+                source = series_dir
+            return self.process_uploaded_mri(source, tta_views=tta_views, wait_exports=wait_exports,
+                                             on_stage=on_stage, fallback=fallback)
+        finally:
+            if series_dir is not None:
+                remove_dir(series_dir)
 
-            # Run MONAI segmentation
-            segmentation, tumor_probabilities = self.monai_segmentor.segment_brain_tumor(image_array)
-            
-            # Calculate medical metrics
-            metrics = self.monai_segmentor.calculate_metrics(segmentation, tumor_probabilities)
-
-            # Create 3D model from segmentation
-            model_path = None
-            if segmentation is not None and np.any(segmentation == 1):
-                model_path, _, _ = self.monai_segmentor.extract_3d_tumor_structure(segmentation, original_shape)
-
-            # Extract 2D contours
-            contours_2d = None
-            if segmentation is not None and np.any(segmentation == 1):
-                contours_2d = self.monai_segmentor.extract_2d_tumor_slices(segmentation, image_array)
-
-            # Consolidate tumor properties for AR
-            tumor_properties = {
-                'volume': metrics.get('total_tumor_volume_cm3'),
-                'center_of_mass': metrics.get('center_of_mass'),
-                'bounding_box': metrics.get('bounding_box'),
-                'mesh_path': model_path,
-                'contours_2d': contours_2d
-            }
-            
-            return metrics, tumor_properties
+    def process_uploaded_mri(self, file_path: Union[str, BinaryIO], tta_views: int = 1, wait_exports: bool = False,
+                             on_stage=None, fallback: bool = True):
+        """
+        Process uploaded MRI using the local MONAI model. file_path is a DICOM or NIfTI file, an
+        open binary DICOM file (the upload spool) or a directory holding a series. GLB/glTF exports
+        and the reduced mesh LODs finish in the background unless wait_exports is set, in which
+        case their timings and sizes are reported.
+
+        Artifacts go to the study's content-addressed store entry; an identical re-upload
+        returns the stored result without running the models again. The entry is committed
+        once its background exports and reduced mesh LODs have finished, with their final sizes.
+
+        When processing fails the synthetic fallback is returned with tumor_properties None,
+        or, with fallback=False, the error is raised instead.
+        """
+        try:
+            key = self.artifact_key(file_path, tta_views)
+            with artifact_store.entry(key) as entry:
+                cached = entry.result()
+                if cached is not None:
+                    print(f"♻️  Reusing stored artifacts for study {key}")
+                    cached["tumor_properties"]["cache_hit"] = True
+                    return cached["metrics"], cached["tumor_properties"]
+
+                export_futures = {}
+                metrics, tumor_properties = self.run_pipeline(file_path, entry.directory, tta_views, wait_exports,
+                                                              on_stage, export_futures=export_futures)
+                if tumor_properties is not None:
+                    tumor_properties["artifact_key"] = key
+                    if tumor_properties.get("mesh_exports"):
+                        tumor_properties["viewer_url"] = viewer_url(key)
+                    # The response goes out now; the stored copy waits for the exports to finish
+                    stored = copy.deepcopy({"metrics": metrics, "tumor_properties": tumor_properties})
+
+                    def completed():
+                        if stored["tumor_properties"].get("mesh_lods"):
+                            stored["tumor_properties"]["mesh_lods"] = complete_lods(
+                                stored["tumor_properties"]["mesh_lods"], export_futures)
+                        exports = stored["tumor_properties"]["mesh_exports"]
+                        if exports and exports["pending"]:
+                            brain = exports.get("brain")
+                            exports = complete_export(exports, export_futures)
+                            if brain:
+                                exports["brain"] = complete_export(brain, export_futures)
+                            stored["tumor_properties"]["mesh_exports"] = exports
+                        return stored
+
+                    entry.commit(completed, pending=export_futures.values())
+                    tumor_properties["cache_hit"] = False
+                elif not fallback:
+                    raise RuntimeError("Segmentation produced no result")
+                return metrics, tumor_properties
             
+        except JobCancelled:
+            raise
         except Exception as e:
             print(f"❌ Local model processing failed: {e}")
             traceback.print_exc()
+            if not fallback:
+                raise
             # Fallback to synthetic analysis
             return self.get_synthetic_fallback(), None
+
+    def brain_mesh(self, segmentation, spacing):
+        """Generated brain sized to the segmentation grid, in the same units as the tumor mesh"""
+        extent = [n * s for n, s in zip(as_mask_array(segmentation).shape, spacing)]
+        brain_model = create_transparent_brain_model(extent)
+        if isinstance(brain_model, trimesh.Trimesh):
+            return brain_model.vertices, brain_model.faces
+        return brain_model
+
+    def run_pipeline(self, file_path: Union[str, BinaryIO], output_dir: str, tta_views: int = 1,
+                     wait_exports: bool = False, on_stage=None, export_futures=None):
+        """
+        Segment one study and write its meshes to output_dir. Returns (metrics, tumor_properties);
+        tumor_properties is None when segmentation failed and the result should not be stored.
+        Futures of exports and reduced mesh LODs still being written are added to export_futures by path.
+        """
+        print(f"📁 Processing MRI with local model: {file_path}")
+        stage = on_stage or (lambda name: None)
+        
+        stage("load")
+        # Load medical image (a single file or a directory holding a slice series)
+        study_info = {}
+        image_array = self.monai_segmentor.load_medical_image(file_path, info=study_info)
+        if image_array is None:
+            raise ValueError("Failed to load medical image from path.")
+        
+        original_shape = image_array.shape
+        if len(original_shape) == 2:
+            original_shape = (1,) + original_shape
+        voxel_spacing = study_info.get("spacing")
+
+        # Run MONAI segmentation
+        stage("segment")
+        inference_stats = {}
+        subregions = None
+        if self.ensemble is not None:
+            segmentation, tumor_probabilities, subregions = self.ensemble.segment(
+                image_array, stats=inference_stats, tta_views=tta_views)
+        else:
+            segmentation, tumor_probabilities = self.monai_segmentor.segment_brain_tumor(
+                image_array, stats=inference_stats, tta_views=tta_views)
+        
+        if segmentation is None:
+            return self.monai_segmentor.get_fallback_metrics(), None
+
+        stage("analyze")
+        # Physical size of one voxel of the segmentation grid (unit when the study has no geometry)
+        mask_spacing = mask_grid_spacing(original_shape, as_mask_array(segmentation).shape, voxel_spacing)
+
+        # Split the tumor into connected lesions once; metrics, meshes and contours share it
+        lesions = self.monai_segmentor.analyze_lesions(segmentation, mask_spacing)
+
+        # Calculate medical metrics
+        with span("analyze.metrics"):
+            metrics = self.monai_segmentor.calculate_metrics(segmentation, tumor_probabilities, subregions,
+                                                             spacing=mask_spacing, lesions=lesions)
+        if voxel_spacing is not None:
+            metrics["voxel_spacing_mm"] = list(voxel_spacing)
+        if inference_stats:
+            metrics["inference_stats"] = inference_stats
+
+        # Create 3D model from segmentation
+        has_tumor = metrics.get("tumor_voxels", 0) > 0
+        model_path = None
+        mesh_lods = None
+        mesh_exports = None
+        lesion_meshes = []
+        if has_tumor:
+            stage("meshes")
+            mesh_lods, meshes = self.monai_segmentor.extract_3d_tumor_lods(segmentation, original_shape, voxel_spacing,
+                                                                           output_dir=output_dir, wait=wait_exports,
+                                                                           futures=export_futures)
+            model_path = mesh_lods["levels"][0]["path"]
+            # The LOD stage already wrote the OBJs; AR clients get the full mesh as GLB/glTF,
+            # the viewer gets it (and the brain around it) as compact binary buffers
+            verts, faces = meshes["full"]
+            with span("meshes.exports"):
+                mesh_exports = mesh_exporter.export(verts, faces, output_dir, "tumor_3d",
+                                                    formats=AR_EXPORT_FORMATS + ("bin",), wait=wait_exports,
+                                                    futures=export_futures)
+            with span("meshes.brain"):
+                brain_verts, brain_faces = self.brain_mesh(segmentation, mesh_lods["spacing"])
+                mesh_exports["brain"] = export_brain_buffer(brain_verts, brain_faces, verts, output_dir,
+                                                            wait=wait_exports, futures=export_futures)
+            lesion_meshes = self.monai_segmentor.extract_lesion_meshes(lesions, original_shape, voxel_spacing,
+                                                                       output_dir=output_dir)
+
+        # Extract 2D contours
+        contours_2d = None
+        if has_tumor:
+            stage("contours")
+            contours_2d = self.monai_segmentor.extract_2d_tumor_slices(segmentation, image_array, lesions)
+
+        # Consolidate tumor properties for AR
+        tumor_properties = {
+            'volume': metrics.get('total_tumor_volume_cm3'),
+            'center_of_mass': metrics.get('center_of_mass'),
+            'bounding_box': metrics.get('bounding_box'),
+            'mesh_path': model_path,
+            'mesh_lods': mesh_lods,
+            'mesh_exports': mesh_exports,
+            'lesion_meshes': lesion_meshes,
+            'contours_2d': contours_2d,
+            'contour_encoding': self.monai_segmentor.contour_encoding
+        }
+        
+        return metrics, tumor_properties
     
     def get_synthetic_fallback(self):
         """Provide synthetic data when processing fails"""
@@ -92,14 +355,41 @@ class NeuroVisionAI:
             "recommendation": "Further clinical evaluation recommended"
         }
 
-# Initialize the AI system
+# Initialize the AI system. Models come from the shared registry with mmap'd weights, so
+# building this at import time under a pre-forking server (gunicorn --preload) lets all
+# workers share the weights copy-on-write.
 neuro_ai = NeuroVisionAI()
 
+def run_job(job, on_stage):
+    """
+    JobQueue worker: the same result /api/segment returns, from the job's persisted upload.
+    A failed study fails the job rather than succeeding with the synthetic fallback.
+    """
+    with open(job["upload_path"], "rb") as f:
+        return segment_result(f, job["filename"], on_stage=on_stage, endpoint="jobs", fallback=False,
+                              **json.loads(job["params"]))
+
+job_queue = JobQueue(JOBS_DB, JOB_UPLOAD_DIR, run_job, pipeline_pool, PIPELINE_STAGES,
+                     result_ttl_s=JOB_RESULT_TTL_H * 3600, max_queued=JOB_QUEUE_MAX)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so the server accepts health/readiness probes immediately
+    threading.Thread(target=neuro_ai.warmup, name="model-warmup", daemon=True).start()
+    artifact_store.start_sweeper(ARTIFACT_SWEEP_INTERVAL_S)
+    write_viewer_shell()
+    job_queue.start()
+    yield
+    job_queue.stop()
+    pipeline_pool.shutdown(wait=False)
+    artifact_store.stop_sweeper()
+
 # Create FastAPI app
 app = FastAPI(
     title="NeuroVision AI - Local Model Edition",
     description="Brain Tumor Detection with Locally Trained Models",
-    version="5.0.0"
+    version="5.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -108,69 +398,168 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # Pagination cursors and 429 back-off hints are read by the browser clients
+    expose_headers=["X-Next-Cursor", "Link", "Retry-After"],
 )
 
-# Serve static files from the correct directory
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES, paths=("/api/segment", "/api/jobs"))
+app.add_middleware(PipelineBusyMiddleware, pool=pipeline_pool)
+
+# Serve static files from the correct directory; store entries get immutable caching
+app.mount("/static", ArtifactStaticFiles(directory="static", store=artifact_store), name="static")
+
+def segment_result(fileobj: BinaryIO, filename: str, tta_views: int = 1, wait_exports: bool = False,
+                   on_stage=None, timings: bool = False, endpoint: str = "segment", fallback: bool = True):
+    """
+    Process one upload and build the /api/segment response body (blocking; runs on the pipeline pool).
+    Stage and step latencies go to /api/metrics; timings=True also returns this request's breakdown.
+    fallback=False raises when processing fails instead of returning the synthetic result.
+    """
+    with pipeline_metrics.trace(endpoint, on_stage) as trace:
+        try:
+            metrics, tumor_properties = neuro_ai.process_upload(fileobj, filename, tta_views, wait_exports,
+                                                                trace.stage, fallback)
+        except JobCancelled:
+            trace.outcome = "cancelled"
+            raise
+        if tumor_properties is None:
+            trace.outcome = "fallback"
+        elif tumor_properties.get("cache_hit"):
+            trace.outcome = "cache_hit"
+        return build_segment_body(filename, metrics, tumor_properties, trace.breakdown() if timings else None)
+
+def build_segment_body(filename, metrics, tumor_properties, timings=None):
+    
+    # Generate medical report
+    report = {
+        "patient_id": f"PAT_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+        "study_date": datetime.now().isoformat(),
+        "analysis_type": "Local Brain Tumor Segmentation",
+        "file_processed": filename,
+        **metrics
+    }
+    
+    body = {
+        "status": "success",
+        "message": "Local brain tumor analysis complete",
+        "report": report,
+        "ar_properties": tumor_properties,
+        "ai_features": {
+            "framework": "MONAI",
+            "model_architecture": "3D UNet",
+            "weights": "Locally Trained",
+            "inference_backend": neuro_ai.monai_segmentor.backend.name
+        }
+    }
+    if timings is not None:
+        body["timings"] = timings
+    return body
+
+def segment_response(fileobj: BinaryIO, filename: str, tta_views: int = 1, wait_exports: bool = False,
+                     timings: bool = False):
+    # Rendered on the worker too: encoding large contour/mesh results would otherwise stall the event loop
+    return json_response(segment_result(fileobj, filename, tta_views, wait_exports, timings=timings))
 
 @app.post("/api/segment")
-async def segment_brain_tumor(file: UploadFile = File(...)):
-    """Segment brain tumor using locally trained MONAI models"""
+async def segment_brain_tumor(file: UploadFile = File(...),
+                              tta_views: int = Query(1, ge=1, le=MAX_TTA_VIEWS),
+                              wait_exports: bool = Query(False),
+                              timings: bool = Query(False)):
+    """
+    Segment brain tumor using locally trained MONAI models; tta_views > 1 trades latency for accuracy.
+    wait_exports=true blocks until the GLB/glTF files and mesh LODs are written and reports their sizes and timings.
+    timings=true adds this request's per-stage and per-step milliseconds to the response.
+    Studies run on the pipeline pool; 429 with Retry-After when its queue is full.
+    """
     try:
         print(f"Processing: {file.filename}")
         
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
-        
-        # Process with local MONAI model
-        metrics, tumor_properties = neuro_ai.process_uploaded_mri(tmp_path)
-        
-        # Generate medical report
-        report = {
-            "patient_id": f"PAT_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-            "study_date": datetime.now().isoformat(),
-            "analysis_type": "Local Brain Tumor Segmentation",
-            "file_processed": file.filename,
-            **metrics
-        }
-        
-        # Clean up
-        os.unlink(tmp_path)
-        
-        return {
-            "status": "success",
-            "message": "Local brain tumor analysis complete",
-            "report": report,
-            "ar_properties": tumor_properties,
-            "ai_features": {
-                "framework": "MONAI",
-                "model_architecture": "3D UNet",
-                "weights": "Locally Trained"
-            }
-        }
+        # Process with local MONAI model, off the event loop
+        return await pipeline_pool.run(segment_response, file.file, file.filename, tta_views, wait_exports,
+                                       timings)
         
+    except PipelineBusy as e:
+        return busy_response(e.retry_after)
+    except HTTPException:
+        raise
     except Exception as e:
         traceback.print_exc()
         return {
             "status": "error", 
             "message": f"Analysis failed: {str(e)}",
-            "suggestion": "Please upload a valid DICOM file and ensure the model is trained."
+            "suggestion": "Please upload a valid DICOM or NIfTI (.nii/.nii.gz) file (or a zip/tar of a DICOM series) and ensure the model is trained."
         }
 
+@app.post("/api/jobs", status_code=202)
+def create_job(file: UploadFile = File(...),
+               tta_views: int = Query(1, ge=1, le=MAX_TTA_VIEWS),
+               wait_exports: bool = Query(False),
+               timings: bool = Query(False)):
+    """
+    Queue a segmentation and return its job id at once; poll GET /api/jobs/{job_id} for progress
+    and the report. The upload is persisted, so queued and running jobs survive a restart.
+    """
+    try:
+        job_id = job_queue.submit(file.file, file.filename,
+                                  {"tta_views": tta_views, "wait_exports": wait_exports, "timings": timings})
+    except QueueFull:
+        return busy_response(pipeline_pool.retry_after())
+    print(f"📥 Queued job {job_id} for {file.filename}")
+    return {"job_id": job_id, "status": "queued", "status_url": f"/api/jobs/{job_id}"}
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    """Status, per-stage progress and, once finished, the same result /api/segment returns"""
+    body = job_queue.response_body(job_id)
+    if body is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return Response(body, media_type="application/json")
+
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    """Queued jobs are cancelled at once, running ones at their next pipeline stage"""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @app.post("/api/cases")
-async def create_case(case_data: dict):
-    cases = read_cases()
-    new_case = {"id": str(uuid.uuid4()), "timestamp": datetime.now().isoformat(), **case_data}
-    cases.append(new_case)
-    write_cases(cases)
-    return new_case
+def create_case(case_data: dict):
+    try:
+        return case_store.create(case_data)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 @app.get("/api/cases")
-async def get_all_cases():
-    return read_cases()
+def get_all_cases(request: Request, response: Response,
+                  limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                  cursor: Optional[str] = None,
+                  status: Optional[str] = None,
+                  since: Optional[str] = Query(None, description="ISO timestamp, inclusive"),
+                  until: Optional[str] = Query(None, description="ISO timestamp, exclusive")):
+    """
+    Cases as a plain JSON array. Without limit or cursor: every (matching) case, oldest
+    first, as before pagination. With either: a newest-first page (50 by default); when
+    more cases follow, the X-Next-Cursor header (and a Link rel="next" URL) carries the
+    cursor for the next page.
+    """
+    if limit is None and cursor is None:
+        return case_store.all(status, since, until)
+    try:
+        cases, next_cursor = case_store.list(limit or 50, cursor, status, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return cases
+
+@app.get("/api/cases/{case_id}")
+def get_case(case_id: str):
+    case = case_store.get(case_id)
+    if case is None:
+        raise HTTPException(status_code=404, detail="Case not found")
+    return case
 
 @app.get("/api/health")
 async def health_check():
@@ -178,29 +567,112 @@ async def health_check():
         "status": "healthy",
         "service": "NeuroVision AI - Local Model Edition",
         "version": "5.0.0",
-        "model_status": "Ready"
+        "model_status": "Ready" if registry.is_ready() else "Warming up"
     }
 
+@app.get("/api/ready")
+async def readiness_check():
+    """Readiness probe: 503 until every served model has been loaded and warmed up"""
+    status = registry.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/api/inference/stats")
+async def inference_stats():
+    """Micro-batching queue depth, batch-size histogram and latency percentiles, plus pipeline pool load"""
+    scheduler = neuro_ai.monai_segmentor.scheduler
+    if scheduler is None:
+        return {"micro_batching": False, "pipeline_pool": pipeline_pool.stats(), "jobs": job_queue.stats()}
+    return {"micro_batching": True, **scheduler.stats(), "pipeline_pool": pipeline_pool.stats(),
+            "jobs": job_queue.stats()}
+
+def runtime_metric_blocks():
+    """Queue depths and model info sampled at scrape time, in Prometheus text"""
+    pool = pipeline_pool.stats()
+    jobs = job_queue.stats()
+    blocks = [
+        metric_block("neurovision_pipeline_workers", "gauge", "Pipeline pool worker threads",
+                     [((), pool["workers"])]),
+        metric_block("neurovision_pipeline_running", "gauge", "Studies running on the pipeline pool",
+                     [((), pool["running"])]),
+        metric_block("neurovision_pipeline_queue_depth", "gauge", "Studies waiting for a pipeline worker",
+                     [((), pool["queued"])]),
+        metric_block("neurovision_pipeline_rejected_total", "counter", "Studies turned away with 429",
+                     [((), pool["rejected"])]),
+        metric_block("neurovision_jobs", "gauge", "Asynchronous jobs in the queue database by status",
+                     [((status,), jobs[status]) for status in JOB_STATUSES], ("status",)),
+    ]
+    scheduler = neuro_ai.monai_segmentor.scheduler
+    if scheduler is not None:
+        batching = scheduler.stats()
+        blocks.append(metric_block("neurovision_microbatch_queue_depth", "gauge",
+                                   "Forward passes waiting for the micro-batch scheduler",
+                                   [((), batching["queue_depth"])]))
+        blocks.append(metric_block("neurovision_microbatch_batches_total", "counter",
+                                   "Batched forward passes run", [((), batching["batches"])]))
+    status = registry.status()
+    models = status["models"]
+    blocks += [
+        metric_block("neurovision_model_ready", "gauge", "1 once every served model is loaded and warmed up",
+                     [((), int(status["ready"]))]),
+        metric_block("neurovision_model_info", "gauge", "Models served by this process",
+                     [((m["architecture"], m["weights_sha256"][:12], m["device"]), 1) for m in models],
+                     ("architecture", "weights_sha256", "device")),
+        metric_block("neurovision_inference_info", "gauge", "Tumor model inference configuration",
+                     [((neuro_ai.monai_segmentor.backend.name, INFERENCE_MODE, INFERENCE_PRECISION), 1)],
+                     ("backend", "mode", "precision")),
+        metric_block("neurovision_model_load_seconds", "gauge", "Time to build each model and load its weights",
+                     [((m["architecture"],), round(m["load_ms"] / 1000, 6)) for m in models], ("architecture",)),
+        metric_block("neurovision_model_warmup_seconds", "gauge", "Warm-up forward pass time of each model",
+                     [((m["architecture"],), round(m["warmup_ms"] / 1000, 6))
+                      for m in models if m["warmup_ms"] is not None],
+                     ("architecture",)),
+    ]
+    return blocks
+
+@app.get("/api/metrics")
+def prometheus_metrics():
+    """
+    Prometheus text exposition: request, stage and step latency histograms, outcome counters,
+    peak/current RSS, pipeline and job queue depth, and the served models
+    """
+    return PlainTextResponse(pipeline_metrics.render(runtime_metric_blocks()), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/api/meshes/{study_key}/{mesh_name}")
+async def get_mesh_buffer(study_key: str, mesh_name: str, request: Request):
+    """Binary viewer mesh (see mesh_export.mesh_buffer), cached by the client forever once committed"""
+    if not re.fullmatch(r"[0-9a-f]{32}", study_key) or not re.fullmatch(r"[a-z0-9_]+", mesh_name):
+        raise HTTPException(status_code=404, detail="Mesh not found")
+    filename = f"{mesh_name}.bin"
+    if not os.path.exists(os.path.join(artifact_store.root, study_key, filename)):
+        raise HTTPException(status_code=404, detail="Mesh not found")
+    return immutable_file_response(artifact_store, study_key, filename, request.headers,
+                                   media_type="application/octet-stream")
+
 @app.get("/")
 async def root():
     return {
         "message": "NeuroVision AI with Locally Trained Models",
         "endpoints": {
             "segment": "POST /api/segment",
+            "jobs_create": "POST /api/jobs",
+            "jobs_get": "GET /api/jobs/{job_id}",
+            "jobs_cancel": "POST /api/jobs/{job_id}/cancel",
             "cases_create": "POST /api/cases",
-            "cases_get_all": "GET /api/cases",
-            "health": "GET /api/health"
+            "cases_get_all": "GET /api/cases?limit=&cursor=&status=&since=&until=",
+            "cases_get": "GET /api/cases/{case_id}",
+            "health": "GET /api/health",
+            "ready": "GET /api/ready",
+            "inference_stats": "GET /api/inference/stats",
+            "metrics": "GET /api/metrics",
+            "mesh_buffer": "GET /api/meshes/{study_key}/{mesh_name}",
+            "viewer": "GET /static/viewer/index.html?study={study_key}"
         }
     }
 
 @app.delete("/api/cases/{case_id}")
-async def delete_case(case_id: str):
-    cases = read_cases()
-    initial_cases_count = len(cases)
-    cases = [case for case in cases if case["id"] != case_id]
-    if len(cases) == initial_cases_count:
+def delete_case(case_id: str):
+    if not case_store.delete(case_id):
         raise HTTPException(status_code=404, detail="Case not found")
-    write_cases(cases)
     return {"message": "Case deleted successfully"}
 
 if __name__ == "__main__":
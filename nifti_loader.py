@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+try:
+    import nibabel as nib
+except ImportError:
+    nib = None
+
+NIFTI_SUFFIXES = (".nii", ".nii.gz")
+NIFTI_CACHE_DIR = os.environ.get("NEUROVISION_NIFTI_CACHE", os.path.join(tempfile.gettempdir(), "neurovision-nifti"))
+NIFTI_CACHE_MAX_BYTES = int(float(os.environ.get("NEUROVISION_NIFTI_CACHE_MB", "4096")) * 1024 * 1024)
+# z-slices read per step when a volume is streamed
+SLAB_DEPTH = 16
+_COPY_CHUNK = 1024 * 1024
+
+_cache_lock = threading.Lock()
+
+
+def is_nifti(filename, fileobj=None):
+    """By extension, or for an uncompressed upload by the NIfTI-1 magic at byte 344"""
+    if (filename or "").lower().endswith(NIFTI_SUFFIXES):
+        return True
+    if fileobj is None:
+        return False
+    position = fileobj.tell()
+    try:
+        fileobj.seek(344)
+        return fileobj.read(4) in (b"n+1\0", b"ni1\0")
+    finally:
+        fileobj.seek(position)
+
+
+class NiftiVolume:
+    """
+    Lazy float32 (slices, rows, cols) view of an uncompressed, memory-mapped
+    NIfTI file. NIfTI stores (x, y, z) in Fortran order, so one z-slab is a
+    contiguous range of the file; slab() reads just that range, applies the
+    header scaling in float32 and transposes it to (z, y, x).
+    """
+
+    def __init__(self, path):
+        if not nib:
+            raise ImportError("nibabel library is required to read NIfTI files.")
+        image = nib.load(path)
+        # The array proxy keeps the on-disk layout; image.header is a copy with scaling reset
+        proxy = image.dataobj
+        self.data = np.memmap(path, dtype=proxy.dtype, mode="r", offset=int(proxy.offset),
+                              shape=proxy.shape, order="F")
+        x, y, z = image.shape[:3]
+        self.shape = (z, y, x)
+        self.ndim = 3
+        self.dtype = np.dtype(np.float32)
+        zooms = image.header.get_zooms()
+        self.spacing = (float(zooms[2]), float(zooms[1]), float(zooms[0]))
+        self.affine = image.affine
+        slope, inter = proxy.slope, proxy.inter
+        self.slope = None if slope is None or not np.isfinite(slope) or slope in (0, 1) else np.float32(slope)
+        self.inter = None if inter is None or not np.isfinite(inter) or inter == 0 else np.float32(inter)
+
+    def slab(self, z0, z1):
+        # 4D series (e.g. fMRI) are reduced to their first volume
+        index = (slice(None), slice(None), slice(z0, z1)) + (0,) * (self.data.ndim - 3)
+        slab = self.data[index].astype(np.float32)
+        if self.slope is not None:
+            slab *= self.slope
+        if self.inter is not None:
+            slab += self.inter
+        return slab.transpose(2, 1, 0)
+
+    def slabs(self, depth=SLAB_DEPTH):
+        for z0 in range(0, self.shape[0], depth):
+            yield z0, self.slab(z0, min(z0 + depth, self.shape[0]))
+
+    def __array__(self, dtype=None, copy=None):
+        volume = np.empty(self.shape, dtype=np.float32)
+        for z0, slab in self.slabs():
+            volume[z0:z0 + len(slab)] = slab
+        return volume if dtype is None else volume.astype(dtype, copy=False)
+
+
+def _evict_cache(keep):
+    entries = []
+    for name in os.listdir(NIFTI_CACHE_DIR):
+        path = os.path.join(NIFTI_CACHE_DIR, name)
+        if name.endswith(".nii") and path != keep:
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= NIFTI_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total -= size
+
+
+def cached_nifti(source, compressed=None):
+    """
+    Path of an uncompressed .nii for a NIfTI file path or open binary file.
+
+    Plain .nii paths are used in place. Everything else (.nii.gz, uploads
+    held in a spool) is decompressed or copied once into NIFTI_CACHE_DIR,
+    keyed by the sha256 of the source bytes, so a re-upload memory-maps
+    the cached file directly. Least recently used files are dropped past
+    NIFTI_CACHE_MAX_BYTES.
+    """
+    if isinstance(source, str) and not source.lower().endswith(".gz"):
+        return source
+
+    opened = isinstance(source, str)
+    fileobj = open(source, "rb") if opened else source
+    try:
+        fileobj.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: fileobj.read(_COPY_CHUNK), b""):
+            digest.update(chunk)
+        fileobj.seek(0)
+        if compressed is None:
+            compressed = fileobj.read(2) == b"\x1f\x8b"
+            fileobj.seek(0)
+
+        os.makedirs(NIFTI_CACHE_DIR, exist_ok=True)
+        path = os.path.join(NIFTI_CACHE_DIR, f"{digest.hexdigest()}.nii")
+        with _cache_lock:
+            if os.path.exists(path):
+                os.utime(path)
+                return path
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            stream = gzip.GzipFile(fileobj=fileobj, mode="rb") if compressed else fileobj
+            with open(tmp_path, "wb") as out:
+                shutil.copyfileobj(stream, out, _COPY_CHUNK)
+            os.replace(tmp_path, path)
+            _evict_cache(path)
+        print(f"🗜️  NIfTI cached at {path}")
+        return path
+    finally:
+        if opened:
+            fileobj.close()
+        else:
+            fileobj.seek(0)
+
+
+def load_nifti_volume(source, info=None):
+    """Lazy NiftiVolume for a NIfTI path or upload; spacing (slice, row, col) goes into `info`"""
+    volume = NiftiVolume(cached_nifti(source))
+    if info is not None:
+        info["spacing"] = volume.spacing
+        info["format"] = "nifti"
+    return volume
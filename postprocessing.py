@@ -0,0 +1,101 @@
+import numpy as np
+import torch
+
+# Depth slices per argmax chunk: bounds the int64 temporary torch.argmax allocates
+ARGMAX_CHUNK = 16
+
+
+class PackedMask:
+    """Binary mask stored with np.packbits: 1 bit per voxel instead of 8"""
+
+    def __init__(self, mask):
+        mask = np.asarray(mask)
+        if mask.size and mask.max() > 1:
+            raise ValueError("Only binary masks can be bit-packed; keep multi-label masks as uint8")
+        self.shape = mask.shape
+        self.bits = np.packbits(mask.astype(bool, copy=False), axis=None)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def unpack(self):
+        count = int(np.prod(self.shape))
+        return np.unpackbits(self.bits, count=count).reshape(self.shape)
+
+
+class TumorProbabilities:
+    """Tumor-class softmax restricted to the tumor bounding box, stored as float16"""
+
+    def __init__(self, values, origin, full_shape):
+        self.values = values
+        self.origin = tuple(origin)
+        self.full_shape = tuple(full_shape)
+
+    @property
+    def slices(self):
+        return tuple(slice(o, o + s) for o, s in zip(self.origin, self.values.shape))
+
+    def to_dense(self, dtype=np.float32):
+        """Expand back to the full grid (zero outside the bounding box)"""
+        dense = np.zeros(self.full_shape, dtype=dtype)
+        dense[self.slices] = self.values
+        return dense
+
+
+def as_mask_array(mask):
+    """Accept a uint8/int mask or a PackedMask and return an ndarray"""
+    if isinstance(mask, PackedMask):
+        return mask.unpack()
+    return mask
+
+
+def logits_to_mask(logits):
+    """
+    Argmax over the class channel of (1, C, D, H, W) logits into a uint8 mask.
+
+    Softmax is monotonic, so the argmax of the logits equals the argmax of
+    the probabilities; running it in depth chunks keeps the int64 index
+    tensor small instead of 8 bytes per voxel of the whole volume.
+    """
+    logits = logits[0]
+    depth = logits.shape[1]
+    mask = torch.empty(logits.shape[1:], dtype=torch.uint8, device=logits.device)
+    for start in range(0, depth, ARGMAX_CHUNK):
+        stop = min(start + ARGMAX_CHUNK, depth)
+        mask[start:stop] = torch.argmax(logits[:, start:stop], dim=0)
+    return mask.cpu().numpy()
+
+
+def mask_bounding_box(mask, label=None):
+    """(min corner, max corner exclusive) of the non-zero (or == label) voxels, or None"""
+    region = mask > 0 if label is None else mask == label
+    corners_min, corners_max = [], []
+    for axis in range(region.ndim):
+        other_axes = tuple(a for a in range(region.ndim) if a != axis)
+        occupied = np.flatnonzero(region.any(axis=other_axes))
+        if occupied.size == 0:
+            return None
+        corners_min.append(int(occupied[0]))
+        corners_max.append(int(occupied[-1]) + 1)
+    return corners_min, corners_max
+
+
+def tumor_probabilities_in_bbox(logits, mask, label=1):
+    """Softmax the logits only inside the tumor bounding box; None when there is no tumor"""
+    bbox = mask_bounding_box(mask, label)
+    if bbox is None:
+        return None
+    lo, hi = bbox
+    crop = logits[0, :, lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+    values = torch.softmax(crop.float(), dim=0)[label].to(torch.float16).cpu().numpy()
+    return TumorProbabilities(values, lo, mask.shape)
+
+
+def compact_mask(mask, mask_format="uint8"):
+    """Store a uint8 mask as-is or bit-packed"""
+    if mask_format == "packed":
+        return PackedMask(mask)
+    if mask_format != "uint8":
+        raise ValueError(f"Unknown mask format: {mask_format}")
+    return mask
@@ -0,0 +1,128 @@
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# ITU-R 601 luma weights, matching the original NumPy conversion
+_RGB_WEIGHTS = torch.tensor([0.2989, 0.5870, 0.1140], dtype=torch.float32)
+
+
+class _StepTimer:
+    """Record wall time per preprocessing step into an optional dict"""
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = time.perf_counter()
+
+    def __call__(self, step):
+        if self.timings is not None:
+            now = time.perf_counter()
+            self.timings[step] = round((now - self.last) * 1000, 3)
+            self.last = now
+
+
+def to_volume_tensor(image_array):
+    """
+    Convert an image to a float32 (D, H, W) tensor with exactly one full-size copy.
+
+    The copy is owned by the tensor, so later in-place steps never touch the
+    caller's array. RGB images become grayscale, 2D images get a depth of one.
+    """
+    if image_array.ndim == 3 and image_array.shape[2] == 3:
+        print(f"Detected RGB image ({image_array.shape}), converting to grayscale.")
+        volume = torch.from_numpy(np.asarray(image_array, dtype=np.float32)) @ _RGB_WEIGHTS
+    else:
+        volume = torch.from_numpy(np.array(image_array, dtype=np.float32))
+
+    if volume.ndim == 2:
+        print(f"Detected 2D image ({tuple(volume.shape)}), expanding to 3D.")
+        volume = volume.unsqueeze(0)
+    return volume
+
+
+def normalize_intensity_(volume):
+    """Min-max scale to [0, 1] in place; a constant image becomes all zeros"""
+    lo, hi = torch.aminmax(volume)
+    volume.sub_(lo)
+    if hi > lo:
+        volume.div_(hi - lo)
+    return volume
+
+
+def resample(volume, target_shape):
+    """
+    Trilinear resample of a (D, H, W) tensor to `target_shape`.
+
+    align_corners=True matches scipy.ndimage.zoom(order=1), which maps the
+    first and last voxels of each axis onto each other.
+    """
+    if tuple(volume.shape) == tuple(target_shape):
+        return volume
+    return F.interpolate(volume[None, None], size=tuple(target_shape),
+                         mode="trilinear", align_corners=True)[0, 0]
+
+
+def resample_slabs(volume, target_shape, timer):
+    """
+    Normalize and resample a lazy volume (anything with .shape and
+    .slabs(), e.g. nifti_loader.NiftiVolume) one z-slab at a time.
+
+    Each slab is resized in-plane as it is read while the global min/max
+    are tracked; the depth axis is interpolated once afterwards and the
+    min-max scaling applied last. Trilinear interpolation with
+    align_corners=True is separable and commutes with the linear scaling,
+    so the result matches the full-volume path without ever holding the
+    source volume in memory.
+    """
+    depth, height, width = volume.shape
+    target_depth, target_height, target_width = target_shape
+    planes = torch.empty((depth, target_height, target_width), dtype=torch.float32)
+    lo, hi = float("inf"), float("-inf")
+    for z0, slab in volume.slabs():
+        slab = torch.from_numpy(np.ascontiguousarray(slab))
+        slab_lo, slab_hi = torch.aminmax(slab)
+        lo, hi = min(lo, float(slab_lo)), max(hi, float(slab_hi))
+        if (height, width) != (target_height, target_width):
+            slab = F.interpolate(slab[:, None], size=(target_height, target_width),
+                                 mode="bilinear", align_corners=True)[:, 0]
+        planes[z0:z0 + len(slab)] = slab
+    timer("read_resample_plane")
+    planes = resample(planes, target_shape)
+    planes.sub_(lo)
+    if hi > lo:
+        planes.div_(hi - lo)
+    timer("resample_depth_normalize")
+    return planes
+
+
+def preprocess_volume(image_array, target_shape=None, device=None, timings=None):
+    """
+    Shared preprocessing for both segmentors: tensor once, normalize, optionally resample.
+
+    Returns a contiguous float32 (1, 1, D, H, W) tensor. All steps are torch
+    ops (multithreaded via intra-op threads) and nothing is promoted to float64.
+    Pass a dict as `timings` to collect per-step milliseconds. Lazy volumes
+    with a target shape are streamed through resample_slabs.
+    """
+    timer = _StepTimer(timings)
+    if target_shape is not None and hasattr(image_array, "slabs"):
+        print(f"Streaming image from {tuple(image_array.shape)} to {tuple(target_shape)}...")
+        volume = resample_slabs(image_array, target_shape, timer)[None, None].contiguous()
+        if device is not None:
+            volume = volume.to(device)
+            timer("to_device")
+        return volume
+    volume = to_volume_tensor(image_array)
+    timer("to_tensor")
+    normalize_intensity_(volume)
+    timer("normalize")
+    if target_shape is not None:
+        print(f"Resizing image from {tuple(volume.shape)} to {tuple(target_shape)}...")
+        volume = resample(volume, target_shape)
+        timer("resample")
+    volume = volume[None, None].contiguous()
+    if device is not None:
+        volume = volume.to(device)
+        timer("to_device")
+    return volume
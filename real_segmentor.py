@@ -1,38 +1,42 @@
-import numpy as np
 import SimpleITK as sitk
-import pydicom
-import nibabel as nib
-from monai.networks.nets import UNet
-from monai.inferers import SimpleInferer
 import torch
 import os
+import time
+from inference_backends import create_backend
+from model_registry import registry
+from preprocessing import preprocess_volume
+from nifti_loader import load_nifti_volume
+from postprocessing import logits_to_mask
+from region_stats import compute_region_stats
+from lesions import analyze_lesions
 from datetime import datetime
 
+# (Z, Y, X) grid the 3-class model is trained, exported and served on
+SUBREGION_SHAPE = (160, 160, 128)
+
 class RealBrainSegmentor:
-    def __init__(self):
+    def __init__(self, backend="eager", weights_path=None, require_weights=False):
         self.model = None
+        self.weights_path = weights_path
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.load_model()
+        self.load_model(require_weights)
+        self.backend = create_backend(backend, self.model, self.weights_path,
+                                      example_shape=(1, 1) + SUBREGION_SHAPE)
     
-    def load_model(self):
-        """Load a pre-trained segmentation model"""
+    def load_model(self, require_weights=False):
+        """
+        Load the background/edema/enhancing UNet from `weights_path`, shared process-wide
+        through the registry. Without weights it is randomly initialized, or with
+        require_weights a FileNotFoundError is raised instead.
+        """
         print("🧠 Loading real brain tumor segmentation model...")
         
-        # Create a UNet model (you can replace with your trained model)
-        self.model = UNet(
-            spatial_dims=3,
-            in_channels=1,
-            out_channels=3,  # Background, Edema, Enhancing Tumor
-            channels=(16, 32, 64, 128),
-            strides=(2, 2, 2),
-            num_res_units=2,
-        )
-        
-        # TODO: Load your trained weights here
-        # self.model.load_state_dict(torch.load('path/to/your/model.pth'))
-        
-        self.model.to(self.device)
-        self.model.eval()
+        if not self.weights_path or not os.path.exists(self.weights_path):
+            if require_weights:
+                raise FileNotFoundError(f"No trained 3-class weights at {self.weights_path!r}")
+            print("⚠️  No trained 3-class weights, using random initialization")
+            self.weights_path = None
+        self.model = registry.get("unet3d-3class", self.weights_path, self.device)
         print("✅ Real segmentation model loaded!")
     
     def load_dicom_series(self, dicom_folder):
@@ -51,54 +55,46 @@ class RealBrainSegmentor:
             return None, None
     
     def load_nifti(self, nifti_path):
-        """Load NIfTI file"""
+        """Load NIfTI file as a lazy float32 (Z, Y, X) volume; .nii.gz is decompressed once and cached"""
         try:
-            img = nib.load(nifti_path)
-            image_array = img.get_fdata()  # (X, Y, Z) or (Z, Y, X)
-            affine = img.affine
+            image_array = load_nifti_volume(nifti_path)
+            affine = image_array.affine
             return image_array, affine
         except Exception as e:
             print(f"❌ NIfTI loading failed: {e}")
             return None, None
     
-    def preprocess_mri(self, image_array):
-        """Preprocess MRI for segmentation"""
-        # Normalize to [0, 1]
-        image_normalized = (image_array - np.min(image_array)) / (np.max(image_array) - np.min(image_array))
-        
-        # Resize to standard size (if needed)
-        target_shape = (160, 160, 128)
-        if image_normalized.shape != target_shape:
-            # Simple resizing - in production use proper resampling
-            from scipy.ndimage import zoom
-            zoom_factors = [target_shape[i] / image_normalized.shape[i] for i in range(3)]
-            image_resized = zoom(image_normalized, zoom_factors, order=1)
-        else:
-            image_resized = image_normalized
-        
-        return image_resized.astype(np.float32)
+    def preprocess_mri(self, image_array, timings=None):
+        """Preprocess MRI for segmentation: (1, 1, Z, Y, X) float32 tensor in [0, 1]"""
+        # Trilinear resize to standard size (skipped when already there)
+        return preprocess_volume(image_array, SUBREGION_SHAPE, self.device, timings)
     
     def segment_brain_tumor(self, image_array):
         """Perform real tumor segmentation"""
         try:
             # Preprocess
-            processed_image = self.preprocess_mri(image_array)
-            
-            # Convert to tensor
-            input_tensor = torch.from_numpy(processed_image).unsqueeze(0).unsqueeze(0)  # (1, 1, Z, Y, X)
-            input_tensor = input_tensor.to(self.device)
-            
-            # Run inference
-            with torch.no_grad():
-                output = self.model(input_tensor)
-                segmentation = torch.argmax(output, dim=1).squeeze().cpu().numpy()
+            input_tensor = self.preprocess_mri(image_array)  # (1, 1, Z, Y, X)
             
+            segmentation = self.segment_tensor(input_tensor)
             print(f"✅ Real segmentation complete! Shape: {segmentation.shape}")
             return segmentation
             
         except Exception as e:
             print(f"❌ Real segmentation failed: {e}")
             return None
+
+    def segment_tensor(self, input_tensor):
+        """Run inference on an already preprocessed (1, 1, Z, Y, X) tensor"""
+        with torch.no_grad():
+            output = self.backend(input_tensor.to(self.device))
+            return logits_to_mask(output)  # uint8 labels, no int64 volume
+
+    def warmup(self, shape=SUBREGION_SHAPE):
+        start = time.perf_counter()
+        self.segment_tensor(torch.zeros((1, 1) + tuple(shape)))
+        warmup_ms = (time.perf_counter() - start) * 1000
+        registry.record_warmup(self.model, warmup_ms)
+        print(f"🔥 Real segmentation model warmed up in {warmup_ms:.0f} ms")
     
     def calculate_real_metrics(self, segmentation, original_shape, spacing=None):
         """Calculate real tumor metrics from segmentation"""
@@ -106,21 +102,24 @@ class RealBrainSegmentor:
             return self.get_fallback_metrics()
         
         try:
-            # Count voxels for each class
-            background_voxels = np.sum(segmentation == 0)
-            edema_voxels = np.sum(segmentation == 1)
-            enhancing_voxels = np.sum(segmentation == 2)
-            
             # Calculate volumes (assuming voxel spacing in mm)
             if spacing is None:
                 spacing = (1.0, 1.0, 1.0)  # Default 1mm³ voxels
             
-            voxel_volume_mm3 = spacing[0] * spacing[1] * spacing[2]
+            # Count voxels for each class in a single pass over the mask
+            region_stats = compute_region_stats(segmentation, spacing)
+            edema = region_stats["labels"].get(1)
+            enhancing = region_stats["labels"].get(2)
+            edema_voxels = edema["voxels"] if edema else 0
+            enhancing_voxels = enhancing["voxels"] if enhancing else 0
             
-            edema_volume_mm3 = edema_voxels * voxel_volume_mm3
-            enhancing_volume_mm3 = enhancing_voxels * voxel_volume_mm3
+            edema_volume_mm3 = edema["volume_mm3"] if edema else 0.0
+            enhancing_volume_mm3 = enhancing["volume_mm3"] if enhancing else 0.0
             total_volume_mm3 = edema_volume_mm3 + enhancing_volume_mm3
             
+            # Connected lesions over edema + enhancing tumor
+            lesions = analyze_lesions(segmentation, spacing)
+            
             # Convert to cm³
             edema_volume_cm3 = edema_volume_mm3 / 1000
             enhancing_volume_cm3 = enhancing_volume_mm3 / 1000
@@ -134,10 +133,11 @@ class RealBrainSegmentor:
                 "enhancing_tumor_volume_cm3": round(enhancing_volume_cm3, 2),
                 "edema_volume_cm3": round(edema_volume_cm3, 2),
                 "total_voxels": int(edema_voxels + enhancing_voxels),
-                "tumor_regions_detected": 2 if enhancing_voxels > 0 else 1,
+                "tumor_regions_detected": lesions["count"],
+                "lesions": lesions["lesions"],
                 "confidence_score": round(confidence, 2),
                 "detection_status": "Tumor Detected" if total_volume_cm3 > 0.1 else "No Significant Tumor",
-                "tumor_location": self.estimate_tumor_location(segmentation),
+                "tumor_location": self.estimate_tumor_location(segmentation, region_stats),
                 "voxel_spacing_mm": spacing,
                 "data_source": "Real MRI Analysis"
             }
@@ -146,22 +146,20 @@ class RealBrainSegmentor:
             print(f"❌ Metrics calculation failed: {e}")
             return self.get_fallback_metrics()
     
-    def estimate_tumor_location(self, segmentation):
+    def estimate_tumor_location(self, segmentation, region_stats=None):
         """Estimate tumor location in brain"""
         try:
-            # Find tumor center of mass
-            tumor_mask = (segmentation > 0).astype(np.float32)
-            if np.sum(tumor_mask) == 0:
+            # Find tumor center of mass (reuses the metrics pass when given)
+            if region_stats is None:
+                region_stats = compute_region_stats(segmentation)
+            tumor = region_stats["foreground"]
+            if tumor is None:
                 return "No tumor detected"
             
-            # Calculate center of mass
-            z, y, x = np.indices(tumor_mask.shape)
-            center_z = np.sum(z * tumor_mask) / np.sum(tumor_mask)
-            center_y = np.sum(y * tumor_mask) / np.sum(tumor_mask) 
-            center_x = np.sum(x * tumor_mask) / np.sum(tumor_mask)
+            center_z, center_y, center_x = tumor["centroid"]
             
             # Simple brain quadrant estimation
-            shape = tumor_mask.shape
+            shape = region_stats["shape"]
             if center_x < shape[2] / 2:
                 hemisphere = "Left"
             else:
@@ -0,0 +1,81 @@
+import numpy as np
+
+from postprocessing import as_mask_array
+
+# Depth slices scanned per step; bounds the index temporaries to one slab
+SLAB_DEPTH = 16
+
+
+def describe_location(centroid, shape):
+    """Quadrant labels for a (z, y, x) centroid, e.g. ('Anterior', 'Superior', 'Left')"""
+    z, y, x = centroid
+    return (
+        "Anterior" if z < shape[0] / 2 else "Posterior",
+        "Superior" if y < shape[1] / 2 else "Inferior",
+        "Left" if x < shape[2] / 2 else "Right",
+    )
+
+
+def _region_from_histograms(label, hists, shape, spacing):
+    counts = hists[0].sum()
+    if counts == 0:
+        return None
+    centroid, bbox_min, bbox_max = [], [], []
+    for axis_hist in hists:
+        occupied = np.flatnonzero(axis_hist)
+        centroid.append(float(np.dot(axis_hist, np.arange(axis_hist.size)) / counts))
+        bbox_min.append(int(occupied[0]))
+        bbox_max.append(int(occupied[-1]))
+    volume_mm3 = float(counts) * float(np.prod(spacing))
+    return {
+        "label": label,
+        "voxels": int(counts),
+        "volume_mm3": round(volume_mm3, 3),
+        "volume_cm3": round(volume_mm3 / 1000, 4),
+        "centroid": centroid,
+        "centroid_mm": [c * s for c, s in zip(centroid, spacing)],
+        "bbox": {"min": bbox_min, "max": bbox_max},
+        "quadrant": describe_location(centroid, shape),
+    }
+
+
+def compute_region_stats(mask, spacing=(1.0, 1.0, 1.0)):
+    """
+    Per-label voxel counts, centroids, bounding boxes, volumes and quadrants in one pass.
+
+    The mask (uint8 labels or a PackedMask) is scanned once, slab by slab;
+    for the foreground voxels of each slab the per-label histograms along
+    z, y and x are accumulated with np.bincount. Counts, centroids and
+    bounding boxes all follow from those three small histograms, so no
+    full-size coordinate or float copies of the volume are ever made.
+
+    Returns {"shape", "spacing", "labels": {label: stats}, "foreground": stats}
+    where "foreground" merges every non-zero label. Boxes are inclusive, in
+    voxel indices; centroids are (z, y, x).
+    """
+    mask = as_mask_array(mask)
+    shape = mask.shape
+    num_labels = int(mask.max()) + 1 if mask.size else 1
+    hists = [np.zeros((num_labels, n), dtype=np.int64) for n in shape]
+
+    for z0 in range(0, shape[0], SLAB_DEPTH):
+        slab = mask[z0:z0 + SLAB_DEPTH]
+        zi, yi, xi = np.nonzero(slab)
+        if zi.size == 0:
+            continue
+        labels = slab[zi, yi, xi].astype(np.intp)
+        for hist, coords, n in zip(hists, (zi + z0, yi, xi), shape):
+            hist += np.bincount(labels * n + coords, minlength=num_labels * n).reshape(num_labels, n)
+
+    regions = {}
+    for label in range(1, num_labels):
+        region = _region_from_histograms(label, [h[label] for h in hists], shape, spacing)
+        if region is not None:
+            regions[label] = region
+
+    return {
+        "shape": shape,
+        "spacing": tuple(spacing),
+        "labels": regions,
+        "foreground": _region_from_histograms(None, [h[1:].sum(axis=0) for h in hists], shape, spacing),
+    }
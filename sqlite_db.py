@@ -0,0 +1,19 @@
+import sqlite3
+from contextlib import contextmanager
+
+
+@contextmanager
+def connect(path):
+    """
+    Short-lived autocommit SQLite connection in WAL mode: readers never
+    block the writer, and each statement is committed when it returns
+    (wrap multi-statement writes in BEGIN / COMMIT).
+    """
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        yield connection
+    finally:
+        connection.close()
@@ -0,0 +1,35 @@
+import threading
+import time
+
+import torch
+
+from inference_scheduler import MicroBatchScheduler
+
+
+def test_multi_sample_requests_do_not_overflow_the_batch():
+    forward_sizes = []
+    release = threading.Event()
+
+    def forward(inputs):
+        # The first forward blocks so the other requests queue up behind it
+        release.wait(5)
+        forward_sizes.append(inputs.shape[0])
+        return inputs * 2
+
+    scheduler = MicroBatchScheduler(forward, max_batch_size=4, max_wait_ms=50)
+    try:
+        first = scheduler.submit(torch.zeros(1, 1, 2, 2, 2))
+        time.sleep(0.2)
+        # 3 + 3 samples would be a batch of 6 if the size were only checked before appending
+        futures = [scheduler.submit(torch.full((3, 1, 2, 2, 2), float(i))) for i in range(2)]
+        release.set()
+        first.result(timeout=5)
+        results = [future.result(timeout=5) for future in futures]
+    finally:
+        scheduler.shutdown()
+
+    assert max(forward_sizes) <= 4
+    assert sum(forward_sizes) == 7
+    for i, result in enumerate(results):
+        assert result.shape[0] == 3
+        assert torch.equal(result, torch.full((3, 1, 2, 2, 2), 2.0 * i))
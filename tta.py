@@ -0,0 +1,36 @@
+import torch
+
+# Spatial flips of an (N, C, D, H, W) tensor, in the order views are added
+FLIP_VIEWS = [(), (2,), (3,), (4,), (2, 3), (2, 4), (3, 4), (2, 3, 4)]
+MAX_TTA_VIEWS = len(FLIP_VIEWS)
+
+
+def tta_logits(forward, input_tensor, views=4, max_batch=None):
+    """
+    Flip test-time augmentation with one batched forward pass.
+
+    The first `views` flips of the (N, C, D, H, W) input are concatenated
+    along the batch axis and run together; each view's logits are flipped
+    back and added into a running sum, so the per-view outputs are never
+    stacked a second time. With `max_batch`, views are split over several
+    forward passes of at most that many items (at least one view each).
+    Returns the mean logits, shape (N, classes, ...).
+    """
+    if not 1 <= views <= MAX_TTA_VIEWS:
+        raise ValueError(f"tta views must be between 1 and {MAX_TTA_VIEWS}")
+    flips = FLIP_VIEWS[:views]
+    if views == 1:
+        return forward(input_tensor)
+
+    n = input_tensor.shape[0]
+    per_pass = views if max_batch is None else max(1, max_batch // n)
+    total = None
+    for start in range(0, views, per_pass):
+        group = flips[start:start + per_pass]
+        batch = torch.cat([input_tensor.flip(dims) if dims else input_tensor for dims in group])
+        outputs = forward(batch)
+        for i, dims in enumerate(group):
+            view = outputs[i * n:(i + 1) * n]
+            view = view.flip(dims) if dims else view
+            total = view.float().clone() if total is None else total.add_(view)
+    return total.div_(views)
@@ -0,0 +1,222 @@
+import json
+import os
+
+import numpy as np
+import trimesh
+from scipy import ndimage
+from skimage import measure
+
+from mesh_export import PreparedMesh, write_obj
+from postprocessing import mask_bounding_box
+
+# Background voxels kept around the tumor bounding box before marching cubes
+MESH_MARGIN = 2
+# (level, fraction of the full-resolution triangle count), most detailed first
+LOD_LEVELS = (("full", 1.0), ("medium", 0.25), ("low", 0.05))
+# Grid coarsening per attempt when decimating by re-meshing (faces fall about with its square),
+# then bisection steps between the last grid over budget and the first one under it
+REMESH_SCALE_STEP = 1.15
+REMESH_REFINE_STEPS = 3
+
+
+def mask_grid_spacing(original_shape, mask_shape, voxel_spacing=None):
+    """
+    Physical spacing of the mask grid. The mask may be resampled from the
+    study (e.g. to the training grid), so each axis is stretched by
+    original / mask size; without a known voxel spacing the mask grid is unit.
+    """
+    if voxel_spacing is None:
+        return (1.0, 1.0, 1.0)
+    return tuple(float(s) * o / m for s, o, m in zip(voxel_spacing, original_shape, mask_shape))
+
+
+def crop_to_roi(binary_mask, margin=MESH_MARGIN):
+    """
+    Crop a binary mask to its bounding box plus `margin`, padded by one empty
+    voxel so surfaces touching the volume border are closed. Returns
+    (crop, offset) where offset is the crop origin in full-volume voxels, or
+    (None, None) for an empty mask.
+    """
+    bbox = mask_bounding_box(binary_mask)
+    if bbox is None:
+        return None, None
+    lo = [max(0, v - margin) for v in bbox[0]]
+    hi = [min(s, v + margin) for v, s in zip(bbox[1], binary_mask.shape)]
+    crop = binary_mask[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+    return np.pad(crop.astype(np.uint8), 1), np.array(lo) - 1
+
+
+def roi_marching_cubes(binary_mask, spacing=(1.0, 1.0, 1.0), margin=MESH_MARGIN, step_size=1, scale=1.0):
+    """
+    Marching cubes over the tumor's bounding box only. Vertices are in
+    physical units of the full volume (voxel index * spacing), so meshes from
+    different crops and levels line up. scale > 1 resamples the ROI to a grid
+    that much coarser first (any real factor, unlike step_size). Returns
+    (verts, faces, normals), or empty arrays when the mask has no foreground.
+    """
+    crop, offset = crop_to_roi(binary_mask, margin)
+    if crop is None:
+        return np.empty((0, 3), np.float32), np.empty((0, 3), np.int64), np.empty((0, 3), np.float32)
+    grid_spacing = np.asarray(spacing, dtype=np.float64)
+    if scale > 1.0:
+        coarse = ndimage.zoom(crop.astype(np.float32), 1.0 / scale, order=1)
+        grid_spacing = grid_spacing * (np.array(crop.shape) - 1) / np.maximum(np.array(coarse.shape) - 1, 1)
+        crop = coarse
+    verts, faces, normals, _ = measure.marching_cubes(crop, level=0.5, spacing=tuple(grid_spacing),
+                                                      step_size=step_size)
+    verts += offset * np.asarray(spacing, dtype=verts.dtype)
+    return verts, faces, normals
+
+
+def decimate(binary_mask, verts, faces, ratio, spacing=(1.0, 1.0, 1.0), margin=MESH_MARGIN):
+    """
+    Reduce a mesh to about `ratio` of its triangles. Uses quadric decimation
+    when trimesh's simplification backend is installed; otherwise re-runs
+    marching cubes on a coarser resampled grid. Triangles fall roughly with
+    the square of the coarsening, so the search starts a little below
+    ratio ** -0.5 and coarsens by REMESH_SCALE_STEP until the measured count
+    first drops under the budget, then bisects back towards it. Returns
+    (verts, faces, method).
+    """
+    target_faces = max(4, int(len(faces) * ratio))
+    try:
+        mesh = trimesh.Trimesh(vertices=verts, faces=faces, process=False)
+        simplified = mesh.simplify_quadric_decimation(face_count=target_faces)
+        return np.asarray(simplified.vertices, dtype=np.float32), np.asarray(simplified.faces), "quadric"
+    except (ImportError, ValueError) as e:
+        print(f"⚠️  Quadric decimation unavailable ({e}), using a coarser marching cubes step")
+
+    def remesh(scale):
+        try:
+            return roi_marching_cubes(binary_mask, spacing, margin, scale=scale)[:2]
+        except (RuntimeError, ValueError):
+            # The ROI is too small for this grid
+            return None
+
+    over, scale = 1.0, max(1.0, 0.8 * ratio ** -0.5)
+    while True:
+        best = remesh(scale)
+        if best is None:
+            return verts, faces, "none"
+        if len(best[1]) <= target_faces:
+            break
+        over, scale = scale, scale * REMESH_SCALE_STEP
+    under = scale
+    for _ in range(REMESH_REFINE_STEPS):
+        mid = (over * under) ** 0.5
+        candidate = remesh(mid)
+        if candidate is not None and len(candidate[1]) <= target_faces:
+            best, under = candidate, mid
+        else:
+            over = mid
+    return best[0], best[1], f"remesh_scale={under:.2f}"
+
+
+def _level_path(output_dir, basename, level, ratio):
+    name = basename if ratio >= 1.0 else f"{basename}_{level}"
+    return os.path.join(output_dir, f"{name}.obj")
+
+
+def _build_levels(binary_mask, verts, faces, output_dir, basename, spacing, levels, margin, meshes):
+    """Decimate and write each level; returns their manifest entries and fills `meshes`"""
+    entries = []
+    for level, ratio in levels:
+        level_verts, level_faces, method = verts, faces, "marching_cubes"
+        if ratio < 1.0 and len(faces):
+            level_verts, level_faces, method = decimate(binary_mask, verts, faces, ratio, spacing, margin)
+        path = _level_path(output_dir, basename, level, ratio)
+        # Written aside and renamed, so a reader never sees a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        write_obj(PreparedMesh(level_verts, level_faces), tmp_path)
+        os.replace(tmp_path, path)
+        meshes[level] = (level_verts, level_faces)
+        entries.append({
+            "level": level,
+            "ratio": ratio,
+            "path": path,
+            "vertices": int(len(level_verts)),
+            "faces": int(len(level_faces)),
+            "bytes": os.path.getsize(path),
+            "method": method,
+        })
+    return entries
+
+
+def _write_manifest(manifest):
+    manifest_path = manifest["manifest_path"]
+    with open(manifest_path, "w") as f:
+        json.dump({k: v for k, v in manifest.items() if k not in ("manifest_path", "pending")}, f, indent=2)
+
+
+def build_mesh_lods(binary_mask, output_dir, basename, spacing=(1.0, 1.0, 1.0),
+                    levels=LOD_LEVELS, margin=MESH_MARGIN, executor=None, futures=None):
+    """
+    Extract the tumor surface once at full resolution and decimate it to each
+    level of detail. Every level is written as `{basename}_{level}.obj`
+    ("full" keeps the plain `{basename}.obj` name) next to a
+    `{basename}_lods.json` manifest listing paths, triangle counts and file
+    sizes, so AR and web clients can fetch the cheapest mesh that fits.
+
+    With an `executor`, the reduced levels (and the manifest file) are built on
+    it after this returns: their manifest entries only hold paths, "pending"
+    is True, and the future is added to the `futures` dict for complete_lods.
+    Without quadric decimation each reduced level re-runs marching cubes, so
+    this keeps them off the request path.
+
+    Returns (manifest, meshes) where meshes maps level -> (verts, faces) for
+    the levels built so far.
+    """
+    binary_mask = np.asarray(binary_mask) > 0
+    verts, faces, _ = roi_marching_cubes(binary_mask, spacing, margin)
+    bbox = mask_bounding_box(binary_mask)
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest = {
+        "basename": basename,
+        "spacing": [float(s) for s in spacing],
+        "roi": {"min": bbox[0], "max": bbox[1]} if bbox else None,
+        "levels": [],
+        "manifest_path": os.path.join(output_dir, f"{basename}_lods.json"),
+        "pending": False,
+    }
+    meshes = {}
+    full_levels = [(level, ratio) for level, ratio in levels if ratio >= 1.0]
+    reduced_levels = [(level, ratio) for level, ratio in levels if ratio < 1.0]
+    args = (binary_mask, verts, faces, output_dir, basename, spacing)
+    if executor is None or not reduced_levels:
+        manifest["levels"] = _build_levels(*args, levels, margin, meshes)
+        _write_manifest(manifest)
+        return manifest, meshes
+
+    built = _build_levels(*args, full_levels, margin, meshes)
+    base = dict(manifest)
+
+    def build_reduced():
+        entries = _build_levels(*args, reduced_levels, margin, {})
+        _write_manifest(dict(base, levels=_merge_levels(levels, built + entries)))
+        return entries
+
+    future = executor.submit(build_reduced)
+    future.add_done_callback(
+        lambda f: f.exception() is not None and print(f"❌ Background LOD build failed: {f.exception()}"))
+    if futures is not None:
+        futures[manifest["manifest_path"]] = future
+    pending = [{"level": level, "ratio": ratio, "path": _level_path(output_dir, basename, level, ratio)}
+               for level, ratio in reduced_levels]
+    manifest["levels"] = _merge_levels(levels, built + pending)
+    manifest["pending"] = True
+    return manifest, meshes
+
+
+def _merge_levels(levels, entries):
+    by_level = {entry["level"]: entry for entry in entries}
+    return [by_level[level] for level, _ in levels]
+
+
+def complete_lods(manifest, futures):
+    """A pending build_mesh_lods manifest with its reduced levels filled in from the finished future"""
+    if not manifest.get("pending"):
+        return manifest
+    built = futures[manifest["manifest_path"]].result()
+    levels = [(entry["level"], entry["ratio"]) for entry in manifest["levels"]]
+    return dict(manifest, levels=_merge_levels(levels, manifest["levels"] + built), pending=False)
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tarfile
+import zipfile
+
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+# Zip/tar bombs: cap the total bytes and members unpacked from one archive
+MAX_ARCHIVE_MEMBERS = 5000
+
+
+def upload_too_large(max_bytes):
+    return HTTPException(status_code=413, detail=f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+
+
+class UploadLimitMiddleware:
+    """
+    Reject oversized uploads before the body is received: a Content-Length
+    over the limit gets a 413 straight away, and bodies without one (or
+    that lie about it) are counted chunk by chunk as the multipart parser
+    pulls them, failing with a 413 as soon as the limit is crossed.
+    """
+
+    def __init__(self, app, max_bytes, paths=("/api/segment",)):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse({"detail": upload_too_large(self.max_bytes).detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise upload_too_large(self.max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def is_archive(filename, fileobj):
+    """Series uploads come as zip or tar archives; anything else is a single image file"""
+    name = (filename or "").lower()
+    if name.endswith(ARCHIVE_SUFFIXES):
+        return True
+    position = fileobj.tell()
+    try:
+        return zipfile.is_zipfile(fileobj)
+    finally:
+        fileobj.seek(position)
+
+
+def _copy_member(source, destination, budget):
+    """Copy one archive member in bounded chunks; returns bytes written, failing past `budget`"""
+    written = 0
+    with open(destination, "wb") as out:
+        for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+            written += len(chunk)
+            if written > budget:
+                raise upload_too_large(budget)
+            out.write(chunk)
+    return written
+
+
+def extract_archive(fileobj, filename, output_dir, max_bytes):
+    """
+    Unpack a zip or tar series member by member into output_dir.
+
+    Members are streamed in bounded chunks (tar in pure streaming mode, so
+    the archive is read once front to back) and written under generated
+    names, which keeps archive paths from escaping output_dir. At most
+    `max_bytes` are unpacked in total. Returns the number of files written.
+    """
+    fileobj.seek(0)
+    remaining = max_bytes
+    count = 0
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                if count >= MAX_ARCHIVE_MEMBERS or member.file_size > remaining:
+                    raise upload_too_large(max_bytes)
+                with archive.open(member) as source:
+                    remaining -= _copy_member(source, os.path.join(output_dir, f"{count:05d}.dcm"), remaining)
+                count += 1
+    else:
+        fileobj.seek(0)
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                if count >= MAX_ARCHIVE_MEMBERS or member.size > remaining:
+                    raise upload_too_large(max_bytes)
+                source = archive.extractfile(member)
+                remaining -= _copy_member(source, os.path.join(output_dir, f"{count:05d}.dcm"), remaining)
+                count += 1
+    print(f"📦 Unpacked {count} files from {filename}")
+    return count
+
+
+def remove_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,115 @@
+import filecmp
+import os
+import shutil
+
+import numpy as np
+import plotly
+
+from mesh_export import mesh_exporter
+
+VIEWER_DIR = os.path.join("static", "viewer")
+# The plotly.js bundled with the Python package, served next to the shell (no CDN)
+PLOTLY_BUNDLE = os.path.join(os.path.dirname(plotly.__file__), "package_data", "plotly.min.js")
+PLOTLY_SCRIPT = "plotly.min.js"
+
+# Emitted once per deployment; every study reuses it as /static/viewer/index.html?study=<key>
+VIEWER_SHELL = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>NeuroVision 3D Viewer</title>
+<script src="%(plotly)s"></script>
+<style>html, body, #plot { margin: 0; width: 100%%; height: 100%%; }</style>
+</head>
+<body>
+<div id="plot"></div>
+<script>
+// Decodes the NVM1 buffers written by mesh_export.mesh_buffer
+async function loadMesh(url) {
+  const response = await fetch(url);
+  if (!response.ok) return null;
+  const buffer = await response.arrayBuffer();
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== "NVM1") throw new Error("Unknown mesh format: " + magic);
+  const vertexCount = view.getUint32(4, true);
+  const indexCount = view.getUint32(8, true);
+  const indexBytes = view.getUint32(12, true);
+  const origin = [view.getFloat32(16, true), view.getFloat32(20, true), view.getFloat32(24, true)];
+  const step = view.getFloat32(28, true);
+
+  const positions = new Uint16Array(buffer, 32, vertexCount * 3);
+  const indexOffset = 32 + Math.ceil(vertexCount * 6 / 4) * 4;
+  const indices = indexBytes === 2 ? new Uint16Array(buffer, indexOffset, indexCount)
+                                   : new Uint32Array(buffer, indexOffset, indexCount);
+  const axes = [new Float32Array(vertexCount), new Float32Array(vertexCount), new Float32Array(vertexCount)];
+  for (let v = 0; v < vertexCount; v++) {
+    for (let a = 0; a < 3; a++) axes[a][v] = positions[v * 3 + a] * step + origin[a];
+  }
+  const triangles = indexCount / 3;
+  const corners = [new Uint32Array(triangles), new Uint32Array(triangles), new Uint32Array(triangles)];
+  for (let t = 0; t < triangles; t++) {
+    for (let c = 0; c < 3; c++) corners[c][t] = indices[t * 3 + c];
+  }
+  return {x: axes[0], y: axes[1], z: axes[2], i: corners[0], j: corners[1], k: corners[2]};
+}
+
+async function main() {
+  const study = new URLSearchParams(window.location.search).get("study");
+  const [tumor, brain] = await Promise.all([
+    loadMesh(`/api/meshes/${study}/tumor_3d`),
+    loadMesh(`/api/meshes/${study}/brain`),
+  ]);
+  const traces = [];
+  if (tumor) traces.push({type: "mesh3d", ...tumor, opacity: 1.0, color: "red", name: "Tumor"});
+  if (brain) traces.push({type: "mesh3d", ...brain, opacity: 0.2, color: "lightpink", name: "Brain"});
+  Plotly.newPlot("plot", traces, {
+    title: "3D Tumor in Generated Brain",
+    scene: {xaxis: {title: "X"}, yaxis: {title: "Y"}, zaxis: {title: "Z"}, aspectmode: "data"},
+  });
+}
+main();
+</script>
+</body>
+</html>
+""" % {"plotly": PLOTLY_SCRIPT}
+
+
+def _copy_plotly(viewer_dir):
+    path = os.path.join(viewer_dir, PLOTLY_SCRIPT)
+    if os.path.exists(path) and filecmp.cmp(PLOTLY_BUNDLE, path, shallow=False):
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.copyfile(PLOTLY_BUNDLE, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_viewer_shell(viewer_dir=VIEWER_DIR):
+    """Write the viewer page and its plotly.js once; later calls leave up-to-date files untouched"""
+    path = os.path.join(viewer_dir, "index.html")
+    os.makedirs(viewer_dir, exist_ok=True)
+    _copy_plotly(viewer_dir)
+    try:
+        with open(path) as f:
+            if f.read() == VIEWER_SHELL:
+                return path
+    except OSError:
+        pass
+    with open(path, "w") as f:
+        f.write(VIEWER_SHELL)
+    return path
+
+
+def viewer_url(key):
+    return f"/static/viewer/index.html?study={key}"
+
+
+def export_brain_buffer(brain_verts, brain_faces, tumor_verts, output_dir, wait=True, futures=None):
+    """
+    Binary brain buffer for the viewer (the tumor's comes from the pipeline's
+    mesh export), centered on the tumor as in visualize_3d_tumor.
+    """
+    brain_verts = np.asarray(brain_verts)
+    brain_verts = brain_verts - brain_verts.mean(axis=0) + np.asarray(tumor_verts).mean(axis=0)
+    return mesh_exporter.export(brain_verts, brain_faces, output_dir, "brain", formats=("bin",), wait=wait,
+                                  futures=futures)
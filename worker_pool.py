@@ -0,0 +1,168 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from starlette.responses import JSONResponse, Response
+
+from artifact_store import json_default
+
+
+class PipelineBusy(Exception):
+    """Every worker is busy and the wait queue is full; retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Pipeline queue is full, retry in {retry_after} s")
+        self.retry_after = retry_after
+
+
+def tune_torch_threads(workers, threads=None):
+    """
+    Split the cores between concurrent pipelines: each torch op uses
+    cpu_count // workers intra-op threads, so `workers` studies running at
+    once do not oversubscribe the machine. Returns the thread count.
+    """
+    threads = threads or max(1, (os.cpu_count() or 1) // max(1, workers))
+    torch.set_num_threads(threads)
+    return threads
+
+
+class PipelinePool:
+    """
+    Run blocking pipeline jobs off the event loop on a fixed set of threads.
+
+    Threads rather than processes: the models live once in this process
+    (shared registry, micro-batching scheduler) and torch, numpy and
+    skimage release the GIL in their heavy loops. At most `workers` jobs run
+    and `max_queue` more wait; submit() raises PipelineBusy beyond that, with
+    a Retry-After estimate from recent job durations.
+    """
+
+    def __init__(self, workers=2, max_queue=8, latency_window=50):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._durations = deque(maxlen=latency_window)
+
+    def full(self):
+        with self._lock:
+            return self._pending >= self.workers + self.max_queue
+
+    def has_idle_worker(self):
+        with self._lock:
+            return self._pending < self.workers
+
+    def retry_after(self):
+        """Seconds until a slot is likely free: queued jobs ahead / workers * mean job time"""
+        with self._lock:
+            mean = sum(self._durations) / len(self._durations) if self._durations else 1.0
+            waves = max(1, self._pending - self.workers + 1) / self.workers
+        return max(1, math.ceil(mean * waves))
+
+    def reject(self):
+        """Count a request turned away and return its Retry-After"""
+        with self._lock:
+            self._rejected += 1
+        return self.retry_after()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs); returns a concurrent Future or raises PipelineBusy"""
+        with self._lock:
+            full = self._pending >= self.workers + self.max_queue
+            if not full:
+                self._pending += 1
+        if full:
+            raise PipelineBusy(self.reject())
+        return self._executor.submit(self._run, fn, args, kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) on the pool without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _run(self, fn, args, kwargs):
+        start = time.perf_counter()
+        with self._lock:
+            self._running += 1
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._running -= 1
+                self._durations.append(time.perf_counter() - start)
+                if ok:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "mean_job_ms": round(sum(self._durations) / len(self._durations) * 1000, 1) if self._durations else None,
+                "torch_threads": torch.get_num_threads(),
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def json_response(content, status_code=200):
+    """
+    JSON response rendered by the caller's thread. Pool jobs return this so
+    large results (contours, mesh manifests) are serialized on the worker
+    rather than by FastAPI's encoder on the event loop.
+    """
+    body = json.dumps(content, default=json_default, separators=(",", ":"))
+    return Response(body, status_code=status_code, media_type="application/json")
+
+
+def busy_response(retry_after):
+    return JSONResponse({"detail": "Server is busy processing other studies, please retry later"},
+                        status_code=429, headers={"Retry-After": str(retry_after)})
+
+
+class PipelineBusyMiddleware:
+    """
+    Answer 429 + Retry-After without parsing or spooling the upload when
+    the pipeline queue is already full. The body is read and dropped chunk
+    by chunk first, since closing on a client mid-upload resets the
+    connection before it sees the 429. The handler's own submit() stays
+    the authority; this is only the early exit.
+    """
+
+    def __init__(self, app, pool, paths=("/api/segment",)):
+        self.app = app
+        self.pool = pool
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"].startswith(self.paths) \
+                and self.pool.full():
+            retry_after = self.pool.reject()
+            message = {"more_body": True}
+            while message.get("more_body") and message.get("type", "http.request") == "http.request":
+                message = await receive()
+            await busy_response(retry_after)(scope, receive, send)
+            return
+        await self.app(scope, receive, send)